@@ -64,24 +64,74 @@ class TaskDB(object):
 
     projects = set()  # projects in taskdb
 
+    # max number of taskids looked up in one query by get_tasks
+    GET_TASKS_CHUNK = 500
+
     def load_tasks(self, status, project=None, fields=None):
         raise NotImplementedError
 
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        '''
+        load one page of tasks in status of project, return (tasks, cursor)
+
+        pass the returned cursor to get the next page, cursor is None when there is
+        no more page. pages are read by keyset, so it's safe to write the taskdb
+        between pages.
+        '''
+        raise NotImplementedError
+
     def get_task(self, project, taskid, fields=None):
         raise NotImplementedError
 
+    def get_tasks(self, project, taskids, fields=None):
+        '''
+        bulk version of get_task, yield the tasks found in taskids
+
+        order of yielded tasks is not guaranteed and missing taskids are skipped,
+        include `taskid` in fields when the caller needs to match them back.
+        backends should overwrite this with a batched query.
+        '''
+        for taskid in taskids:
+            task = self.get_task(project, taskid, fields=fields)
+            if task:
+                yield task
+
     def status_count(self, project):
         '''
         return a dict
         '''
         raise NotImplementedError
 
+    def last_updatetime(self, project):
+        '''
+        latest updatetime of tasks in project, None when project has no task
+
+        tells whether taskdb is changed since a time, backends without it raise
+        NotImplementedError.
+        '''
+        raise NotImplementedError
+
     def insert(self, project, taskid, obj={}):
         raise NotImplementedError
 
     def update(self, project, taskid, obj={}, **kwargs):
         raise NotImplementedError
 
+    def insert_many(self, project, tasks):
+        '''
+        insert a batch of (taskid, obj) tasks
+
+        backends should overwrite this to write the batch in one transaction
+        or round-trip.
+        '''
+        for taskid, obj in tasks:
+            self.insert(project, taskid, obj)
+
+    def update_many(self, project, tasks):
+        '''update a batch of (taskid, obj) tasks, see insert_many'''
+        for taskid, obj in tasks:
+            self.update(project, taskid, obj)
+
     def drop(self, project):
         raise NotImplementedError
 
@@ -8,6 +8,7 @@
 
 
 import logging
+import contextlib
 logger = logging.getLogger('database.basedb')
 
 
@@ -38,6 +39,22 @@ class BaseDB:
         dbcur.execute(sql_query, values)
         return dbcur
 
+    def _executemany(self, sql_query, values_list):
+        dbcur = self.dbcur
+        dbcur.executemany(sql_query, values_list)
+        return dbcur
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._execute('BEGIN')
+        try:
+            yield
+        except Exception:
+            self._execute('ROLLBACK')
+            raise
+        else:
+            self._execute('COMMIT')
+
     def _select(self, tablename=None, what="*", where="", where_values=[], offset=0, limit=None):
         tablename = self.escape(tablename or self.__tablename__)
         if isinstance(what, list) or isinstance(what, tuple) or what is None:
@@ -113,6 +130,37 @@ class BaseDB:
             dbcur = self._execute(sql_query)
         return dbcur.lastrowid
 
+    def _insert_many(self, tablename=None, values_list=[]):
+        '''insert rows of dict, rows with the same columns are sent in one executemany'''
+        tablename = self.escape(tablename or self.__tablename__)
+        groups = {}
+        for values in values_list:
+            groups.setdefault(tuple(values), []).append(list(values.values()))
+        for keys, rows in groups.items():
+            _keys = ", ".join(self.escape(k) for k in keys)
+            _values = ", ".join([self.placeholder, ] * len(keys))
+            sql_query = "INSERT INTO %s (%s) VALUES (%s)" % (tablename, _keys, _values)
+            logger.debug("<sql: %s> x %d", sql_query, len(rows))
+            self._executemany(sql_query, rows)
+
+    def _update_many(self, tablename=None, where="1=0", values_list=[]):
+        '''
+        update rows with a list of (values, where_values),
+        rows with the same columns are sent in one executemany
+        '''
+        tablename = self.escape(tablename or self.__tablename__)
+        groups = {}
+        for values, where_values in values_list:
+            groups.setdefault(tuple(values), []).append(
+                list(values.values()) + list(where_values))
+        for keys, rows in groups.items():
+            _key_values = ", ".join([
+                "%s = %s" % (self.escape(k), self.placeholder) for k in keys
+            ])
+            sql_query = "UPDATE %s SET %s WHERE %s" % (tablename, _key_values, where)
+            logger.debug("<sql: %s> x %d", sql_query, len(rows))
+            self._executemany(sql_query, rows)
+
     def _update(self, tablename=None, where="1=0", where_values=[], **values):
         tablename = self.escape(tablename or self.__tablename__)
         _key_values = ", ".join([
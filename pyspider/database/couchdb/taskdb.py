@@ -64,6 +64,22 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             return None
         return ret[0]
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        if fields is None:
+            fields = []
+        collection_name = self._get_collection_name(project)
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            chunk = taskids[i:i + self.GET_TASKS_CHUNK]
+            for task in self.get_docs(collection_name, {"selector": {"taskid": {"$in": chunk}},
+                                                        "fields": fields,
+                                                        "limit": len(chunk)}):
+                yield task
+
     def status_count(self, project):
         if project not in self.projects:
             self._list_project()
@@ -79,6 +79,18 @@ class TaskDB(BaseTaskDB):
                           _source_include=fields or [], ignore=404)
         return self._parse(ret.get('_source', None))
 
+    def get_tasks(self, project, taskids, fields=None):
+        if self._changed:
+            self.refresh()
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            ids = ["%s:%s" % (project, taskid) for taskid in taskids[i:i + self.GET_TASKS_CHUNK]]
+            ret = self.es.mget(index=self.index, doc_type=self.__type__, body={'ids': ids},
+                               _source_include=fields or [])
+            for doc in ret.get('docs', []):
+                if doc.get('found'):
+                    yield self._parse(doc['_source'])
+
     def status_count(self, project):
         self.refresh()
         ret = self.es.search(index=self.index, doc_type=self.__type__,
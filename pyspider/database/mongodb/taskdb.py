@@ -8,7 +8,7 @@
 import json
 import time
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from pyspider.database.base.taskdb import TaskDB as BaseTaskDB
 from .mongodbbase import SplitTableMixin
@@ -70,6 +70,23 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             for task in self.database[collection_name].find({'status': status}, fields):
                 yield self._parse(task)
 
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return [], None
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid', ]
+        query = {'status': status}
+        if cursor is not None:
+            query['taskid'] = {'$gt': cursor}
+        collection_name = self._collection_name(project)
+        tasks = [self._parse(task) for task in self.database[collection_name].find(
+            query, fields).sort('taskid', 1).limit(limit)]
+        if len(tasks) < limit:
+            return tasks, None
+        return tasks, tasks[-1]['taskid']
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -81,6 +98,18 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             return ret
         return self._parse(ret)
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        collection_name = self._collection_name(project)
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            chunk = taskids[i:i + self.GET_TASKS_CHUNK]
+            for task in self.database[collection_name].find({'taskid': {'$in': chunk}}, fields):
+                yield self._parse(task)
+
     def status_count(self, project):
         if project not in self.projects:
             self._list_project()
@@ -120,6 +149,16 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             result[each['_id']] = each['total']
         return result
 
+    def last_updatetime(self, project):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return None
+        collection_name = self._collection_name(project)
+        task = self.database[collection_name].find_one(
+            {}, {'updatetime': 1}, sort=[('updatetime', -1)])
+        return task.get('updatetime') if task else None
+
     def insert(self, project, taskid, obj={}):
         if project not in self.projects:
             self._create_project(project)
@@ -139,3 +178,31 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             {"$set": self._stringify(obj)},
             upsert=True
         )
+
+    def insert_many(self, project, tasks):
+        if project not in self.projects:
+            self._create_project(project)
+        now = time.time()
+        requests = []
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['taskid'] = taskid
+            obj['project'] = project
+            obj['updatetime'] = now
+            requests.append(UpdateOne({'taskid': taskid}, {"$set": self._stringify(obj)},
+                                      upsert=True))
+        if requests:
+            collection_name = self._collection_name(project)
+            return self.database[collection_name].bulk_write(requests, ordered=False)
+
+    def update_many(self, project, tasks):
+        now = time.time()
+        requests = []
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            requests.append(UpdateOne({'taskid': taskid}, {"$set": self._stringify(obj)},
+                                      upsert=True))
+        if requests:
+            collection_name = self._collection_name(project)
+            return self.database[collection_name].bulk_write(requests, ordered=False)
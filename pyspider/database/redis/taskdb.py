@@ -101,6 +101,27 @@ class TaskDB(BaseTaskDB):
                 else:
                     yield self._parse(obj)
 
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        # cursor of SSCAN, a task may be returned more than once
+        cursor, taskids = self.redis.sscan(self._gen_status_key(project, status),
+                                           cursor=cursor or 0, count=limit)
+        pipe = self.redis.pipeline(transaction=False)
+        for taskid in taskids:
+            if fields:
+                pipe.hmget(self._gen_key(project, utils.text(taskid)), fields)
+            else:
+                pipe.hgetall(self._gen_key(project, utils.text(taskid)))
+        tasks = []
+        for obj in pipe.execute():
+            if fields:
+                if all(x is None for x in obj):
+                    continue
+                obj = dict(zip(fields, obj))
+            if not obj:
+                continue
+            tasks.append(self._parse(obj))
+        return tasks, (cursor or None)
+
     def get_task(self, project, taskid, fields=None):
         if fields:
             obj = self.redis.hmget(self._gen_key(project, taskid), fields)
@@ -114,6 +135,24 @@ class TaskDB(BaseTaskDB):
             return None
         return self._parse(obj)
 
+    def get_tasks(self, project, taskids, fields=None):
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            pipe = self.redis.pipeline(transaction=False)
+            for taskid in taskids[i:i + self.GET_TASKS_CHUNK]:
+                if fields:
+                    pipe.hmget(self._gen_key(project, taskid), fields)
+                else:
+                    pipe.hgetall(self._gen_key(project, taskid))
+            for obj in pipe.execute():
+                if fields:
+                    if all(x is None for x in obj):
+                        continue
+                    obj = dict(zip(fields, obj))
+                if not obj:
+                    continue
+                yield self._parse(obj)
+
     def status_count(self, project):
         '''
         return a dict
@@ -160,6 +199,36 @@ class TaskDB(BaseTaskDB):
                     pipe.srem(self._gen_status_key(project, status), taskid)
         pipe.execute()
 
+    def insert_many(self, project, tasks):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        if project not in self.projects:
+            pipe.sadd(self.__prefix__ + 'projects', project)
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['taskid'] = taskid
+            obj['project'] = project
+            obj['updatetime'] = now
+            obj.setdefault('status', self.ACTIVE)
+            pipe.hmset(self._gen_key(project, taskid), self._stringify(obj))
+            pipe.sadd(self._gen_status_key(project, obj['status']), taskid)
+        pipe.execute()
+
+    def update_many(self, project, tasks):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            pipe.hmset(self._gen_key(project, taskid), self._stringify(obj))
+            if 'status' in obj:
+                for status in range(1, 5):
+                    if status == obj['status']:
+                        pipe.sadd(self._gen_status_key(project, status), taskid)
+                    else:
+                        pipe.srem(self._gen_status_key(project, status), taskid)
+        pipe.execute()
+
     def drop(self, project):
         self.redis.srem(self.__prefix__ + 'projects', project)
 
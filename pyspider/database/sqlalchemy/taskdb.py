@@ -11,7 +11,7 @@ import json
 import sqlalchemy.exc
 
 from sqlalchemy import (create_engine, MetaData, Table, Column, Index,
-                        Integer, String, Float, Text, func)
+                        Integer, String, Float, Text, func, bindparam)
 from sqlalchemy.engine.url import make_url
 from pyspider.libs import utils
 from pyspider.database.base.taskdb import TaskDB as BaseTaskDB
@@ -103,6 +103,24 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
                                             .where(self.table.c.status == status)):
                 yield self._parse(result2dict(columns, task))
 
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        if project not in self.projects:
+            return [], None
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid', ]
+
+        self.table.name = self._tablename(project)
+        columns = [getattr(self.table.c, f, f) for f in fields] if fields else self.table.c
+        query = self.table.select().with_only_columns(columns).where(
+            self.table.c.status == status)
+        if cursor is not None:
+            query = query.where(self.table.c.taskid > cursor)
+        query = query.order_by(self.table.c.taskid).limit(limit)
+        tasks = [self._parse(result2dict(columns, each)) for each in self.engine.execute(query)]
+        if len(tasks) < limit:
+            return tasks, None
+        return tasks, tasks[-1]['taskid']
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -117,6 +135,22 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
                                         .where(self.table.c.taskid == taskid)):
             return self._parse(result2dict(columns, each))
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+
+        self.table.name = self._tablename(project)
+        columns = [getattr(self.table.c, f, f) for f in fields] if fields else self.table.c
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            chunk = taskids[i:i + self.GET_TASKS_CHUNK]
+            for each in self.engine.execute(self.table.select()
+                                            .with_only_columns(columns)
+                                            .where(self.table.c.taskid.in_(chunk))):
+                yield self._parse(result2dict(columns, each))
+
     def status_count(self, project):
         result = dict()
         if project not in self.projects:
@@ -132,6 +166,17 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             result[status] = count
         return result
 
+    def last_updatetime(self, project):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return None
+
+        self.table.name = self._tablename(project)
+        return self.engine.execute(
+            self.table.select()
+            .with_only_columns((func.max(self.table.c.updatetime), ))).scalar()
+
     def insert(self, project, taskid, obj={}):
         if project not in self.projects:
             self._list_project()
@@ -158,3 +203,49 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
         return self.engine.execute(self.table.update()
                                    .where(self.table.c.taskid == taskid)
                                    .values(**self._stringify(obj)))
+
+    def insert_many(self, project, tasks):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            self._create_project(project)
+            self._list_project()
+        now = time.time()
+        rows = []
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['taskid'] = taskid
+            obj['project'] = project
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        # rows with the same columns are sent in one executemany
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        self.table.name = self._tablename(project)
+        with self.engine.begin() as conn:
+            for rows in groups.values():
+                conn.execute(self.table.insert(), rows)
+
+    def update_many(self, project, tasks):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            raise LookupError
+        now = time.time()
+        groups = {}
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            obj = self._stringify(obj)
+            # names of bindparam can't be the same as columns set
+            row = dict(('_' + k, v) for k, v in obj.items())
+            row['_where_taskid'] = taskid
+            groups.setdefault(tuple(sorted(obj)), []).append(row)
+        self.table.name = self._tablename(project)
+        with self.engine.begin() as conn:
+            for keys, rows in groups.items():
+                conn.execute(self.table.update()
+                             .where(self.table.c.taskid == bindparam('_where_taskid'))
+                             .values(**dict((k, bindparam('_' + k)) for k in keys)),
+                             rows)
@@ -69,6 +69,24 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             for each in self._select2dic(tablename, what=fields, where=where):
                 yield self._parse(each)
 
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        if project not in self.projects:
+            return [], None
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid', ]
+        where = "`status` = %s" % self.placeholder
+        where_values = [status, ]
+        if cursor is not None:
+            where += " AND `taskid` > %s" % self.placeholder
+            where_values.append(cursor)
+        tablename = self._tablename(project)
+        tasks = [self._parse(each) for each in self._select2dic(
+            tablename, what=fields, where=where, where_values=where_values,
+            order='`taskid`', limit=limit)]
+        if len(tasks) < limit:
+            return tasks, None
+        return tasks, tasks[-1]['taskid']
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -82,6 +100,19 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             return self._parse(each)
         return None
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        tablename = self._tablename(project)
+        taskids = list(taskids)
+        for i in range(0, len(taskids), self.GET_TASKS_CHUNK):
+            chunk = taskids[i:i + self.GET_TASKS_CHUNK]
+            where = "`taskid` IN (%s)" % ", ".join([self.placeholder, ] * len(chunk))
+            for each in self._select2dic(tablename, what=fields, where=where, where_values=chunk):
+                yield self._parse(each)
+
     def status_count(self, project):
         '''
         return a dict
@@ -97,6 +128,17 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             result[status] = count
         return result
 
+    def last_updatetime(self, project):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return None
+        tablename = self._tablename(project)
+        for updatetime, in self._execute("SELECT MAX(`updatetime`) FROM %s" %
+                                         self.escape(tablename)):
+            return updatetime
+        return None
+
     def insert(self, project, taskid, obj={}):
         if project not in self.projects:
             self._create_project(project)
@@ -119,3 +161,37 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             tablename, where="`taskid` = %s" % self.placeholder, where_values=(taskid, ),
             **self._stringify(obj)
         )
+
+    def insert_many(self, project, tasks):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            self._create_project(project)
+            self._list_project()
+        tablename = self._tablename(project)
+        now = time.time()
+        rows = []
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['taskid'] = taskid
+            obj['project'] = project
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        with self._transaction():
+            self._insert_many(tablename, rows)
+
+    def update_many(self, project, tasks):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            raise LookupError
+        tablename = self._tablename(project)
+        now = time.time()
+        rows = []
+        for taskid, obj in tasks:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            rows.append((self._stringify(obj), (taskid, )))
+        with self._transaction():
+            self._update_many(tablename, where="`taskid` = %s" % self.placeholder,
+                              values_list=rows)
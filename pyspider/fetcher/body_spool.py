@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import uuid
+import logging
+import tempfile
+
+logger = logging.getLogger('fetcher')
+
+DEFAULT_SPILL_DIR = os.path.join(tempfile.gettempdir(), 'pyspider-spool')
+
+
+class BodySpool(object):
+    '''
+    Bounded buffer of a streamed response body
+
+    Chunks are kept in memory until `spill_size`, larger bodies are written to a
+    file of their own under `spill_dir`, and referenced by `spool://` url
+    instead of being inlined in the fetch result. The file is removed when
+    processor loads the body, see libs.body_store.load_body.
+
+    Bodies over `max_size` are truncated, or aborted when `overflow` is 'abort'.
+    In both cases the transfer is stopped.
+    '''
+
+    def __init__(self, max_size=None, overflow='truncate', spill_size=None, spill_dir=None):
+        self.max_size = max_size
+        self.overflow = overflow
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir or DEFAULT_SPILL_DIR
+        self.buffer = bytearray()
+        self.file = None
+        self.size = 0
+        self.truncated = False
+        self.aborted = False
+        self.status_code = None
+        self.header_lines = []
+
+    @classmethod
+    def for_task(cls, task_fetch, max_size=None, spill_size=None, spill_dir=None):
+        '''spool for fetch options of task, None when body is not limited'''
+        max_size = task_fetch.get('max_body_size', max_size)
+        spill_size = task_fetch.get('spill_body_size', spill_size)
+        if not max_size and not spill_size:
+            return None
+        return cls(max_size, task_fetch.get('body_overflow', 'truncate'), spill_size, spill_dir)
+
+    @property
+    def stopped(self):
+        return self.truncated or self.aborted
+
+    def write(self, chunk):
+        '''append a chunk, return False when transfer should be stopped'''
+        if self.stopped:
+            return False
+        if self.max_size and self.size + len(chunk) > self.max_size:
+            if self.overflow == 'abort':
+                self.aborted = True
+                return False
+            chunk = chunk[:self.max_size - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        if self.file is not None:
+            self.file.write(chunk)
+        else:
+            self.buffer += chunk
+            if self.spill_size and len(self.buffer) > self.spill_size:
+                self._spill()
+        return not self.truncated
+
+    def _spill(self):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=self.spill_dir, prefix='.spool-', delete=False)
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def on_header(self, line):
+        '''header_callback of tornado request, keeps status and headers of stopped transfer'''
+        line = line.strip()
+        if line.startswith('HTTP/'):
+            self.header_lines = []
+            try:
+                self.status_code = int(line.split()[1])
+            except (IndexError, ValueError):
+                pass
+        elif line:
+            self.header_lines.append(line)
+
+    def prepare_curl(self, curl):
+        '''prepare_curl_callback of tornado request, writes body into spool'''
+        import pycurl
+
+        def write(chunk):
+            if not self.write(chunk):
+                # not consuming the chunk makes curl abort with CURLE_WRITE_ERROR
+                return 0
+        curl.setopt(pycurl.WRITEFUNCTION, write)
+
+    def finish(self):
+        '''return (content, content_ref), content_ref is None when body is in memory'''
+        if self.file is None:
+            return bytes(self.buffer), None
+        self.file.close()
+        path = os.path.join(self.spill_dir, uuid.uuid4().hex)
+        os.replace(self.file.name, path)
+        self.file = None
+        return b'', 'spool://' + path
+
+    def discard(self):
+        '''drop the body, e.g. of a redirect'''
+        self.buffer = bytearray()
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.remove(self.file.name)
+            except OSError:
+                pass
+            self.file = None
+
+
+def clear_spool(spill_dir=None, ttl=86400):
+    '''remove spilled bodies never loaded, older than ttl seconds'''
+    spill_dir = spill_dir or DEFAULT_SPILL_DIR
+    if not os.path.isdir(spill_dir):
+        return
+    now = time.time()
+    for name in os.listdir(spill_dir):
+        path = os.path.join(spill_dir, name)
+        try:
+            if now - os.path.getmtime(path) > ttl:
+                os.remove(path)
+        except OSError as e:
+            logger.debug("can't remove spilled body %s: %s", path, e)
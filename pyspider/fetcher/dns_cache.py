@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+import collections
+
+logger = logging.getLogger('fetcher')
+
+try:
+    import dns.asyncresolver
+    import dns.exception
+except ImportError:
+    dns = None
+
+
+class DNSCache(object):
+    '''
+    Fetcher level cache of resolved addresses by host
+
+    Records are kept for their TTL when dnspython is installed, capped by `ttl`,
+    otherwise resolved by getaddrinfo and kept for `ttl`. Failed lookups are
+    cached for `negative_ttl`. Concurrent lookups of a host share one query.
+    A host looked up after `prefetch` of its TTL passed is refreshed in
+    background, so hot hosts never wait for resolver.
+    '''
+
+    def __init__(self, ttl=300, negative_ttl=30, min_ttl=10, max_size=100000, prefetch=0.8):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_size = max_size
+        self.prefetch_ratio = prefetch
+        self.cache = collections.OrderedDict()  # host -> (addresses, expire, refresh_at)
+        self._resolving = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, host):
+        entry = self.cache.get(host)
+        return entry is not None and entry[1] > time.time()
+
+    async def _query(self, host):
+        '''return (addresses, ttl)'''
+        if dns is not None:
+            try:
+                answer = await dns.asyncresolver.resolve(host, 'A')
+                return [x.address for x in answer], answer.rrset.ttl
+            except dns.exception.DNSException:
+                pass
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        addresses = []
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        return addresses, self.ttl
+
+    def _set(self, host, addresses, ttl):
+        now = time.time()
+        self.cache[host] = (addresses, now + ttl, now + ttl * self.prefetch_ratio)
+        self.cache.move_to_end(host)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    async def _resolve(self, host):
+        try:
+            addresses, ttl = await self._query(host)
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, 'no address of %s' % host)
+        except Exception as e:
+            entry = self.cache.get(host)
+            if entry is not None and entry[0]:
+                # refresh failed, keep last addresses for a while
+                self._set(host, entry[0], self.negative_ttl)
+            else:
+                self._set(host, None, self.negative_ttl)
+            raise e
+        self._set(host, addresses, max(self.min_ttl, min(ttl, self.ttl)))
+        return addresses
+
+    def _start(self, host):
+        future = self._resolving.get(host)
+        if future is None:
+            future = asyncio.ensure_future(self._resolve(host))
+            self._resolving[host] = future
+            future.add_done_callback(lambda f: self._done(host, f))
+        return future
+
+    def _done(self, host, future):
+        self._resolving.pop(host, None)
+        if not future.cancelled():
+            # retrieved here, so background prefetch errors are not reported as never retrieved
+            future.exception()
+
+    def prefetch(self, host):
+        '''resolve host in background if it's not cached'''
+        if host and host not in self and not self._is_ip(host):
+            self._start(host)
+
+    @staticmethod
+    def _is_ip(host):
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    async def resolve(self, host):
+        '''addresses of host, raise socket.gaierror for host failed to resolve'''
+        if self._is_ip(host):
+            return [host]
+        now = time.time()
+        entry = self.cache.get(host)
+        if entry is not None and entry[1] > now:
+            self.hits += 1
+            self.cache.move_to_end(host)
+            if entry[0] is None:
+                raise socket.gaierror(socket.EAI_NONAME, '%s failed to resolve (cached)' % host)
+            if now > entry[2] and host not in self._resolving:
+                self._start(host)
+            return entry[0]
+        self.misses += 1
+        return await asyncio.shield(self._start(host))
+
+    def stats(self):
+        return {
+            'size': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import time
+import asyncio
+import logging
+import collections
+import email.utils
+
+logger = logging.getLogger('fetcher')
+
+# status codes of a host asking to slow down
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(value):
+    '''seconds of a Retry-After header, in seconds or a http date, None if invalid'''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
+class HostState(object):
+    __slots__ = ('limit', 'inflight', 'waiters', 'latency', 'last_decrease', 'blocked_until',
+                 'timer')
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self.waiters = collections.deque()
+        self.latency = None
+        self.last_decrease = 0
+        self.blocked_until = 0
+        self.timer = None
+
+
+class HostLimiter(object):
+    '''
+    Adaptive limit of concurrent requests per host, additive increase and
+    multiplicative decrease
+
+    Limit of a host grows by `increase` after `limit` successful requests, and
+    is multiplied by `decrease` when the host replies 429 / 503, fails, or is
+    `latency_factor` times slower than the lowest latency seen of it, at most
+    once per latency. A host replied Retry-After is not requested until then.
+
+    Requests over the limit wait in fifo order. `backoff` of a host is the
+    seconds scheduler should hold its tasks, sent to scheduler in fetch results.
+
+    Tasks from the queue of fetcher don't wait, they are sent back to scheduler
+    when `defer` of their host is not 0, so a throttled host doesn't hold slots
+    of fetcher pool.
+    '''
+
+    def __init__(self, max_limit=64, initial=4, min_limit=1, increase=1.0, decrease=0.5,
+                 latency_factor=3.0, max_retry_after=600):
+        self.max_limit = max_limit
+        self.initial = min(initial, max_limit)
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.max_retry_after = max_retry_after
+        self.hosts = {}
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.initial)
+        return state
+
+    async def acquire(self, host):
+        '''wait until a request to host is allowed'''
+        state = self._state(host)
+        if not state.waiters and state.inflight < int(state.limit) \
+                and state.blocked_until <= time.time():
+            state.inflight += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        state.waiters.append(future)
+        self._wake(host, state)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was given before cancelled
+                state.inflight -= 1
+                self._wake(host, state)
+            raise
+
+    def _wake(self, host, state):
+        now = time.time()
+        if state.blocked_until > now:
+            if state.timer is None:
+                state.timer = asyncio.get_event_loop().call_later(
+                    state.blocked_until - now, self._unblock, host, state)
+            return
+        while state.waiters and state.inflight < int(state.limit):
+            future = state.waiters.popleft()
+            if future.done():
+                continue
+            state.inflight += 1
+            future.set_result(None)
+
+    def _unblock(self, host, state):
+        state.timer = None
+        self._wake(host, state)
+
+    def release(self, host, status_code, latency=None, headers=None):
+        '''a request to host finished, adjust limit of host with the response'''
+        state = self.hosts.get(host)
+        if state is None:
+            return
+        state.inflight -= 1
+        now = time.time()
+
+        retry_after = None
+        if headers and status_code in THROTTLE_STATUS_CODES:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after:
+            blocked_until = now + min(retry_after, self.max_retry_after)
+            if blocked_until > state.blocked_until:
+                state.blocked_until = blocked_until
+                logger.warning('%s asked to retry after %ds', host, retry_after)
+
+        slow = False
+        if latency is not None and status_code not in THROTTLE_STATUS_CODES and status_code != 599:
+            if state.latency is None or latency < state.latency:
+                state.latency = latency
+            else:
+                # lowest latency seen, drifting slowly to latency of now
+                slow = latency > state.latency * self.latency_factor
+                state.latency += (latency - state.latency) * 0.01
+
+        if status_code in THROTTLE_STATUS_CODES or status_code == 599 or slow:
+            if now - state.last_decrease > max(state.latency or 0, 1):
+                state.limit = max(state.limit * self.decrease, self.min_limit)
+                state.last_decrease = now
+        else:
+            state.limit = min(state.limit + self.increase / state.limit, self.max_limit)
+
+        self._wake(host, state)
+        if not state.inflight and not state.waiters and state.blocked_until <= now \
+                and state.limit >= self.initial:
+            # host is healthy and idle, forget it
+            del self.hosts[host]
+
+    def backoff(self, host):
+        '''seconds tasks of host should be held by scheduler, 0 for none'''
+        state = self.hosts.get(host)
+        if state is None:
+            return 0
+        now = time.time()
+        if state.blocked_until > now:
+            return state.blocked_until - now
+        if len(state.waiters) > state.limit:
+            return len(state.waiters) / state.limit * (state.latency or 1)
+        return 0
+
+    def defer(self, host):
+        '''seconds a task of host should be held instead of waiting for host, 0 to fetch it'''
+        state = self.hosts.get(host)
+        if state is None:
+            return 0
+        now = time.time()
+        if state.blocked_until > now:
+            return state.blocked_until - now
+        if state.waiters or state.inflight >= int(state.limit):
+            # a request of host is done in about its latency
+            return max(self.backoff(host), state.latency or 0, 1.0)
+        return 0
+
+    def stats(self, limit=1000):
+        '''state of hosts limited or waiting, most waiting first'''
+        now = time.time()
+        hosts = sorted(self.hosts.items(), key=lambda x: -len(x[1].waiters))[:limit]
+        return dict((host, {
+            'limit': state.limit,
+            'inflight': state.inflight,
+            'waiting': len(state.waiters),
+            'latency': state.latency or 0.0,
+            'blocked': max(state.blocked_until - now, 0),
+        }) for host, state in hosts)
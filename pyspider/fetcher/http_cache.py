@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import contextlib
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger('fetcher')
+
+
+def normalize_url(url):
+    '''lowercase scheme and host, drop default port and fragment, sort query'''
+    parsed = urlsplit(url)
+    scheme = parsed.scheme.lower()
+    netloc = (parsed.hostname or '').lower()
+    if parsed.port and (scheme, parsed.port) not in (('http', 80), ('https', 443)):
+        netloc = '%s:%d' % (netloc, parsed.port)
+    if parsed.username:
+        netloc = '%s@%s' % (parsed.username, netloc)
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parsed.path or '/', query, ''))
+
+
+class HTTPCache(object):
+    '''
+    Disk-backed cache of HTTP responses in a sqlite file
+
+    Responses are keyed by method, normalized url and body of request. Least
+    recently used responses are evicted when size of bodies is over `max_size`.
+    Cached responses are revalidated by fetcher with If-None-Match and
+    If-Modified-Since, and served when the server replies 304.
+
+    The file can be shared by fetchers, total size of bodies is kept in table
+    `cache_size` and updated in the transaction writing the cache. Methods block
+    on disk, fetcher calls them in a thread pool.
+    '''
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024):
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, 'http_cache.db')
+        self.max_size = max_size
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                          'key TEXT PRIMARY KEY, url TEXT, status_code INTEGER, headers TEXT, '
+                          'content BLOB, size INTEGER, updatetime REAL, atime REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY, size INTEGER)')
+        self.conn.execute('INSERT OR IGNORE INTO cache_size (id, size) '
+                          'SELECT 0, COALESCE(SUM(size), 0) FROM cache')
+        self.mutex = threading.Lock()
+        self.size = self._size()
+        self.hits = 0
+        self.misses = 0
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.mutex:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            else:
+                self.conn.execute('COMMIT')
+
+    def _size(self):
+        return self.conn.execute('SELECT size FROM cache_size WHERE id = 0').fetchone()[0]
+
+    def _add_size(self, delta):
+        self.conn.execute('UPDATE cache_size SET size = size + ? WHERE id = 0', (delta, ))
+        self.size = self._size()
+
+    @staticmethod
+    def key(method, url, body=None):
+        key = '%s %s' % (method.upper(), normalize_url(url))
+        if body:
+            if isinstance(body, str):
+                body = body.encode('utf8')
+            key += ' ' + hashlib.sha1(body).hexdigest()
+        return key
+
+    def get(self, key):
+        '''cached response of key as dict, None if not cached'''
+        with self.mutex:
+            row = self.conn.execute('SELECT url, status_code, headers, content, updatetime '
+                                    'FROM cache WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute('UPDATE cache SET atime = ? WHERE key = ?', (time.time(), key))
+        return {
+            'url': row[0],
+            'status_code': row[1],
+            'headers': json.loads(row[2]),
+            'content': bytes(row[3]),
+            'updatetime': row[4],
+        }
+
+    @staticmethod
+    def cacheable(result):
+        if result.get('status_code') != 200 or result.get('content_ref') or result.get('truncated'):
+            return False
+        headers = dict((k.lower(), v) for k, v in (result.get('headers') or {}).items())
+        return 'no-store' not in headers.get('cache-control', '').lower()
+
+    def put(self, key, result):
+        '''cache a fetch result'''
+        content = result.get('content') or b''
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        now = time.time()
+        with self._transaction():
+            old = self.conn.execute('SELECT size FROM cache WHERE key = ?', (key, )).fetchone()
+            self.conn.execute('REPLACE INTO cache (key, url, status_code, headers, content, size, '
+                              'updatetime, atime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, result.get('url'), result.get('status_code'),
+                               json.dumps(dict(result.get('headers') or {})),
+                               sqlite3.Binary(content), len(content), now, now))
+            self._add_size(len(content) - (old[0] if old else 0))
+            if self.size > self.max_size:
+                self._evict()
+
+    def evict(self, ratio=0.9):
+        '''drop least recently used responses until size is under ratio of max_size'''
+        with self._transaction():
+            self._evict(ratio)
+
+    def _evict(self, ratio=0.9):
+        # size is counted again, in case fetchers sharing the file have got it wrong
+        size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        target = self.max_size * ratio
+        rows = self.conn.execute('SELECT key, size FROM cache ORDER BY atime')
+        drop = []
+        for key, _size in rows:
+            if size <= target:
+                break
+            drop.append((key, ))
+            size -= _size
+        self.conn.executemany('DELETE FROM cache WHERE key = ?', drop)
+        self.conn.execute('UPDATE cache_size SET size = ? WHERE id = 0', (size, ))
+        self.size = size
+
+    def delete(self, key):
+        with self._transaction():
+            old = self.conn.execute('SELECT size FROM cache WHERE key = ?', (key, )).fetchone()
+            if old:
+                self.conn.execute('DELETE FROM cache WHERE key = ?', (key, ))
+                self._add_size(-old[0])
+
+    def __len__(self):
+        with self.mutex:
+            return self.conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
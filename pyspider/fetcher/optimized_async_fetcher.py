@@ -12,15 +12,23 @@ Optimized asynchronous fetcher for PySpider
 import time
 import json
 import copy
+import socket
+import queue
 import asyncio
 import logging
 import traceback
+from urllib.parse import urlsplit
 from typing import Dict, Any, Optional, List, Tuple, Union, Callable
 
 import aiohttp
 from aiohttp import ClientTimeout, TCPConnector
+from aiohttp.abc import AbstractResolver
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
-from pyspider.libs import utils
 from pyspider.libs.url import quote_chinese
 from pyspider.libs.metrics import metrics
 from pyspider.libs.errors import (
@@ -29,14 +37,64 @@ from pyspider.libs.errors import (
 )
 from pyspider.libs.memory_optimizer import memory_optimizer
 from pyspider.fetcher.connection_pool_optimizer import connection_pool_optimizer
+from pyspider.fetcher.body_spool import BodySpool
+from pyspider.libs.body_store import offload_body
+from pyspider.message_queue import get_many
+from pyspider.fetcher.robots_cache import RobotsCache
+from pyspider.fetcher.dns_cache import DNSCache
 
 logger = logging.getLogger('optimized_async_fetcher')
 
+
+class DNSCacheResolver(AbstractResolver):
+    """
+    aiohttp resolver backed by fetcher DNSCache
+    """
+
+    def __init__(self, dns_cache: DNSCache):
+        self.dns_cache = dns_cache
+
+    async def resolve(self, host: str, port: int = 0,
+                      family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        addresses = await self.dns_cache.resolve(host)
+        return [{
+            'hostname': host,
+            'host': address,
+            'port': port,
+            'family': socket.AF_INET6 if ':' in address else socket.AF_INET,
+            'proto': 0,
+            'flags': socket.AI_NUMERICHOST,
+        } for address in addresses]
+
+    async def close(self) -> None:
+        pass
+
 class OptimizedAsyncFetcher:
     """
     Optimized asynchronous fetcher using aiohttp with memory and connection pool optimization
     """
 
+    # Default limits of response body, see tornado_fetcher.Fetcher
+    max_body_size = None
+    spill_body_size = None
+    spill_dir = None
+    body_chunk_size = 64 * 1024
+    # Body store of response bodies sent by reference, see tornado_fetcher.Fetcher
+    body_store = None
+    body_store_size = 64 * 1024
+    # robots.txt cache
+    robots_txt_age = 24 * 60 * 60
+    robots_txt_cache_size = 10000
+    # DNS cache, 0 to use resolver of aiohttp
+    dns_cache_ttl = 0
+    dns_negative_ttl = 30
+    # ProxyPool proxies are picked from, see tornado_fetcher.Fetcher
+    proxy_pool = None
+    # HostLimiter of concurrent requests per host, see tornado_fetcher.Fetcher
+    host_limiter = None
+    # Max tasks got from inqueue in one round trip and fetched concurrently
+    intake_batch = 100
+
     def __init__(self,
                  user_agent: str = None,
                  poolsize: int = None,
@@ -96,7 +154,9 @@ class OptimizedAsyncFetcher:
 
         # Session and state
         self.session = None
-        self.robots_txt_cache = {}
+        self.http2_clients = {}
+        self.robots_txt_cache = RobotsCache(self.robots_txt_cache_size, self.robots_txt_age)
+        self.dns_cache = DNSCache(self.dns_cache_ttl, self.dns_negative_ttl) if self.dns_cache_ttl else None
         self._active_connections = 0
         self._queue_size = 0
         self._initialized = False
@@ -120,12 +180,37 @@ class OptimizedAsyncFetcher:
         pool_size = self.connection_pool_optimizer.get_pool_size()
 
         # Create a ClientSession with an optimized connection pool
-        connector = TCPConnector(limit=pool_size, ssl=False)
-        self.session = aiohttp.ClientSession(connector=connector)
+        if self.dns_cache is not None:
+            connector = TCPConnector(limit=pool_size, ssl=False, use_dns_cache=False,
+                                     resolver=DNSCacheResolver(self.dns_cache))
+        else:
+            connector = TCPConnector(limit=pool_size, ssl=False)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             trace_configs=[self._connection_trace_config()])
 
         self._initialized = True
         logger.info(f"Optimized async fetcher initialized with pool size {pool_size}")
 
+    def _connection_trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Trace config counting keep-alive connection reuse by host
+        """
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.host = params.url.host
+
+        async def on_connection_create_end(session, ctx, params):
+            metrics.increment('connection_created', tags={'host': getattr(ctx, 'host', None)})
+
+        async def on_connection_reuseconn(session, ctx, params):
+            metrics.increment('connection_reused', tags={'host': getattr(ctx, 'host', None)})
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
     async def close(self):
         """
         Close the fetcher
@@ -137,6 +222,9 @@ class OptimizedAsyncFetcher:
         if self.session:
             await self.session.close()
             self.session = None
+        for client in self.http2_clients.values():
+            await client.aclose()
+        self.http2_clients = {}
 
         # Stop optimizers
         self.memory_optimizer.stop()
@@ -192,6 +280,8 @@ class OptimizedAsyncFetcher:
                     result = await self.py_playwright_fetch(url, task)
                 elif fetch_type == 'splash':
                     result = await self.splash_fetch(url, task)
+                elif fetch_type == 'http2':
+                    result = await self.http2_fetch(url, task)
                 else:
                     result = await self.http_fetch(url, task)
 
@@ -319,11 +409,7 @@ class OptimizedAsyncFetcher:
             cookies.update(fetch['cookies'])
 
         # Handle proxy
-        proxy = None
-        if fetch.get('proxy'):
-            proxy = fetch['proxy']
-        elif self.proxy and fetch.get('proxy', True):
-            proxy = self.proxy
+        proxy = self.choose_proxy(url, fetch)
 
         # Handle timeout
         timeout = ClientTimeout(
@@ -331,6 +417,13 @@ class OptimizedAsyncFetcher:
             connect=fetch.get('connect_timeout', 20)
         )
 
+        # Wait for a slot of host when limited by host
+        host = urlsplit(url).hostname if self.host_limiter is not None else None
+        if host:
+            await self.host_limiter.acquire(host)
+        request_start = time.time()
+        status_code, response_headers = 599, None
+
         # Make request
         try:
             method = options.get('method', 'GET').upper()
@@ -369,8 +462,25 @@ class OptimizedAsyncFetcher:
 
             # Make request
             async with self.session.request(**kwargs) as response:
-                # Get content
-                content = await response.read()
+                status_code, response_headers = response.status, response.headers
+
+                # Get content, streamed into a spool when body is limited
+                spool = BodySpool.for_task(fetch, self.max_body_size,
+                                           self.spill_body_size, self.spill_dir)
+                content_ref = None
+                if spool is None:
+                    content = await response.read()
+                else:
+                    async for chunk in response.content.iter_chunked(self.body_chunk_size):
+                        if not spool.write(chunk):
+                            break
+                    if spool.aborted:
+                        spool.discard()
+                        response.close()
+                        raise HTTPError(599, f"Response body larger than max_body_size {spool.max_size}")
+                    if spool.truncated:
+                        response.close()
+                    content, content_ref = spool.finish()
 
                 # Get cookies
                 cookies = {}
@@ -388,20 +498,170 @@ class OptimizedAsyncFetcher:
                     'time': time.time() - start_time,
                     'save': task.get('fetch', {}).get('save')
                 }
+                if spool is not None:
+                    result['content_length'] = spool.size
+                    if content_ref:
+                        result['content_ref'] = content_ref
+                    if spool.truncated:
+                        result['truncated'] = True
 
                 # Handle redirect
                 if response.history:
                     result['redirect_url'] = str(response.url)
 
+                self.report_proxy(proxy, url, result['status_code'], result['time'], content)
                 return result
         except aiohttp.ClientError as e:
             # Convert exception
             error = convert_exception(e)
+            self.report_proxy(proxy, url, 599, time.time() - start_time)
             raise error
         except asyncio.TimeoutError:
+            self.report_proxy(proxy, url, 599, time.time() - start_time)
             raise TimeoutError(f"Timeout after {timeout.total} seconds")
         except Exception as e:
             raise e
+        finally:
+            if host:
+                self.host_limiter.release(host, status_code, time.time() - request_start,
+                                          response_headers)
+
+    def choose_proxy(self, url: str, fetch: Dict[str, Any]) -> Optional[str]:
+        """
+        Proxy of a request, proxy of task, from proxy pool, or default proxy
+
+        Args:
+            url: URL to fetch
+            fetch: Fetch options of task
+
+        Returns:
+            Proxy, None for no proxy
+        """
+        if isinstance(fetch.get('proxy'), str):
+            return fetch['proxy']
+        elif not fetch.get('proxy', True):
+            return None
+        elif self.proxy_pool is not None and len(self.proxy_pool):
+            return self.proxy_pool.choose(urlsplit(url).hostname)
+        return self.proxy
+
+    def get_http2_client(self, scheme: str, proxy: Optional[str] = None):
+        """
+        httpx client speaking http2, negotiated by ALPN over https, prior
+        knowledge (h2c) over http, one client per proxy
+
+        Args:
+            scheme: Scheme of URL
+            proxy: Proxy of requests, None for no proxy
+
+        Returns:
+            httpx.AsyncClient
+        """
+        prior_knowledge = scheme != 'https'
+        if proxy and '://' not in proxy:
+            proxy = 'http://' + proxy
+        key = (prior_knowledge, proxy)
+        if key not in self.http2_clients:
+            pool_size = self.connection_pool_optimizer.get_pool_size()
+            self.http2_clients[key] = httpx.AsyncClient(
+                http1=not prior_knowledge, http2=True, verify=False, proxy=proxy,
+                limits=httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size))
+        return self.http2_clients[key]
+
+    async def http2_fetch(self, url: str, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Fetch with httpx over http2, concurrent requests of a host are
+        multiplexed over one connection
+
+        Args:
+            url: URL to fetch
+            task: Task
+
+        Returns:
+            Fetch result, same as http_fetch
+        """
+        if httpx is None:
+            logger.warning("httpx is not installed, fetch %s with http/1.1. "
+                           "Please install it with 'pip install httpx[http2]'", url)
+            return await self.http_fetch(url, task)
+
+        start_time = time.time()
+        fetch = task.get('fetch', {})
+        if fetch.get('robots_txt', False) and not await self.can_fetch(url, task):
+            return self.handle_error('http2', url, task, start_time,
+                                     HTTPError(403, 'Disallowed by robots.txt'))
+
+        headers = dict(self.default_options['headers'])
+        headers.update(fetch.get('headers') or {})
+        if fetch.get('user_agent'):
+            headers['User-Agent'] = fetch['user_agent']
+        method = fetch.get('method', 'GET').upper()
+        url = quote_chinese(url)
+        timeout = fetch.get('timeout', self.timeout)
+        proxy = self.choose_proxy(url, fetch)
+
+        host = urlsplit(url).hostname if self.host_limiter is not None else None
+        if host:
+            await self.host_limiter.acquire(host)
+        request_start = time.time()
+        status_code, response_headers = 599, None
+        try:
+            client = self.get_http2_client(urlsplit(url).scheme, proxy)
+            request = client.build_request(
+                method, url, headers=headers, cookies=fetch.get('cookies'),
+                content=fetch.get('data') if method in ('POST', 'PUT', 'PATCH') else None,
+                timeout=httpx.Timeout(timeout, connect=fetch.get('connect_timeout', 20)))
+            response = await client.send(request, stream=True,
+                                          follow_redirects=fetch.get('allow_redirects', True))
+            try:
+                status_code, response_headers = response.status_code, response.headers
+                spool = BodySpool.for_task(fetch, self.max_body_size,
+                                           self.spill_body_size, self.spill_dir)
+                content_ref = None
+                if spool is None:
+                    content = await response.aread()
+                else:
+                    async for chunk in response.aiter_bytes(self.body_chunk_size):
+                        if not spool.write(chunk):
+                            break
+                    if spool.aborted:
+                        spool.discard()
+                        raise HTTPError(599, f"Response body larger than max_body_size {spool.max_size}")
+                    content, content_ref = spool.finish()
+            finally:
+                await response.aclose()
+        except httpx.TimeoutException:
+            self.report_proxy(proxy, url, 599, time.time() - start_time)
+            raise TimeoutError(f"Timeout after {timeout} seconds")
+        except httpx.HTTPError:
+            self.report_proxy(proxy, url, 599, time.time() - start_time)
+            raise
+        finally:
+            if host:
+                self.host_limiter.release(host, status_code, time.time() - request_start,
+                                          response_headers)
+
+        result = {
+            'status_code': response.status_code,
+            'url': str(response.url),
+            'orig_url': url,
+            'content': content,
+            'headers': dict(response.headers),
+            'cookies': dict(response.cookies),
+            'time': time.time() - start_time,
+            'save': fetch.get('save')
+        }
+        if spool is not None:
+            result['content_length'] = spool.size
+            if content_ref:
+                result['content_ref'] = content_ref
+            if spool.truncated:
+                result['truncated'] = True
+        if response.history:
+            result['redirect_url'] = str(response.url)
+        self.report_proxy(proxy, url, result['status_code'], result['time'], content)
+        return result
 
     async def puppeteer_fetch(self, url: str, task: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -703,6 +963,22 @@ class OptimizedAsyncFetcher:
             error = convert_exception(e)
             raise error
 
+    def report_proxy(self, proxy: Optional[str], url: str, status_code: int,
+                     latency: float, content: Union[bytes, str] = None) -> None:
+        """
+        Update health of proxy in pool with result of a request
+
+        Args:
+            proxy: Proxy used
+            url: URL fetched
+            status_code: Status code, 599 for network errors
+            latency: Time of the request in seconds
+            content: Response body
+        """
+        if self.proxy_pool is None or proxy not in self.proxy_pool:
+            return
+        self.proxy_pool.report(proxy, urlsplit(url).hostname, status_code, latency, content)
+
     def handle_error(self, fetch_type: str, url: str, task: Dict[str, Any],
                      start_time: float, error: Exception) -> Dict[str, Any]:
         """
@@ -742,66 +1018,45 @@ class OptimizedAsyncFetcher:
         Returns:
             True if URL can be fetched, False otherwise
         """
-        from urllib.parse import urlparse, urljoin
-        from urllib.robotparser import RobotFileParser
-
-        parsed_url = urlparse(url)
-        robots_url = urljoin(url, '/robots.txt')
         user_agent = task.get('fetch', {}).get('user_agent', self.user_agent)
+        return await self.robots_txt_cache.can_fetch(
+            user_agent, url, lambda robots_url: self.load_robots_txt(robots_url, user_agent))
 
-        # Check cache
-        key = (parsed_url.netloc, user_agent)
-        if key in self.robots_txt_cache:
-            rp, last_check = self.robots_txt_cache[key]
-            # Cache for 1 day
-            if time.time() - last_check < 24 * 60 * 60:
-                return rp.can_fetch(user_agent, url)
+    async def load_robots_txt(self, robots_url: str, user_agent: str = None) -> Optional[str]:
+        """
+        Load robots.txt
 
-        # Fetch robots.txt
-        rp = RobotFileParser()
-        rp.url = robots_url
+        Args:
+            robots_url: URL of robots.txt
+            user_agent: User agent
 
-        try:
-            # Create a simple task for fetching robots.txt
-            robots_task = {
-                'url': robots_url,
-                'fetch': {
-                    'method': 'GET',
-                    'headers': {
-                        'User-Agent': user_agent or 'pyspider/%s' % utils.__version__,
-                    },
-                    'timeout': 10,
-                    'robots_txt': False  # Avoid infinite recursion
-                }
+        Returns:
+            Content of robots.txt, None if not available
+        """
+        robots_task = {
+            'url': robots_url,
+            'fetch': {
+                'method': 'GET',
+                'headers': {
+                    'User-Agent': user_agent or self.default_options['headers']['User-Agent'],
+                },
+                'timeout': 10,
+                'robots_txt': False  # Avoid infinite recursion
             }
-
-            # Fetch robots.txt
-            result = await self.http_fetch(robots_url, robots_task)
-
-            if result['status_code'] == 200:
-                # Parse robots.txt
-                rp.parse(result['content'].decode('utf-8', 'ignore').splitlines())
-            else:
-                # If robots.txt is not available, allow all
-                rp = RobotFileParser()
-                rp.allow_all = True
-        except Exception as e:
-            logger.error("Error fetching robots.txt: %s", e)
-            # If error, allow all
-            rp = RobotFileParser()
-            rp.allow_all = True
-
-        # Update cache
-        self.robots_txt_cache[key] = (rp, time.time())
-
-        # Check if URL can be fetched
-        return rp.can_fetch(user_agent, url)
+        }
+        result = await self.http_fetch(robots_url, robots_task)
+        if result['status_code'] != 200:
+            return None
+        content = result['content']
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'ignore')
+        return content
 
     async def clear_robots_txt_cache(self) -> None:
         """
-        Clear robots.txt cache
+        Clear expired robots.txt
         """
-        self.robots_txt_cache = {}
+        self.robots_txt_cache.clear_expired()
 
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -815,7 +1070,10 @@ class OptimizedAsyncFetcher:
             'queue_size': self._queue_size,
             'pool_size': self.connection_pool_optimizer.get_pool_size(),
             'memory': self.memory_optimizer.get_memory_usage(),
-            'pool': self.connection_pool_optimizer.get_pool_stats()
+            'pool': self.connection_pool_optimizer.get_pool_stats(),
+            'dns': self.dns_cache.stats() if self.dns_cache is not None else {},
+            'proxy': self.proxy_pool.stats() if self.proxy_pool is not None else [],
+            'hosts': self.host_limiter.stats() if self.host_limiter is not None else {}
         }
 
     def xmlrpc_run(self, port=24444, bind='127.0.0.1'):
@@ -837,6 +1095,8 @@ class OptimizedAsyncFetcher:
 
         application.register_function(self.fetch_sync, 'fetch')
         application.register_function(self.get_stats, 'get_stats')
+        application.register_function(
+            lambda: self.proxy_pool.stats() if self.proxy_pool is not None else [], 'proxy_stats')
 
         container = tornado.wsgi.WSGIContainer(application)
         self.xmlrpc_ioloop = tornado.ioloop.IOLoop.current()
@@ -872,6 +1132,106 @@ class OptimizedAsyncFetcher:
         # Pack result for XML-RPC
         return {"data": umsgpack.packb(result)}
 
+    def deferred_result(self, task: Dict[str, Any], seconds: float) -> Dict[str, Any]:
+        """
+        Fetch result of a task sent back without fetched, its host is throttled
+
+        Args:
+            task: Task
+            seconds: Seconds the task should be held by scheduler
+
+        Returns:
+            Deferred result
+        """
+        url = task.get('url', '')
+        return {
+            'status_code': 599,
+            'error': 'host %s is throttled, deferred for %.1fs' % (urlsplit(url).hostname, seconds),
+            'orig_url': url,
+            'url': url,
+            'headers': {},
+            'content': '',
+            'cookies': {},
+            'time': 0,
+            'save': task.get('fetch', {}).get('save'),
+            'deferred': True,
+            'backoff': seconds,
+        }
+
+    async def fetch_one(self, task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a task from inqueue, a task of blocked or busy host is sent back at once
+
+        Args:
+            task: Task
+
+        Returns:
+            Fetch result, None when failed
+        """
+        host = urlsplit(task.get('url') or '').hostname if self.host_limiter is not None else None
+        if host:
+            defer = self.host_limiter.defer(host)
+            if defer:
+                return self.deferred_result(task, defer)
+        try:
+            result = await self.async_fetch(task)
+        except Exception as e:
+            logger.error(f"Error processing task: {e}")
+            return None
+        if self.body_store is not None:
+            result = offload_body(self.body_store, result, self.body_store_size)
+        if host:
+            backoff = self.host_limiter.backoff(host)
+            if backoff > result.get('backoff', 0):
+                result['backoff'] = backoff
+        return result
+
+    async def process_queue(self):
+        """
+        Fetch tasks from inqueue, up to intake_batch at once
+
+        Free slots are filled with one get as fetches finish, and each result
+        is put to outqueue as soon as its fetch is done.
+        """
+        loop = asyncio.get_event_loop()
+        slots = asyncio.Semaphore(self.intake_batch)
+        # references of running fetches, so they aren't garbage collected
+        running = set()
+
+        async def fetch_and_put(task):
+            try:
+                result = await self.fetch_one(task)
+                if result is not None and getattr(self, 'outqueue', None) is not None:
+                    await loop.run_in_executor(None, self.outqueue.put, (task, result))
+            except Exception as e:
+                logger.error(f"Error putting result to queue: {e}")
+            finally:
+                slots.release()
+
+        while True:
+            # wait for a free slot, and take the others free now
+            await slots.acquire()
+            free = 1
+            while free < self.intake_batch and not slots.locked():
+                await slots.acquire()
+                free += 1
+            try:
+                # Get tasks for free slots from queue in one round trip
+                tasks = await loop.run_in_executor(
+                    None, lambda: get_many(self.inqueue, free, timeout=1))
+            except queue.Empty:
+                tasks = []
+            except Exception as e:
+                logger.error(f"Error getting task from queue: {e}")
+                await asyncio.sleep(1)
+                tasks = []
+            for _ in range(free - len(tasks)):
+                slots.release()
+            for task in tasks:
+                future = asyncio.ensure_future(fetch_and_put(task))
+                running.add(future)
+                future.add_done_callback(running.discard)
+
     def run(self):
         """
         Run the fetcher
@@ -893,27 +1253,8 @@ class OptimizedAsyncFetcher:
             if hasattr(self, 'inqueue') and self.inqueue:
                 logger.info("Fetcher starting to process tasks from queue")
 
-                async def process_queue():
-                    while True:
-                        try:
-                            # Get task from queue
-                            task = await loop.run_in_executor(None, self.inqueue.get)
-
-                            # Process task
-                            try:
-                                result = await self.async_fetch(task)
-
-                                # Put result in output queue
-                                if hasattr(self, 'outqueue') and self.outqueue:
-                                    await loop.run_in_executor(None, lambda: self.outqueue.put(result))
-                            except Exception as e:
-                                logger.error(f"Error processing task: {e}")
-                        except Exception as e:
-                            logger.error(f"Error getting task from queue: {e}")
-                            await asyncio.sleep(1)
-
                 # Run queue processing
-                loop.run_until_complete(process_queue())
+                loop.run_until_complete(self.process_queue())
             else:
                 # No input queue, just keep the process running
                 logger.info("Fetcher running without input queue")
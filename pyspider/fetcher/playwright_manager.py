@@ -14,7 +14,9 @@ import time
 import asyncio
 import logging
 import traceback
+import collections
 from typing import Dict, Any, Optional, List, Tuple, Union, Callable
+from urllib.parse import urlsplit
 
 try:
     from playwright.async_api import async_playwright, Browser, Page, BrowserContext, Response
@@ -30,9 +32,52 @@ from pyspider.libs.errors import (
 
 logger = logging.getLogger('playwright_manager')
 
+# resource types blocked when `block_resources` is True
+DEFAULT_BLOCKED_RESOURCES = ('image', 'font', 'media')
+
+# analytics and ad hosts blocked when `block_trackers` is True
+DEFAULT_TRACKER_DOMAINS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googlesyndication.com',
+    'doubleclick.net',
+    'facebook.net',
+    'connect.facebook.net',
+    'hotjar.com',
+    'scorecardresearch.com',
+    'adservice.google.com',
+    'amazon-adsystem.com',
+)
+
+
+class PooledPage:
+    """
+    A page with its own browser context, owned by the pool
+    """
+
+    __slots__ = ('page', 'context', 'key', 'uses', 'created')
+
+    def __init__(self, page: 'Page', context: 'BrowserContext', key: Tuple[Optional[str], Optional[str]]):
+        self.page = page
+        self.context = context
+        self.key = key
+        self.uses = 0
+        self.created = time.time()
+
+
 class PlaywrightManager:
     """
     Playwright manager for PySpider
+
+    Pages are pooled by (proxy, user_agent), each page with its own browser
+    context. Acquire and release don't take a lock, a page is handed out
+    from the idle pool of its key or created when the pool is empty. Pages
+    are recycled after `max_page_uses` uses, or when JS heap of page grows
+    over `max_page_memory` MB.
+
+    At most `max_pages` pages are open over all keys. When the limit is
+    reached, an idle page of another key is closed to make room, or
+    `get_page` waits until a page is released.
     """
     
     def __init__(self, 
@@ -44,20 +89,30 @@ class PlaywrightManager:
                  timeout: int = 60,
                  viewport: Dict[str, int] = None,
                  ignore_https_errors: bool = True,
-                 slow_mo: int = 0):
+                 slow_mo: int = 0,
+                 warm_pages: int = 3,
+                 max_page_uses: int = 100,
+                 max_page_memory: int = 256,
+                 block_resources: Union[bool, List[str]] = False,
+                 block_trackers: Union[bool, List[str]] = False):
         """
         Initialize PlaywrightManager
         
         Args:
             browser_type: Browser type (chromium, firefox, webkit)
             headless: Whether to run browser in headless mode
-            max_pages: Maximum number of pages to keep in pool
+            max_pages: Maximum number of pages open, idle and in use, over all keys
             user_agent: User agent
             proxy: Proxy
             timeout: Default timeout in seconds
             viewport: Viewport size
             ignore_https_errors: Whether to ignore HTTPS errors
             slow_mo: Slow down operations by the specified amount of milliseconds
+            warm_pages: Number of pages created ahead for each (proxy, user_agent)
+            max_page_uses: Close a page after it was used this many times
+            max_page_memory: Close a page when its JS heap is over this size in MB
+            block_resources: Resource types to abort, True for images, fonts and media
+            block_trackers: Domains to abort, True for common analytics and ad hosts
         """
         if not has_playwright:
             logger.error("Playwright is not installed. Please install it with 'pip install playwright'")
@@ -72,12 +127,33 @@ class PlaywrightManager:
         self.viewport = viewport or {'width': 1280, 'height': 800}
         self.ignore_https_errors = ignore_https_errors
         self.slow_mo = slow_mo
+        self.warm_pages = warm_pages
+        self.max_page_uses = max_page_uses
+        self.max_page_memory = max_page_memory
+        if block_resources is True:
+            block_resources = DEFAULT_BLOCKED_RESOURCES
+        if block_trackers is True:
+            block_trackers = DEFAULT_TRACKER_DOMAINS
+        self.block_resources = frozenset(block_resources or ())
+        self.block_trackers = tuple(block_trackers or ())
         
         self._playwright = None
         self._browser = None
-        self._page_pool = []
-        self._lock = asyncio.Lock()
+        self._idle = collections.defaultdict(collections.deque)  # key -> deque of PooledPage
+        self._pages = {}  # page -> PooledPage, idle and in use
+        self._warming = {}  # key -> future of warm()
+        self._creating = 0  # pages being created, counted against max_pages
+        self._waiters = collections.deque()  # futures of get_page waiting for room
+        self._lock = asyncio.Lock()  # only guards init
         self._initialized = False
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'created': 0,
+            'recycled': 0,
+            'blocked': 0,
+            'create_time': 0.0,
+        }
     
     async def init(self):
         """
@@ -117,6 +193,9 @@ class PlaywrightManager:
                 '--disable-features=IsolateOrigins,site-per-process',
                 '--disable-site-isolation-trials'
             ]
+            if self.max_page_memory:
+                # exposes usedJSHeapSize in performance.memory
+                browser_args.append('--enable-precise-memory-info')
         
         # Prepare launch options
         launch_options = {
@@ -128,17 +207,12 @@ class PlaywrightManager:
         
         # Launch browser
         self._browser = await browser_factory.launch(**launch_options)
-        
-        # Initialize page pool
-        for _ in range(min(3, self.max_pages)):  # Start with a few pages
-            page = await self._create_new_page()
-            self._page_pool.append(page)
-        
         self._initialized = True
-        logger.info(f"Playwright initialized with {len(self._page_pool)} pages in pool")
         
-        # Record metrics
-        metrics.gauge('playwright_pages', len(self._page_pool))
+        # Pre-warm pages of default proxy and user agent
+        await self.warm(self.proxy, self.user_agent)
+        
+        logger.info(f"Playwright initialized with {len(self._pages)} pages in pool")
     
     async def close(self):
         """
@@ -151,11 +225,14 @@ class PlaywrightManager:
             return
         
         logger.info("Closing Playwright")
+        self._initialized = False
+        self._notify(all=True)
         
-        # Close all pages in pool
-        for page in self._page_pool:
-            await page.close()
-        self._page_pool = []
+        # Close all pages, idle and in use
+        for pooled in list(self._pages.values()):
+            await self._close_page(pooled)
+        self._idle.clear()
+        self._pages = {}
         
         # Close browser
         if self._browser:
@@ -167,19 +244,77 @@ class PlaywrightManager:
             await self._playwright.stop()
             self._playwright = None
         
-        self._initialized = False
         logger.info("Playwright closed")
     
-    async def _create_new_page(self) -> Page:
+    def _key(self, proxy: str = None, user_agent: str = None) -> Tuple[Optional[str], Optional[str]]:
+        return (proxy or self.proxy, user_agent or self.user_agent)
+    
+    def _has_room(self) -> bool:
+        return len(self._pages) + self._creating < self.max_pages
+    
+    def _notify(self, all: bool = False):
+        """
+        Wake up get_page waiting for room, one or all of them
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                if not all:
+                    break
+    
+    async def _evict_idle(self) -> bool:
+        """
+        Close the oldest idle page of any key, False when no page is idle
+        """
+        oldest = None
+        for idle in self._idle.values():
+            if idle and (oldest is None or idle[0].created < oldest[0].created):
+                oldest = idle
+        if oldest is None:
+            return False
+        await self._close_page(oldest.popleft())
+        return True
+    
+    async def _create_new_page(self, key: Tuple[Optional[str], Optional[str]] = None) -> PooledPage:
         """
-        Create a new page
+        Create a new page in its own browser context
+        
+        Args:
+            key: (proxy, user_agent) of the context
         
         Returns:
-            Page
+            PooledPage
         """
         if not has_playwright:
             raise ImportError("Playwright is not installed")
-            
+        
+        proxy, user_agent = key or self._key()
+        start_time = time.time()
+        
+        # counted against max_pages while awaiting
+        self._creating += 1
+        try:
+            context, page = await self._new_context_page(proxy, user_agent)
+        finally:
+            self._creating -= 1
+            # a failed creation frees its room
+            self._notify()
+        
+        pooled = PooledPage(page, context, (proxy, user_agent))
+        self._pages[page] = pooled
+        
+        # Record metrics
+        cost = time.time() - start_time
+        self._stats['created'] += 1
+        self._stats['create_time'] += cost
+        metrics.increment('playwright_pages_created')
+        metrics.gauge('playwright_page_create_time', cost)
+        metrics.gauge('playwright_pages', len(self._pages))
+        
+        return pooled
+    
+    async def _new_context_page(self, proxy: Optional[str], user_agent: Optional[str]):
         # Create browser context
         context_options = {
             'viewport': self.viewport,
@@ -187,55 +322,179 @@ class PlaywrightManager:
         }
         
         # Add user agent if provided
-        if self.user_agent:
-            context_options['user_agent'] = self.user_agent
+        if user_agent:
+            context_options['user_agent'] = user_agent
         
         # Add proxy if provided
-        if self.proxy:
+        if proxy:
             context_options['proxy'] = {
-                'server': self.proxy
+                'server': proxy
             }
         
         # Create context
         context = await self._browser.new_context(**context_options)
         
+        # Abort blocked requests before they hit the network
+        if self.block_resources or self.block_trackers:
+            await context.route('**/*', self._route)
+        
         # Create page
         page = await context.new_page()
         
         # Set default timeout
         page.set_default_timeout(self.timeout)
         
-        return page
+        return context, page
     
-    async def get_page(self) -> Tuple[Page, bool]:
+    def _blocked(self, request) -> bool:
+        """
+        Whether a request should be aborted by interception
+        """
+        if request.resource_type in self.block_resources:
+            return True
+        if self.block_trackers:
+            host = (urlsplit(request.url).hostname or '').lower()
+            for domain in self.block_trackers:
+                if host == domain or host.endswith('.' + domain):
+                    return True
+        return False
+    
+    async def _route(self, route):
+        """
+        Route handler of pooled contexts, aborts blocked requests
+        """
+        if self._blocked(route.request):
+            self._stats['blocked'] += 1
+            await route.abort('blockedbyclient')
+        else:
+            await route.continue_()
+    
+    async def warm(self, proxy: str = None, user_agent: str = None, count: int = None):
+        """
+        Create pages ahead for (proxy, user_agent), until `count` of them are
+        idle or `max_pages` pages are open
+        
+        Args:
+            proxy: Proxy
+            user_agent: User agent
+            count: Number of idle pages wanted, default `warm_pages`
+        """
+        key = self._key(proxy, user_agent)
+        count = self.warm_pages if count is None else count
+        
+        # only one warm up for a key at a time
+        future = self._warming.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._warm(key, count))
+            self._warming[key] = future
+            future.add_done_callback(lambda _: self._warming.pop(key, None))
+        await asyncio.shield(future)
+    
+    async def _warm(self, key: Tuple[Optional[str], Optional[str]], count: int):
+        idle = self._idle[key]
+        while self._initialized and len(idle) < count and self._has_room():
+            try:
+                pooled = await self._create_new_page(key)
+            except Exception as e:
+                logger.error(f"Playwright warm up error: {e}")
+                break
+            if not self._initialized:
+                # manager closed while creating
+                await self._close_page(pooled)
+                break
+            idle.append(pooled)
+    
+    def _warm_in_background(self, key: Tuple[Optional[str], Optional[str]]):
+        if self.warm_pages and key not in self._warming and len(self._idle[key]) < self.warm_pages:
+            future = asyncio.ensure_future(self.warm(*key))
+            # retrieved here, so errors are not reported as never retrieved
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    
+    async def get_page(self, proxy: str = None, user_agent: str = None) -> Tuple['Page', bool]:
         """
         Get a page from pool or create a new one
         
+        Args:
+            proxy: Proxy, default to proxy of manager
+            user_agent: User agent, default to user agent of manager
+        
         Returns:
             Tuple of (page, is_new)
         """
         if not has_playwright:
             raise ImportError("Playwright is not installed")
-            
-        async with self._lock:
-            if not self._initialized:
-                await self.init()
-            
+        
+        if not self._initialized:
+            async with self._lock:
+                if not self._initialized:
+                    await self.init()
+        
+        key = self._key(proxy, user_agent)
+        idle = self._idle[key]
+        
+        while True:
             # Try to get a page from pool
-            if self._page_pool:
-                page = self._page_pool.pop()
-                return page, False
-            
-            # Create a new page if pool is empty
-            page = await self._create_new_page()
-            
-            # Record metrics
-            metrics.gauge('playwright_pages', len(self._page_pool))
-            metrics.increment('playwright_pages_created')
-            
-            return page, True
+            if idle:
+                pooled = idle.popleft()
+                pooled.uses += 1
+                self._stats['hits'] += 1
+                metrics.increment('playwright_pool_hits')
+                self._warm_in_background(key)
+                return pooled.page, False
+            
+            if self._has_room():
+                break
+            # make room by closing an idle page of another key
+            if await self._evict_idle():
+                continue
+            # all pages in use, wait for one released or closed
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+            if not self._initialized:
+                raise ProcessError("Playwright manager closed")
+        
+        # Create a new page if pool is empty
+        self._stats['misses'] += 1
+        metrics.increment('playwright_pool_misses')
+        pooled = await self._create_new_page(key)
+        pooled.uses += 1
+        self._warm_in_background(key)
+        
+        return pooled.page, True
+    
+    async def _page_memory(self, page: 'Page') -> Optional[float]:
+        """
+        Used JS heap of page in MB, None when not available
+        """
+        try:
+            used = await page.evaluate(
+                '() => performance.memory ? performance.memory.usedJSHeapSize : null')
+        except Exception:
+            return None
+        return used / 1024 / 1024 if used else None
+    
+    async def _should_recycle(self, pooled: PooledPage) -> bool:
+        if self.max_page_uses and pooled.uses >= self.max_page_uses:
+            return True
+        if self.max_page_memory and self.browser_type == 'chromium':
+            memory = await self._page_memory(pooled.page)
+            if memory is not None and memory > self.max_page_memory:
+                logger.debug(f"Recycle page using {memory:.1f}MB JS heap")
+                return True
+        return False
+    
+    async def _close_page(self, pooled: PooledPage):
+        self._pages.pop(pooled.page, None)
+        self._notify()
+        try:
+            await pooled.context.close()
+        except Exception as e:
+            logger.debug(f"Close page error: {e}")
+        metrics.increment('playwright_pages_closed')
+        metrics.gauge('playwright_pages', len(self._pages))
     
-    async def release_page(self, page: Page, error: bool = False):
+    async def release_page(self, page: 'Page', error: bool = False):
         """
         Release a page back to pool or close it if there was an error
         
@@ -245,34 +504,64 @@ class PlaywrightManager:
         """
         if not has_playwright:
             return
+        
+        pooled = self._pages.get(page)
+        if pooled is None:
+            # not created by pool, or pool closed
+            return
+        
+        if not self._initialized:
+            await self._close_page(pooled)
+            return
             
-        async with self._lock:
-            if not self._initialized:
-                return
-            
-            # Close page if there was an error or pool is full
-            if error or len(self._page_pool) >= self.max_pages:
-                await page.close()
-                metrics.increment('playwright_pages_closed')
-            else:
-                # Clear cookies and cache
-                context = page.context
-                await context.clear_cookies()
-                
-                # Navigate to about:blank to release resources
-                try:
-                    await page.goto('about:blank', wait_until='load', timeout=5000)
-                except Exception:
-                    # If navigation fails, close the page
-                    await page.close()
-                    metrics.increment('playwright_pages_closed')
-                    return
-                
-                # Add page back to pool
-                self._page_pool.append(page)
-            
-            # Record metrics
-            metrics.gauge('playwright_pages', len(self._page_pool))
+        # Close page if there was an error or it's worn out
+        if error:
+            await self._close_page(pooled)
+            return
+        if await self._should_recycle(pooled):
+            self._stats['recycled'] += 1
+            metrics.increment('playwright_pages_recycled')
+            await self._close_page(pooled)
+            self._warm_in_background(pooled.key)
+            return
+        
+        try:
+            # Clear cookies and navigate to about:blank to release resources
+            await pooled.context.clear_cookies()
+            await page.set_extra_http_headers({})
+            await page.goto('about:blank', wait_until='load', timeout=5000)
+        except Exception:
+            # If navigation fails, close the page
+            await self._close_page(pooled)
+            return
+        
+        # Add page back to pool
+        if self._initialized:
+            self._idle[pooled.key].append(pooled)
+            self._notify()
+        else:
+            await self._close_page(pooled)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Statistics of page pool
+        
+        Returns:
+            Dict of pool size, hit rate and average page creation time in seconds
+        """
+        requests = self._stats['hits'] + self._stats['misses']
+        created = self._stats['created']
+        return {
+            'pages': len(self._pages),
+            'idle': sum(len(x) for x in self._idle.values()),
+            'hits': self._stats['hits'],
+            'misses': self._stats['misses'],
+            'hit_rate': self._stats['hits'] / requests if requests else 0.0,
+            'created': created,
+            'recycled': self._stats['recycled'],
+            'blocked': self._stats['blocked'],
+            'avg_create_time': self._stats['create_time'] / created if created else 0.0,
+        }
     
     async def fetch(self, url: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """
@@ -306,7 +595,7 @@ class PlaywrightManager:
         
         try:
             # Get page
-            page, is_new_page = await self.get_page()
+            page, is_new_page = await self.get_page(options.get('proxy'), options.get('user_agent'))
             
             # Set timeout
             timeout = options.get('timeout', self.timeout)
@@ -459,7 +748,7 @@ class PlaywrightManager:
         
         try:
             # Get page
-            page, is_new_page = await self.get_page()
+            page, is_new_page = await self.get_page(options.get('proxy'), options.get('user_agent'))
             
             # Set timeout
             timeout = options.get('timeout', self.timeout)
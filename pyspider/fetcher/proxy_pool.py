@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import re
+import time
+import random
+import logging
+import collections
+
+logger = logging.getLogger('fetcher')
+
+# status codes meaning proxy is blocked by the site
+BAN_STATUS_CODES = (403, 429)
+# markers of challenge pages of anti-bot services, served with status 200
+BAN_MARKERS = (
+    br'cf-chl-|cf_chl_opt|/cdn-cgi/challenge-platform/'  # cloudflare
+    br'|_Incapsula_Resource|Incapsula incident'  # imperva
+    br'|captcha-delivery\.com'  # datadome
+    br'|px-captcha|_pxCaptcha'  # perimeterx
+    br'|/_sec/cp_challenge/'  # akamai
+)
+# titles of block pages, only of pages smaller than BAN_MAX_SIZE, as pages
+# with content are rarely block pages whatever the title says
+BAN_TITLES = (
+    br'just a moment|attention required|access denied|are you a (?:robot|human)'
+    br'|captcha|security check|unusual traffic|pardon our interruption|request blocked'
+)
+BAN_MAX_SIZE = 32 * 1024
+# size of content searched for markers
+BAN_SEARCH_SIZE = 64 * 1024
+
+TITLE = re.compile(br'<title[^>]*>(.*?)</title', re.IGNORECASE | re.DOTALL)
+
+
+def compile_ban_pattern(pattern):
+    '''compile regex of content, None or empty for never'''
+    if not pattern:
+        return None
+    if hasattr(pattern, 'search'):
+        return pattern
+    if isinstance(pattern, str):
+        pattern = pattern.encode('utf8')
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class ProxyStats(object):
+    '''health of a proxy, success rate and latency are moving averages'''
+
+    __slots__ = ('proxy', 'success_rate', 'latency', 'requests', 'failures', 'bans',
+                 'continuous_failures', 'cooldown_until')
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.success_rate = 1.0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.bans = 0
+        self.continuous_failures = 0
+        self.cooldown_until = 0
+
+    def to_dict(self):
+        return {
+            'proxy': self.proxy,
+            'success_rate': self.success_rate,
+            'latency': self.latency or 0.0,
+            'requests': self.requests,
+            'failures': self.failures,
+            'bans': self.bans,
+            'cooldown': max(self.cooldown_until - time.time(), 0),
+        }
+
+
+class ProxyPool(object):
+    '''
+    Pool of proxies picked by health
+
+    Proxies are picked at random, weighted by success rate over latency, so
+    slow or failing proxies are used less. Responses of `ban_status_codes`,
+    or pages of status 200 look like a block page, are taken as the proxy
+    banned by the site. A page looks like a block page when it has one of
+    `ban_markers` of anti-bot challenge pages, or its title matches
+    `ban_titles` while it's smaller than `ban_max_size` bytes. A proxy
+    failed `max_failures` times in a row, or banned, is put on cooldown,
+    doubled for each ban in a row up to `max_cooldown` seconds.
+
+    A failed request counts as taking at least `failure_latency` seconds,
+    so a proxy timing out is scored as slow rather than as not tried yet.
+
+    With `sticky_ttl`, requests to a host stick to the same proxy until the
+    proxy fails, so sessions of sites binding cookies to IP keep working.
+    '''
+
+    def __init__(self, proxies=(), alpha=0.2, cooldown=60, max_cooldown=3600,
+                 max_failures=3, failure_latency=10, sticky_ttl=0, max_sticky=100000,
+                 ban_status_codes=BAN_STATUS_CODES, ban_markers=BAN_MARKERS,
+                 ban_titles=BAN_TITLES, ban_max_size=BAN_MAX_SIZE):
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_failures = max_failures
+        self.failure_latency = failure_latency
+        self.sticky_ttl = sticky_ttl
+        self.max_sticky = max_sticky
+        self.ban_status_codes = frozenset(ban_status_codes or ())
+        self.ban_markers = compile_ban_pattern(ban_markers)
+        self.ban_titles = compile_ban_pattern(ban_titles)
+        self.ban_max_size = ban_max_size
+        self.proxies = collections.OrderedDict()
+        self.sticky = collections.OrderedDict()  # host -> (proxy, expire)
+        for proxy in proxies:
+            self.add(proxy)
+
+    @staticmethod
+    def normalize(proxy):
+        proxy = proxy.strip()
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return proxy
+
+    def add(self, proxy):
+        proxy = self.normalize(proxy)
+        if proxy not in self.proxies:
+            self.proxies[proxy] = ProxyStats(proxy)
+
+    def remove(self, proxy):
+        self.proxies.pop(self.normalize(proxy), None)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def __contains__(self, proxy):
+        return proxy is not None and self.normalize(proxy) in self.proxies
+
+    def mean_latency(self):
+        tried = [x.latency for x in self.proxies.values() if x.latency is not None]
+        return sum(tried) / len(tried) if tried else 1.0
+
+    def score(self, stats, mean_latency=None):
+        latency = stats.latency
+        if latency is None:
+            # not tried yet, as good as an average proxy
+            latency = self.mean_latency() if mean_latency is None else mean_latency
+        return max(stats.success_rate, 0.01) / (0.1 + latency)
+
+    def choose(self, host=None):
+        '''pick a proxy for a request to host, None when pool is empty'''
+        if not self.proxies:
+            return None
+        now = time.time()
+        if host and self.sticky_ttl and host in self.sticky:
+            proxy, expire = self.sticky[host]
+            stats = self.proxies.get(proxy)
+            if expire > now and stats is not None and stats.cooldown_until <= now:
+                return proxy
+            del self.sticky[host]
+
+        available = [x for x in self.proxies.values() if x.cooldown_until <= now]
+        if available:
+            mean_latency = self.mean_latency()
+            weights = [self.score(x, mean_latency) for x in available]
+            proxy = random.choices(available, weights)[0].proxy
+        else:
+            # all on cooldown, the one back soonest
+            proxy = min(self.proxies.values(), key=lambda x: x.cooldown_until).proxy
+
+        if host and self.sticky_ttl:
+            self.sticky[host] = (proxy, now + self.sticky_ttl)
+            self.sticky.move_to_end(host)
+            while len(self.sticky) > self.max_sticky:
+                self.sticky.popitem(last=False)
+        return proxy
+
+    def is_banned(self, status_code, content=None):
+        if status_code in self.ban_status_codes:
+            return True
+        if not content or status_code != 200:
+            return False
+        if isinstance(content, str):
+            content = content.encode('utf8', 'ignore')
+        head = content[:BAN_SEARCH_SIZE]
+        if self.ban_markers is not None and self.ban_markers.search(head):
+            return True
+        if self.ban_titles is not None and len(content) <= self.ban_max_size:
+            title = TITLE.search(head)
+            if title and self.ban_titles.search(title.group(1)):
+                return True
+        return False
+
+    def report(self, proxy, host, status_code, latency, content=None):
+        '''update health of proxy with result of a request'''
+        stats = self.proxies.get(self.normalize(proxy))
+        if stats is None:
+            return
+        stats.requests += 1
+        banned = self.is_banned(status_code, content)
+        failed = banned or status_code == 599 or status_code >= 500
+
+        alpha = self.alpha
+        stats.success_rate = (1 - alpha) * stats.success_rate + alpha * (0.0 if failed else 1.0)
+        if failed:
+            # a failed request is as good as a slow one
+            latency = max(latency or 0, self.failure_latency)
+        if latency is not None:
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency = (1 - alpha) * stats.latency + alpha * latency
+
+        if not failed:
+            stats.continuous_failures = 0
+            stats.bans = 0
+            return
+        stats.failures += 1
+        stats.continuous_failures += 1
+        if banned:
+            stats.bans += 1
+        if banned or stats.continuous_failures >= self.max_failures:
+            cooldown = min(self.cooldown * 2 ** max(stats.bans - 1, 0), self.max_cooldown)
+            stats.cooldown_until = time.time() + cooldown
+            stats.continuous_failures = 0
+            logger.warning('proxy %s %s, cooldown %ds', proxy,
+                           'banned by %s' % host if banned else 'failed', cooldown)
+        if host and self.sticky.get(host, (None, ))[0] == stats.proxy:
+            del self.sticky[host]
+
+    def stats(self):
+        return [x.to_dict() for x in self.proxies.values()]
+
+
+def load_proxies(spec):
+    '''proxies from a file with one proxy per line, or a comma separated list'''
+    if os.path.isfile(spec):
+        with open(spec) as fp:
+            lines = fp.read().splitlines()
+    else:
+        lines = spec.split(',')
+    return [x.strip() for x in lines if x.strip() and not x.strip().startswith('#')]
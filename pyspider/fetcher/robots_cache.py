@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import re
+import time
+import json
+import asyncio
+import logging
+import collections
+
+from urllib.parse import urlsplit, urlunsplit, quote, unquote
+
+logger = logging.getLogger('fetcher')
+
+
+def _normalize_path(path):
+    return quote(unquote(path), safe="/%;:@&=+$,!~*'()?#[]")
+
+
+class RobotsRules(object):
+    '''
+    Precompiled rules of a robots.txt
+
+    Groups of rules are selected by the product token of user agent, and
+    matched with longest match wins, allow wins on tie. `*` and `$` in path are
+    supported. Plain paths are matched by prefix, others by compiled regex.
+    '''
+
+    def __init__(self, content=None):
+        # content None for robots.txt not available, allow all
+        self.content = content
+        self.groups = []  # [(agents, rules, crawl_delay)]
+        self.default = None
+        self._selected = {}
+        if content:
+            self._parse(content)
+
+    def _parse(self, content):
+        agents, rules, delay = [], [], None
+        in_rules = False
+        for line in content.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if ':' not in line:
+                continue
+            field, value = line.split(':', 1)
+            field, value = field.strip().lower(), value.strip()
+            if field == 'user-agent':
+                if in_rules:
+                    self._add_group(agents, rules, delay)
+                    agents, rules, delay = [], [], None
+                    in_rules = False
+                agents.append(value.lower())
+            elif field in ('allow', 'disallow') and agents:
+                in_rules = True
+                if value:
+                    rules.append(self._compile(value, field == 'allow'))
+            elif field == 'crawl-delay' and agents:
+                in_rules = True
+                try:
+                    delay = float(value)
+                except ValueError:
+                    pass
+        if agents:
+            self._add_group(agents, rules, delay)
+
+    def _add_group(self, agents, rules, delay):
+        # longest match first, allow first on same length
+        rules.sort(key=lambda x: (-x[0], not x[1]))
+        group = (agents, rules, delay)
+        if '*' in agents and self.default is None:
+            self.default = group
+        self.groups.append(group)
+
+    @staticmethod
+    def _compile(path, allow):
+        path = _normalize_path(path)
+        if '*' not in path and not path.endswith('$'):
+            return (len(path), allow, path, None)
+        pattern = re.escape(path).replace(r'\*', '.*')
+        if pattern.endswith(r'\$'):
+            pattern = pattern[:-2] + '$'
+        return (len(path), allow, None, re.compile(pattern))
+
+    def _group(self, user_agent):
+        agent = (user_agent or '*').split('/')[0].lower()
+        if agent not in self._selected:
+            selected = self.default
+            for group in self.groups:
+                if any(x != '*' and x in agent for x in group[0]):
+                    selected = group
+                    break
+            self._selected[agent] = selected
+        return self._selected[agent]
+
+    def can_fetch(self, user_agent, url):
+        group = self._group(user_agent)
+        if group is None:
+            return True
+        parsed = urlsplit(url)
+        path = _normalize_path(urlunsplit(('', '', parsed.path or '/', parsed.query, '')))
+        for _, allow, prefix, regex in group[1]:
+            if prefix is not None:
+                if path.startswith(prefix):
+                    return allow
+            elif regex.match(path):
+                return allow
+        return True
+
+    def crawl_delay(self, user_agent):
+        group = self._group(user_agent)
+        return group[2] if group else None
+
+
+class SQLiteRobotsBackend(object):
+    '''robots.txt shared by fetcher processes on a host via a sqlite file'''
+
+    def __init__(self, path):
+        import sqlite3
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS robots ('
+                          'key TEXT PRIMARY KEY, content TEXT, expire REAL)')
+
+    def get(self, key):
+        row = self.conn.execute('SELECT content, expire FROM robots WHERE key = ?',
+                                (key, )).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row
+
+    def put(self, key, content, expire):
+        self.conn.execute('REPLACE INTO robots (key, content, expire) VALUES (?, ?, ?)',
+                          (key, content, expire))
+
+    def clear_expired(self):
+        self.conn.execute('DELETE FROM robots WHERE expire < ?', (time.time(), ))
+
+
+class RedisRobotsBackend(object):
+    '''robots.txt shared by fetchers via redis keys'''
+
+    def __init__(self, url, prefix='pyspider:robots:'):
+        import redis
+        self.redis = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.redis.get(self.prefix + key)
+        if value is None:
+            return None
+        value = json.loads(value)
+        return value['content'], value['expire']
+
+    def put(self, key, content, expire):
+        self.redis.set(self.prefix + key, json.dumps({'content': content, 'expire': expire}),
+                       ex=max(int(expire - time.time()), 1))
+
+    def clear_expired(self):
+        pass
+
+
+def connect_robots_backend(url):
+    """
+    create backend sharing robots.txt between fetchers
+
+    sqlite:
+        sqlite:///path/to/robots.db
+    redis:
+        redis://host:6379/db
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteRobotsBackend(url[len('sqlite:///'):])
+    elif url.startswith('redis://'):
+        return RedisRobotsBackend(url)
+    else:
+        raise Exception('unknown robots cache: %s' % url)
+
+
+class RobotsCache(object):
+    '''
+    LRU cache of robots.txt rules by scheme and host, entries expire after ttl
+
+    Concurrent lookups of a host not in cache share one load of robots.txt.
+    With a backend, robots.txt loaded by other fetchers is reused.
+    '''
+
+    def __init__(self, max_size=10000, ttl=3600, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.cache = collections.OrderedDict()  # key -> (rules, expire)
+        self._loading = {}
+
+    @staticmethod
+    def key_of(url):
+        parsed = urlsplit(url)
+        return '%s://%s' % (parsed.scheme, parsed.netloc)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get(self, key):
+        '''rules of key, None when not cached or expired'''
+        now = time.time()
+        if key in self.cache:
+            rules, expire = self.cache[key]
+            if expire > now:
+                self.cache.move_to_end(key)
+                return rules
+            del self.cache[key]
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logger.warning('get robots.txt of %s from backend error: %r', key, e)
+                value = None
+            if value is not None:
+                return self._set(key, RobotsRules(value[0]), value[1])
+        return None
+
+    def _set(self, key, rules, expire):
+        self.cache[key] = (rules, expire)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return rules
+
+    def put(self, key, content):
+        expire = time.time() + self.ttl
+        if self.backend is not None:
+            try:
+                self.backend.put(key, content, expire)
+            except Exception as e:
+                logger.warning('put robots.txt of %s to backend error: %r', key, e)
+        return self._set(key, RobotsRules(content), expire)
+
+    async def _load(self, key, load):
+        try:
+            content = await load(key + '/robots.txt')
+        except Exception as e:
+            logger.error('load robots.txt from %s error: %r', key, e)
+            content = None
+        return self.put(key, content)
+
+    async def rules(self, url, load):
+        '''
+        rules of host of url, `load` is a coroutine function returns content of
+        robots.txt url, or None when not available
+        '''
+        key = self.key_of(url)
+        rules = self.get(key)
+        if rules is not None:
+            return rules
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, load))
+            self._loading[key] = future
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def can_fetch(self, user_agent, url, load):
+        rules = await self.rules(url, load)
+        return rules.can_fetch(user_agent, url)
+
+    def clear_expired(self):
+        now = time.time()
+        for key in [k for k, (_, expire) in self.cache.items() if expire <= now]:
+            del self.cache[key]
+        if self.backend is not None:
+            try:
+                self.backend.clear_expired()
+            except Exception as e:
+                logger.warning('clear robots cache backend error: %r', e)
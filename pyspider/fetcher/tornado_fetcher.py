@@ -17,6 +17,7 @@ import logging
 import traceback
 import functools
 import threading
+import queue
 import tornado.ioloop
 import tornado.httputil
 import tornado.httpclient
@@ -31,7 +32,6 @@ import requests
 inject_into_urllib3()
 
 
-from urllib.robotparser import RobotFileParser
 from requests import cookies
 from urllib.parse import urljoin, urlsplit
 from tornado import gen
@@ -42,12 +42,20 @@ from tornado.curl_httpclient import CurlAsyncHTTPClient
 from tornado.simple_httpclient import SimpleAsyncHTTPClient
 
 from pyspider.libs import utils, dataurl, counter
+from pyspider.libs.body_store import offload_body
 from pyspider.libs.url import quote_chinese
+from pyspider.message_queue import get_many
 from .cookie_utils import extract_cookies_to_jar
+from .body_spool import BodySpool, clear_spool
+from .robots_cache import RobotsCache
+from .dns_cache import DNSCache
 logger = logging.getLogger('fetcher')
 
 
 class MyCurlAsyncHTTPClient(CurlAsyncHTTPClient):
+    # called with (url, number of new connections) when a request finished
+    connection_callback = None
+
     def __init__(self, *args, **kwargs):
         self.max_clients = kwargs.get('max_clients', 10)
         # In Python 3.13, we need to use a different approach
@@ -60,6 +68,16 @@ class MyCurlAsyncHTTPClient(CurlAsyncHTTPClient):
     def free_size(self):
         return len(self._free_list)
 
+    def _finish(self, curl, *args, **kwargs):
+        if self.connection_callback is not None and curl.info:
+            import pycurl
+            try:
+                self.connection_callback(curl.info['request'].url,
+                                         curl.getinfo(pycurl.NUM_CONNECTS))
+            except Exception as e:
+                logger.exception(e)
+        return super(MyCurlAsyncHTTPClient, self)._finish(curl, *args, **kwargs)
+
     def size(self):
         return len(self._curls) - self.free_size()
 
@@ -106,6 +124,35 @@ class Fetcher(object):
     puppeteer_proxy = 'http://localhost:22223'
     splash_lua_source = open(os.path.join(os.path.dirname(__file__), "splash_fetcher.lua")).read()
     robot_txt_age = 60*60  # 1h
+    robot_txt_cache_size = 10000  # hosts
+    dns_cache_ttl = 0  # max seconds a resolved host is cached, 0 to disable
+    dns_negative_ttl = 30
+    # disk-backed HTTPCache of responses, revalidated with conditional requests,
+    # served only from cache in offline mode
+    http_cache = None
+    http_cache_offline = False
+    # ProxyPool proxies are picked from when task has no proxy of its own
+    proxy_pool = None
+    # HostLimiter adapting concurrent requests per host, see host_limiter.py
+    host_limiter = None
+    # fetch_type 'http2', concurrent requests of a host are multiplexed over up
+    # to http2_connections connections
+    http2_connections = 2
+    intake_timeout = 1.0  # seconds intake thread blocks before checking quit
+    intake_error_interval = 1.0  # seconds intake thread waits after a failed get of inqueue
+    intake_batch = 100  # max tasks intake thread gets from inqueue in one round trip
+    # default limits of response body, can be overridden by max_body_size and
+    # spill_body_size of task, None for unlimited / never spill
+    max_body_size = None
+    spill_body_size = None
+    spill_dir = None
+    # spilled bodies, and bodies in shm / redis body store, are removed when loaded
+    # by processor, those never loaded are removed after spill_ttl
+    spill_ttl = 24*60*60  # 1d
+    # body store of response bodies sent to processor by reference, see
+    # libs.body_store.connect_body_store, bodies smaller than body_store_size are inlined
+    body_store = None
+    body_store_size = 64*1024
 
     def __init__(self, inqueue, outqueue, poolsize=100, proxy=None, async_mode=True):
         self.inqueue = inqueue
@@ -114,15 +161,19 @@ class Fetcher(object):
         self.poolsize = poolsize
         self._running = False
         self._quit = False
+        self._inflight = 0
         self.proxy = proxy
         self.async_mode = async_mode
         self.ioloop = tornado.ioloop.IOLoop.current()
 
-        self.robots_txt_cache = {}
+        self.robots_txt_cache = RobotsCache(self.robot_txt_cache_size, self.robot_txt_age)
 
         # binding io_loop to http_client here
         # In Python 3.13, we need to use AsyncHTTPClient directly to avoid event loop issues
         self.http_client = MyCurlAsyncHTTPClient(max_clients=self.poolsize)
+        self.http_client.connection_callback = self.on_connection
+        self.http2_client = None
+        self.dns_cache = DNSCache(self.dns_cache_ttl, self.dns_negative_ttl) if self.dns_cache_ttl else None
         # We don't use HTTPClient anymore as it causes event loop issues in Python 3.13
         # if not self.async_mode:
         #     self.http_client = tornado.httpclient.HTTPClient(MyCurlAsyncHTTPClient, max_clients=self.poolsize)
@@ -156,6 +207,13 @@ class Fetcher(object):
         '''Send fetch result to processor'''
         if self.outqueue:
             try:
+                if self.body_store is not None:
+                    result = offload_body(self.body_store, result, self.body_store_size)
+                if self.host_limiter is not None:
+                    # back-pressure, scheduler holds tasks of a throttled host
+                    backoff = self.host_limiter.backoff(urlsplit(task.get('url', '')).hostname)
+                    if backoff > result.get('backoff', 0):
+                        result['backoff'] = backoff
                 self.outqueue.put((task, result))
             except Exception as e:
                 logger.exception(e)
@@ -299,6 +357,8 @@ class Fetcher(object):
                 result = yield self.puppeteer_fetch(url, task)
             else:
                 fetch_type = 'http'
+                if task.get('fetch', {}).get('fetch_type') == 'http2':
+                    fetch_type = 'http2'
                 # In Python 3.13, we need to handle http_fetch differently to avoid event loop issues
                 try:
                     # Create a Future that will be resolved by http_fetch
@@ -396,7 +456,24 @@ class Fetcher(object):
 
     allowed_options = ['method', 'data', 'connect_timeout', 'timeout', 'cookies', 'use_gzip', 'validate_cert']
 
-    def pack_tornado_request_parameters(self, url, task):
+    def pick_proxy(self, url, task_fetch):
+        '''proxy of task, picked from proxy pool, or default proxy of fetcher'''
+        if isinstance(task_fetch.get('proxy'), str):
+            return task_fetch['proxy']
+        if not task_fetch.get('proxy', True):
+            return None
+        if self.proxy_pool is not None and len(self.proxy_pool):
+            return self.proxy_pool.choose(urlsplit(url).hostname)
+        return self.proxy
+
+    def report_proxy(self, proxy, url, result):
+        '''update health of proxy in pool with fetch result'''
+        if self.proxy_pool is None or proxy not in self.proxy_pool:
+            return
+        self.proxy_pool.report(proxy, urlsplit(url).hostname, result.get('status_code', 599),
+                               result.get('time'), result.get('content'))
+
+    def pack_tornado_request_parameters(self, url, task, proxy=None):
         fetch = copy.deepcopy(self.default_options)
         fetch['url'] = url
         fetch['headers'] = tornado.httputil.HTTPHeaders(fetch['headers'])
@@ -415,11 +492,7 @@ class Fetcher(object):
             track_headers = {}
             track_ok = False
         # proxy
-        proxy_string = None
-        if isinstance(task_fetch.get('proxy'), str):
-            proxy_string = task_fetch['proxy']
-        elif self.proxy and task_fetch.get('proxy', True):
-            proxy_string = self.proxy
+        proxy_string = proxy or self.pick_proxy(url, task_fetch)
         if proxy_string:
             if '://' not in proxy_string:
                 proxy_string = 'http://' + proxy_string
@@ -467,40 +540,52 @@ class Fetcher(object):
 
     @gen.coroutine
     def can_fetch(self, user_agent, url):
-        parsed = urlsplit(url)
-        domain = parsed.netloc
-        if domain in self.robots_txt_cache:
-            robot_txt = self.robots_txt_cache[domain]
-            if time.time() - robot_txt.mtime() > self.robot_txt_age:
-                robot_txt = None
-        else:
-            robot_txt = None
-
-        if robot_txt is None:
-            robot_txt = RobotFileParser()
-            try:
-                response = yield gen.maybe_future(self.http_client.fetch(
-                    urljoin(url, '/robots.txt'), connect_timeout=10, request_timeout=30))
-                content = response.body
-            except tornado.httpclient.HTTPError as e:
-                logger.error('load robots.txt from %s error: %r', domain, e)
-                content = ''
-
-            try:
-                content = content.decode('utf8', 'ignore')
-            except UnicodeDecodeError:
-                content = ''
-
-            robot_txt.parse(content.splitlines())
-            self.robots_txt_cache[domain] = robot_txt
+        result = yield self.robots_txt_cache.can_fetch(user_agent, url, self.load_robots_txt)
+        raise gen.Return(result)
 
-        raise gen.Return(robot_txt.can_fetch(user_agent, url))
+    @gen.coroutine
+    def load_robots_txt(self, url):
+        try:
+            response = yield gen.maybe_future(self.http_client.fetch(
+                url, connect_timeout=10, request_timeout=30))
+        except tornado.httpclient.HTTPError as e:
+            logger.error('load robots.txt from %s error: %r', url, e)
+            raise gen.Return(None)
+        raise gen.Return((response.body or b'').decode('utf8', 'ignore'))
 
     def clear_robot_txt_cache(self):
-        now = time.time()
-        for domain, robot_txt in self.robots_txt_cache.items():
-            if now - robot_txt.mtime() > self.robot_txt_age:
-                del self.robots_txt_cache[domain]
+        self.robots_txt_cache.clear_expired()
+
+    @staticmethod
+    def prepare_curl(curl, spool=None, resolve=None, http2=None):
+        '''pin resolved address of host, stream body to spool, and speak http2'''
+        import pycurl
+        if resolve:
+            curl.setopt(pycurl.RESOLVE, resolve)
+        if spool is not None:
+            spool.prepare_curl(curl)
+        if http2:
+            # negotiated by ALPN over https, prior knowledge (h2c) over http
+            curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2TLS if http2 == 'https'
+                        else pycurl.CURL_HTTP_VERSION_2_PRIOR_KNOWLEDGE)
+            # wait for a connection to multiplex on, instead of opening a new one
+            curl.setopt(pycurl.PIPEWAIT, 1)
+
+    def get_http2_client(self):
+        '''curl client of fetch_type http2, multiplexing requests of a host'''
+        if self.http2_client is None:
+            import pycurl
+            client = MyCurlAsyncHTTPClient(force_instance=True, max_clients=self.poolsize)
+            client.connection_callback = self.on_connection
+            client._multi.setopt(pycurl.M_PIPELINING, pycurl.PIPE_MULTIPLEX)
+            client._multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, self.http2_connections)
+            self.http2_client = client
+        return self.http2_client
+
+    def clear_spool(self):
+        clear_spool(self.spill_dir, self.spill_ttl)
+        if hasattr(self.body_store, 'clear'):
+            self.body_store.clear(self.spill_ttl)
 
     @gen.coroutine
     def http_fetch(self, url, task):
@@ -510,8 +595,11 @@ class Fetcher(object):
         handle_error = lambda x: self.handle_error('http', url, task, start_time, x)
 
         # setup request parameters
-        fetch = self.pack_tornado_request_parameters(url, task)
         task_fetch = task.get('fetch', {})
+        http2 = task_fetch.get('fetch_type') == 'http2'
+        client = self.get_http2_client() if http2 else self.http_client
+        proxy = self.pick_proxy(url, task_fetch)
+        fetch = self.pack_tornado_request_parameters(url, task, proxy)
 
         session = cookies.RequestsCookieJar()
         # fix for tornado request obj
@@ -528,6 +616,24 @@ class Fetcher(object):
             session.update(fetch['cookies'])
             del fetch['cookies']
 
+        # http cache
+        cache_key = cache_entry = None
+        if (self.http_cache is not None and task_fetch.get('http_cache', True)
+                and fetch['method'].upper() in ('GET', 'HEAD')):
+            cache_key = self.http_cache.key(fetch['method'], url, fetch.get('body'))
+            cache_entry = yield self.http_cache_call(self.http_cache.get, cache_key)
+            if self.http_cache_offline or task_fetch.get('http_cache') == 'offline':
+                if cache_entry is None:
+                    error = tornado.httpclient.HTTPError(599, 'Not in http cache (offline)')
+                    raise gen.Return(handle_error(error))
+                raise gen.Return(self.cached_result(url, task, cache_entry, start_time))
+            if cache_entry is not None:
+                headers = tornado.httputil.HTTPHeaders(cache_entry['headers'])
+                if headers.get('etag') and 'If-None-Match' not in fetch['headers']:
+                    fetch['headers']['If-None-Match'] = headers['etag']
+                if headers.get('last-modified') and 'If-Modified-Since' not in fetch['headers']:
+                    fetch['headers']['If-Modified-Since'] = headers['last-modified']
+
         max_redirects = task_fetch.get('max_redirects', 5)
         # we will handle redirects by hand to capture cookies
         fetch['follow_redirects'] = False
@@ -541,6 +647,27 @@ class Fetcher(object):
                     error = tornado.httpclient.HTTPError(403, 'Disallowed by robots.txt')
                     raise gen.Return(handle_error(error))
 
+            resolve = None
+            parsed = urlsplit(fetch['url'])
+            if self.dns_cache is not None and 'proxy_host' not in fetch and parsed.hostname:
+                try:
+                    addresses = yield self.dns_cache.resolve(parsed.hostname)
+                    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+                except Exception as e:
+                    raise gen.Return(handle_error(e))
+                # all addresses, curl falls back to the next when one fails to connect
+                resolve = ['%s:%d:%s' % (parsed.hostname, port, ','.join(
+                    '[%s]' % x if ':' in x else x for x in addresses))]
+
+            spool = BodySpool.for_task(task_fetch, self.max_body_size,
+                                       self.spill_body_size, self.spill_dir)
+            if spool is not None:
+                fetch['header_callback'] = spool.on_header
+            if spool is not None or resolve or http2:
+                fetch['prepare_curl_callback'] = functools.partial(
+                    self.prepare_curl, spool=spool, resolve=resolve,
+                    http2=parsed.scheme if http2 else None)
+
             try:
                 request = tornado.httpclient.HTTPRequest(**fetch)
                 # if cookie already in header, get_cookie_header wouldn't work
@@ -564,7 +691,8 @@ class Fetcher(object):
                     future = tornado.concurrent.Future()
                     try:
                         # Use AsyncHTTPClient directly without run_sync
-                        response_future = self.http_client.fetch(request, raise_error=False)
+                        response_future = self.limited_fetch(parsed.hostname, request, spool,
+                                                             client, raise_error=False)
                         # Wait for the response using a callback
                         def on_response(f):
                             try:
@@ -578,12 +706,28 @@ class Fetcher(object):
                         raise
                 else:
                     # For async mode, we can use the future directly
-                    response = yield self.http_client.fetch(request, raise_error=False)
+                    response = yield self.limited_fetch(parsed.hostname, request, spool,
+                                                        client, raise_error=False)
             except tornado.httpclient.HTTPError as e:
                 if e.response:
                     response = e.response
+                elif spool is not None and spool.aborted:
+                    spool.discard()
+                    error = tornado.httpclient.HTTPError(
+                        599, 'Response body larger than max_body_size %d' % spool.max_size)
+                    raise gen.Return(handle_error(error))
+                elif spool is not None and spool.truncated:
+                    # transfer is stopped by spool, which failed with a write error of curl
+                    headers = tornado.httputil.HTTPHeaders()
+                    for line in spool.header_lines:
+                        headers.parse_line(line)
+                    response = tornado.httpclient.HTTPResponse(
+                        request, spool.status_code or 200, headers=headers,
+                        effective_url=fetch['url'])
                 else:
-                    raise gen.Return(handle_error(e))
+                    result = handle_error(e)
+                    self.report_proxy(proxy, url, result)
+                    raise gen.Return(result)
 
             extract_cookies_to_jar(session, response.request, response.headers)
             if (response.code in (301, 302, 303, 307)
@@ -603,11 +747,32 @@ class Fetcher(object):
                 if fetch['request_timeout'] < 0:
                     fetch['request_timeout'] = 0.1
                 max_redirects -= 1
+                if spool is not None:
+                    spool.discard()
                 continue
 
+            if response.code == 304 and cache_entry is not None:
+                # not modified, serve the cached response with updated headers
+                cache_entry['headers'].update(
+                    (k, v) for k, v in response.headers.items()
+                    if k.lower() not in ('content-length', 'content-encoding', 'transfer-encoding'))
+                yield self.http_cache_call(self.http_cache.put, cache_key, cache_entry)
+                result = self.cached_result(url, task, cache_entry, start_time)
+                result['cookies'] = session.get_dict()
+                self.report_proxy(proxy, url, result)
+                raise gen.Return(result)
+
             result = {}
             result['orig_url'] = url
-            result['content'] = response.body or ''
+            if spool is not None:
+                result['content'], content_ref = spool.finish()
+                result['content_length'] = spool.size
+                if content_ref:
+                    result['content_ref'] = content_ref
+                if spool.truncated:
+                    result['truncated'] = True
+            else:
+                result['content'] = response.body or ''
             result['headers'] = dict(response.headers)
             result['status_code'] = response.code
             result['url'] = response.effective_url or url
@@ -616,6 +781,9 @@ class Fetcher(object):
             result['save'] = task_fetch.get('save')
             if response.error:
                 result['error'] = utils.text(response.error)
+            if cache_key is not None and self.http_cache.cacheable(result):
+                yield self.http_cache_call(self.http_cache.put, cache_key, result)
+            self.report_proxy(proxy, url, result)
             if 200 <= response.code < 300:
                 logger.info("[%d] %s:%s %s %.2fs", response.code,
                             task.get('project'), task.get('taskid'),
@@ -627,6 +795,51 @@ class Fetcher(object):
 
             raise gen.Return(result)
 
+    @gen.coroutine
+    def limited_fetch(self, host, request, spool=None, client=None, **kwargs):
+        '''fetch request once allowed by host limiter, and feed the response back to it'''
+        client = client or self.http_client
+        if self.host_limiter is None or not host:
+            response = yield client.fetch(request, **kwargs)
+            raise gen.Return(response)
+        yield self.host_limiter.acquire(host)
+        start_time = time.time()
+        status_code, headers = 599, None
+        try:
+            response = yield client.fetch(request, **kwargs)
+            status_code, headers = response.code, response.headers
+        except tornado.httpclient.HTTPError as e:
+            if e.response is not None:
+                status_code, headers = e.response.code, e.response.headers
+            elif spool is not None and spool.stopped:
+                # stopped by spool, not a failure of host
+                status_code = spool.status_code or 200
+            raise
+        finally:
+            self.host_limiter.release(host, status_code, time.time() - start_time, headers)
+        raise gen.Return(response)
+
+    def http_cache_call(self, method, *args):
+        '''call method of http cache in thread pool, it's blocked by disk'''
+        return tornado.ioloop.IOLoop.current().run_in_executor(None, method, *args)
+
+    def cached_result(self, url, task, cache_entry, start_time):
+        '''fetch result of a response from http cache'''
+        result = {
+            'orig_url': url,
+            'url': cache_entry['url'] or url,
+            'status_code': cache_entry['status_code'],
+            'headers': cache_entry['headers'],
+            'content': cache_entry['content'],
+            'cookies': {},
+            'time': time.time() - start_time,
+            'save': task.get('fetch', {}).get('save'),
+            'from_cache': True,
+        }
+        logger.info("[%d] %s:%s %s (cached) %.2fs", result['status_code'],
+                    task.get('project'), task.get('taskid'), url, result['time'])
+        return result
+
     # phantomjs_fetch method has been removed as PhantomJS is deprecated
     # js/phantomjs fetch_type is now redirected to puppeteer_fetch
 
@@ -889,34 +1102,100 @@ class Fetcher(object):
 
         raise gen.Return(result)
 
+    def _intake_loop(self):
+        '''
+        Intake thread, blocks on inqueue and hands tasks to ioloop
+
+        A slot of the pool is taken before waiting for a task, and given back as
+        soon as the fetch is done, so a completion wakes the thread to pull the
+        next task at once, and the pool is kept saturated without polling. All
+        free slots are filled with one get of inqueue.
+        '''
+        while not self._quit:
+            if not self._slots.acquire(timeout=self.intake_timeout):
+                continue
+            # take all free slots, up to intake_batch, to get tasks in one round trip
+            slots = 1
+            while slots < self.intake_batch and self._slots.acquire(blocking=False):
+                slots += 1
+            tasks = []
+            failed = False
+            try:
+                while not self._quit and self.outqueue.full():
+                    time.sleep(self.intake_timeout / 10)
+                if not self._quit:
+                    tasks = get_many(self.inqueue, slots, timeout=self.intake_timeout)
+            except queue.Empty:
+                pass
+            except KeyboardInterrupt:
+                for _ in range(slots):
+                    self._slots.release()
+                break
+            except Exception as e:
+                logger.exception(e)
+                failed = True
+            for _ in range(slots - len(tasks)):
+                self._slots.release()
+            if failed:
+                # a broken connection of inqueue, don't retry in a hot loop
+                time.sleep(self.intake_error_interval)
+            for task in tasks:
+                # FIXME: decode unicode_obj should used after data selete from
+                # database, it's used here for performance
+                self.ioloop.add_callback(self._dispatch, utils.decode_unicode_obj(task))
+
+    def deferred_result(self, task, seconds):
+        '''fetch result of a task sent back without fetched, its host is throttled'''
+        url = task.get('url', '')
+        return {
+            'status_code': 599,
+            'error': 'host %s is throttled, deferred for %.1fs' % (urlsplit(url).hostname, seconds),
+            'orig_url': url,
+            'url': url,
+            'headers': {},
+            'content': '',
+            'cookies': {},
+            'time': 0,
+            'save': task.get('fetch', {}).get('save'),
+            'deferred': True,
+            'backoff': seconds,
+        }
+
+    def _dispatch(self, task):
+        '''start fetching task in ioloop, slot is released when fetch done'''
+        if self.host_limiter is not None:
+            # a task of blocked or busy host doesn't take a slot waiting for it
+            defer = self.host_limiter.defer(urlsplit(task.get('url') or '').hostname)
+            if defer:
+                self.send_result('http', task, self.deferred_result(task, defer))
+                self._slots.release()
+                return
+        self._inflight += 1
+        try:
+            future = self.fetch(task)
+        except Exception as e:
+            logger.exception(e)
+            self._on_dispatch_done(None)
+            return
+        if not gen.is_future(future):
+            # result of fetch without async_mode, done already
+            self._on_dispatch_done(None)
+            return
+        future.add_done_callback(self._on_dispatch_done)
+
+    def _on_dispatch_done(self, future):
+        self._inflight -= 1
+        self._slots.release()
+
     def run(self):
         '''Run loop'''
         logger.info("fetcher starting...")
 
-        def queue_loop():
-            if not self.outqueue or not self.inqueue:
-                return
-            while not self._quit:
-                try:
-                    if self.outqueue.full():
-                        break
-                    if self.http_client.free_size() <= 0:
-                        break
-                    task = self.inqueue.get_nowait()
-                    # FIXME: decode unicode_obj should used after data selete from
-                    # database, it's used here for performance
-                    task = utils.decode_unicode_obj(task)
-                    self.fetch(task)
-                except Exception as empty_error:  # Handle queue.Empty
-                    break
-                except KeyboardInterrupt:
-                    break
-                except Exception as e:
-                    logger.exception(e)
-                    break
-
-        tornado.ioloop.PeriodicCallback(queue_loop, 100).start()
+        if self.outqueue and self.inqueue:
+            self._slots = threading.BoundedSemaphore(self.poolsize)
+            self._intake_thread = utils.run_in_thread(self._intake_loop)
         tornado.ioloop.PeriodicCallback(self.clear_robot_txt_cache, 10000).start()
+        tornado.ioloop.PeriodicCallback(self.clear_spool, 60000).start()
         self._running = True
 
         try:
@@ -936,6 +1215,8 @@ class Fetcher(object):
             self.xmlrpc_ioloop.add_callback(self.xmlrpc_ioloop.stop)
 
     def size(self):
+        if self.http2_client is not None:
+            return self.http_client.size() + self.http2_client.size()
         return self.http_client.size()
 
     def xmlrpc_run(self, port=24444, bind='127.0.0.1', log_requests=False):
@@ -982,6 +1263,18 @@ class Fetcher(object):
             return self._cnt[_time].to_dict(_type)
         application.register_function(dump_counter, 'counter')
 
+        def dns_stats():
+            return self.dns_cache.stats() if self.dns_cache is not None else {}
+        application.register_function(dns_stats, 'dns_stats')
+
+        def proxy_stats():
+            return self.proxy_pool.stats() if self.proxy_pool is not None else []
+        application.register_function(proxy_stats, 'proxy_stats')
+
+        def host_stats():
+            return self.host_limiter.stats() if self.host_limiter is not None else {}
+        application.register_function(host_stats, 'host_stats')
+
         import tornado.wsgi
         import tornado.ioloop
         import tornado.httpserver
@@ -1014,6 +1307,13 @@ class Fetcher(object):
             }
         })
 
+    def on_connection(self, url, new_connections):
+        '''Called when a http request finished, count keep-alive connection reuse by host'''
+        host = urlsplit(url).hostname
+        reused = 0 if new_connections else 1
+        self._cnt['5m'].event(('_hosts', host, 'reuse'), reused)
+        self._cnt['1h'].event(('_hosts', host, 'reuse'), reused)
+
     def on_result(self, fetch_type, task, result):
         '''Called after task fetched'''
         status_code = result.get('status_code', 599)
@@ -1022,8 +1322,8 @@ class Fetcher(object):
         self._cnt['5m'].event((task.get('project'), status_code), +1)
         self._cnt['1h'].event((task.get('project'), status_code), +1)
 
-        if fetch_type in ('http', 'phantomjs') and result.get('time'):
-            content_len = len(result.get('content', ''))
+        if fetch_type in ('http', 'http2', 'phantomjs') and result.get('time'):
+            content_len = result.get('content_length') or len(result.get('content', ''))
             self._cnt['5m'].event((task.get('project'), 'speed'),
                                   float(content_len) / result.get('time'))
             self._cnt['1h'].event((task.get('project'), 'speed'),
@@ -223,7 +223,8 @@ class BaseHandler(object, metaclass=BaseHandlerMeta):
     fetch_fields = ('method', 'headers', 'user_agent', 'data', 'connect_timeout', 'timeout', 'allow_redirects', 'cookies',
                     'proxy', 'etag', 'last_modifed', 'last_modified', 'save', 'js_run_at', 'js_script',
                     'js_viewport_width', 'js_viewport_height', 'load_images', 'fetch_type', 'use_gzip', 'validate_cert',
-                    'max_redirects', 'robots_txt')
+                    'max_redirects', 'robots_txt', 'max_body_size', 'body_overflow', 'spill_body_size',
+                    'http_cache')
     process_fields = ('callback', 'process_time_limit')
 
     @staticmethod
@@ -17,6 +17,7 @@ from pyspider.fetcher.tornado_fetcher import Fetcher
 from pyspider.processor import Processor
 from pyspider.result import ResultWorker
 from pyspider.libs.utils import md5string
+from pyspider.message_queue import get_many, put_many
 
 
 def bench_test_taskdb(taskdb):
@@ -168,11 +169,43 @@ def bench_test_message_queue(queue):
         logger.info("cost %.2fs, %.2f/s %.2fms",
                     cost_time, n * 1.0 / cost_time, cost_time / n * 1000)
 
+    def test_put_many(n, batch=100):
+        logger.info("message queue put_many %d, batch %d", n, batch)
+        start_time = time.time()
+        for i in range(0, n, batch):
+            tasks = []
+            for j in range(i, min(i + batch, n)):
+                task['url'] = 'http://bench.pyspider.org/?l=%d' % j
+                task['taskid'] = md5string(task['url'])
+                tasks.append(dict(task))
+            put_many(queue, tasks, block=True, timeout=1)
+        end_time = time.time()
+        cost_time = end_time - start_time
+        logger.info("cost %.2fs, %.2f/s %.2fms",
+                    cost_time, n * 1.0 / cost_time, cost_time / n * 1000)
+
+    def test_get_many(n, batch=100):
+        logger.info("message queue get_many %d, batch %d", n, batch)
+        start_time = time.time()
+        got = 0
+        while got < n:
+            try:
+                got += len(get_many(queue, min(batch, n - got), True, 1))
+            except Queue.Empty:
+                logger.error('message queue empty while get %d', got)
+                raise
+        end_time = time.time()
+        cost_time = end_time - start_time
+        logger.info("cost %.2fs, %.2f/s %.2fms",
+                    cost_time, n * 1.0 / cost_time, cost_time / n * 1000)
+
     try:
         test_put(1000)
         test_get(1000)
         test_put(10000)
         test_get(10000)
+        test_put_many(10000)
+        test_get_many(10000)
     except Exception as e:
         logger.exception(e)
     finally:
@@ -187,6 +220,35 @@ def bench_test_message_queue(queue):
             pass
 
 
+def bench_test_task_queue(task_queue_cls, n=100000):
+    import tracemalloc
+
+    def measure(name, func):
+        start_time = time.time()
+        func()
+        cost_time = time.time() - start_time
+        logger.info("%s %s %d cost %.2fs, %.2f/s %.2fms", task_queue_cls.__name__,
+                    name, n, cost_time, n * 1.0 / cost_time, cost_time / n * 1000)
+
+    urls = ['http://bench.pyspider.org/?l=%d' % i for i in range(n)]
+    tracemalloc.start()
+    try:
+        task_queue = task_queue_cls(rate=0, burst=0)
+        task_queue.rate = task_queue.burst = n * 10
+        task_queue.processing_timeout = 3600
+        before = tracemalloc.get_traced_memory()[0]
+        # taskids are new strings for every put, as they are decoded from messages
+        measure('put', lambda: [task_queue.put(md5string(url), i % 10)
+                                for i, url in enumerate(urls)])
+        memory = tracemalloc.get_traced_memory()[0] - before
+        logger.info("%s memory of %d tasks: %.2fMB, %.1f bytes/task", task_queue_cls.__name__,
+                    n, memory / 1024.0 / 1024, memory * 1.0 / n)
+        measure('get', lambda: [task_queue.get() for _ in range(n)])
+        measure('done', lambda: [task_queue.done(md5string(url)) for url in urls])
+    finally:
+        tracemalloc.stop()
+
+
 class BenchMixin(object):
     """Report to logger for bench test"""
     def _bench_init(self):
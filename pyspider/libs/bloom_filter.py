@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import math
+import struct
+import hashlib
+import logging
+import threading
+
+from pyspider.libs import utils
+
+logger = logging.getLogger('bloom_filter')
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of strings
+
+    `key not in filter` is never wrong, `key in filter` is wrong with
+    probability about error_rate as long as no more than capacity keys are added.
+    The bit array is bounded by max_bytes, error rate grows instead when capacity
+    needs more memory than that.
+    """
+
+    MAGIC = b'PYSBLOOM1'
+    HEADER = struct.Struct('<QQQd')  # num_bits, num_hashes, count, error_rate
+
+    def __init__(self, capacity, error_rate=0.001, max_bytes=None):
+        capacity = max(int(capacity), 1)
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        if max_bytes:
+            num_bits = min(num_bits, int(max_bytes) * 8)
+        nbytes = max((num_bits + 7) // 8, 1)
+
+        self.error_rate = error_rate
+        self.bits = bytearray(nbytes)
+        self.num_bits = nbytes * 8
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.count = 0
+        self.mutex = threading.Lock()
+        self.changed = False
+
+    @property
+    def capacity(self):
+        '''number of keys the filter can hold with error_rate'''
+        return int(-self.num_bits * (math.log(2) ** 2) / math.log(self.error_rate))
+
+    def _indexes(self, key):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(utils.utf8(key)).digest())
+        h2 |= 1
+        num_bits = self.num_bits
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % num_bits
+
+    def add(self, key):
+        '''add key to filter, return True if key was not in filter'''
+        new = False
+        bits = self.bits
+        with self.mutex:
+            for i in self._indexes(key):
+                mask = 1 << (i & 7)
+                if not bits[i >> 3] & mask:
+                    bits[i >> 3] |= mask
+                    new = True
+            self.count += 1
+            self.changed = True
+        return new
+
+    def __contains__(self, key):
+        bits = self.bits
+        for i in self._indexes(key):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def dump(self, filename):
+        '''Dump filter to file'''
+        tmp = '%s.tmp' % filename
+        try:
+            with self.mutex:
+                with open(tmp, 'wb') as fp:
+                    fp.write(self.MAGIC)
+                    fp.write(self.HEADER.pack(self.num_bits, self.num_hashes,
+                                              self.count, self.error_rate))
+                    fp.write(self.bits)
+                self.changed = False
+            os.replace(tmp, filename)
+        except Exception as e:
+            logger.warning("can't dump bloom filter to file %s: %s", filename, e)
+            return False
+        return True
+
+    @classmethod
+    def load(cls, filename):
+        '''Load filter from file, return None if file is missing or broken'''
+        try:
+            with open(filename, 'rb') as fp:
+                if fp.read(len(cls.MAGIC)) != cls.MAGIC:
+                    raise ValueError('bad magic')
+                num_bits, num_hashes, count, error_rate = cls.HEADER.unpack(
+                    fp.read(cls.HEADER.size))
+                bits = bytearray(fp.read())
+            if len(bits) * 8 != num_bits:
+                raise ValueError('truncated file')
+        except Exception as e:
+            logger.debug("can't load bloom filter from file %s: %s", filename, e)
+            return None
+
+        self = cls.__new__(cls)
+        self.error_rate = error_rate
+        self.bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = count
+        self.mutex = threading.Lock()
+        self.changed = False
+        return self
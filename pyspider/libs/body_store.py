@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import mmap
+import time
+import uuid
+import hashlib
+import logging
+
+from urllib.parse import urlparse
+
+logger = logging.getLogger('body_store')
+
+
+class FileBodyStore(object):
+    '''
+    response bodies as files named by sha1 of content under a directory,
+    files are kept until removed by `clear`, so same content is written once
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+
+    def put(self, content):
+        path = os.path.join(self.path, hashlib.sha1(content).hexdigest())
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+            with open(tmp, 'wb') as fp:
+                fp.write(content)
+            os.replace(tmp, path)
+        return 'file://' + path
+
+    @staticmethod
+    def load(ref, remove=False):
+        '''body mapped from file, the file is removed after mapped with `remove`'''
+        path = urlparse(ref).path
+        with open(path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                body = b''
+            else:
+                body = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        if remove:
+            # the mapping stays readable after the file is unlinked
+            os.remove(path)
+        return body
+
+    def clear(self, ttl=3600):
+        '''remove bodies older than ttl seconds'''
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if now - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+            except OSError as e:
+                logger.debug("can't remove body %s: %s", path, e)
+
+
+class SharedMemoryBodyStore(object):
+    '''
+    response bodies in shared memory segments, for components on one host,
+    a segment is unlinked when the body is loaded
+
+    segments not loaded, when processor is down or fails, are removed by
+    `clear` after ttl, found in /dev/shm by name prefix
+    '''
+
+    prefix = 'pysb_'
+    path = '/dev/shm'
+
+    def put(self, content):
+        # short names, macOS limits them to 31 characters
+        shm = _shared_memory(name=self.prefix + uuid.uuid4().hex[:24], create=True,
+                             size=max(len(content), 1))
+        shm.buf[:len(content)] = content
+        ref = 'shm://%s/%d' % (shm.name.lstrip('/'), len(content))
+        shm.close()
+        return ref
+
+    @staticmethod
+    def load(ref):
+        parsed = urlparse(ref)
+        shm = _shared_memory(name=parsed.netloc)
+        try:
+            return bytes(shm.buf[:int(parsed.path.strip('/'))])
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def clear(self, ttl=3600):
+        '''remove bodies older than ttl seconds, on systems listing segments in /dev/shm'''
+        if not os.path.isdir(self.path):
+            return
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.startswith(self.prefix):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                if now - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+            except OSError as e:
+                logger.debug("can't remove body %s: %s", path, e)
+
+
+def _shared_memory(**kwargs):
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(track=False, **kwargs)
+    except TypeError:
+        # python < 3.13, segments are unlinked by reader, not resource tracker
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(**kwargs)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class RedisBodyStore(object):
+    '''
+    response bodies in redis keys expiring after ttl seconds,
+    a key is deleted when the body is loaded
+    '''
+
+    def __init__(self, url, ttl=3600, prefix='pyspider:body:'):
+        self.url = url.rstrip('/')
+        self.ttl = ttl
+        self.prefix = prefix
+        self.redis = _redis(self.url)
+
+    def put(self, content):
+        key = self.prefix + uuid.uuid4().hex
+        self.redis.set(key, content, ex=self.ttl)
+        return '%s/%s' % (self.url, key)
+
+    @staticmethod
+    def load(ref):
+        url, key = ref.rsplit('/', 1)
+        redis = _redis(url)
+        pipe = redis.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        content = pipe.execute()[0]
+        if content is None:
+            raise KeyError('body %s expired' % ref)
+        return content
+
+
+_redis_clients = {}
+
+
+def _redis(url):
+    if url not in _redis_clients:
+        import redis
+        _redis_clients[url] = redis.StrictRedis.from_url(url)
+    return _redis_clients[url]
+
+
+def connect_body_store(url, ttl=3600):
+    """
+    create body store for response bodies passed to processor by reference
+
+    shared memory:
+        shm://
+    directory:
+        file:///path/to/dir
+    redis:
+        redis://host:6379/db
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'shm':
+        return SharedMemoryBodyStore()
+    elif parsed.scheme == 'file':
+        return FileBodyStore(parsed.path)
+    elif parsed.scheme == 'redis':
+        return RedisBodyStore(url, ttl=ttl)
+    else:
+        raise Exception('unknown body store: %s' % url)
+
+
+def load_body(ref):
+    '''
+    load body by reference, as bytes or memoryview
+
+    bodies in shared memory, redis, and spilled to file by fetcher (`spool://`)
+    are removed once loaded, loading them again raises FileNotFoundError or
+    KeyError.
+    '''
+    scheme = urlparse(ref).scheme
+    if scheme == 'file':
+        return FileBodyStore.load(ref)
+    elif scheme == 'spool':
+        return FileBodyStore.load(ref, remove=True)
+    elif scheme == 'shm':
+        return SharedMemoryBodyStore.load(ref)
+    elif scheme == 'redis':
+        return RedisBodyStore.load(ref)
+    raise ValueError('unknown body reference: %r' % ref)
+
+
+def offload_body(store, result, min_size=0):
+    '''put content of fetch result larger than min_size to store, return result with reference'''
+    content = result.get('content')
+    if not isinstance(content, bytes) or not content or len(content) < min_size \
+            or result.get('content_ref'):
+        return result
+    result = dict(result)
+    result['content_ref'] = store.put(content)
+    result['content_length'] = len(content)
+    result['content'] = b''
+    return result
@@ -18,6 +18,7 @@ from pyquery import PyQuery
 from requests.structures import CaseInsensitiveDict
 from requests import HTTPError
 from pyspider.libs import utils
+from pyspider.libs.body_store import load_body
 from pyspider.libs.advanced_selector import AdvancedSelector
 from pyspider.libs.structured_data import StructuredDataExtractor
 from pyspider.libs.multimedia import MultimediaProcessor
@@ -32,14 +33,16 @@ from pyspider.libs.selector_error_handler import SelectorErrorHandler
 class Response(object):
 
     def __init__(self, status_code=None, url=None, orig_url=None, headers=CaseInsensitiveDict(),
-                 content='', cookies=None, error=None, traceback=None, save=None, js_script_result=None, time=0):
+                 content='', cookies=None, error=None, traceback=None, save=None, js_script_result=None, time=0,
+                 content_ref=None):
         if cookies is None:
             cookies = {}
         self.status_code = status_code
         self.url = url
         self.orig_url = orig_url
         self.headers = headers
-        self.content = content
+        self.content_ref = content_ref
+        self._content = content
         self.cookies = cookies
         self.error = error
         self.traceback = traceback
@@ -61,6 +64,20 @@ class Response(object):
     def __repr__(self):
         return u'<Response [%d]>' % self.status_code
 
+    @property
+    def content(self):
+        """
+        content of response, a body passed by reference is loaded from body store
+        on first access.
+        """
+        if self._content is None and self.content_ref:
+            self._content = bytes(load_body(self.content_ref))
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
     def __bool__(self):
         """Returns true if `status_code` is 200 and no error"""
         return self.ok
@@ -412,7 +429,8 @@ def rebuild_response(r):
         status_code=r.get('status_code', 599),
         url=r.get('url', ''),
         headers=CaseInsensitiveDict(r.get('headers', {})),
-        content=r.get('content', ''),
+        content=None if r.get('content_ref') else r.get('content', ''),
+        content_ref=r.get('content_ref'),
         cookies=r.get('cookies', {}),
         error=r.get('error'),
         traceback=r.get('traceback'),
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import pickle
+import struct
+import weakref
+import multiprocessing
+import queue as BaseQueue
+from multiprocessing import shared_memory
+
+from pyspider.libs.body_store import _shared_memory
+
+# head and tail as offsets growing forever, message count
+HEADER = struct.Struct('<QQQ')
+# length of record, records of OVERFLOW hold name of a segment with the message
+RECORD = struct.Struct('<I')
+OVERFLOW = 0x80000000
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+
+
+def shm_available(size):
+    '''if size bytes of shared memory are free, /dev/shm of a docker container is 64MB'''
+    if os.path.isdir('/dev/shm'):
+        stat = os.statvfs('/dev/shm')
+        return stat.f_bavail * stat.f_frsize >= size
+    try:
+        # shm_open without a tmpfs, like macOS
+        shm = shared_memory.SharedMemory(create=True, size=1)
+    except OSError:
+        return False
+    shm.close()
+    shm.unlink()
+    return True
+
+
+def _release(shm, owner):
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    if os.getpid() == owner:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedMemoryQueue(object):
+    '''
+    Multi-producer multi-consumer queue of processes on one host, over a ring
+    buffer in shared memory
+
+    Messages are pickled to records of a length and the bytes, copied in and
+    out of the ring under a process shared lock, and waits for messages or
+    room are on conditions, without polling. A message larger than a quarter
+    of `capacity` is put in a segment of its own, and the ring holds its name.
+
+    qsize counts messages in the ring, `full` is true when there are `maxsize`
+    messages or the ring has no room for one more record. The ring is unlinked
+    when the queue is collected in the process created it.
+    '''
+
+    Empty = BaseQueue.Empty
+    Full = BaseQueue.Full
+
+    def __init__(self, maxsize=0, capacity=DEFAULT_CAPACITY):
+        self.maxsize = maxsize
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity)
+        HEADER.pack_into(self.shm.buf, 0, 0, 0, 0)
+        self.lock = multiprocessing.Lock()
+        self.not_empty = multiprocessing.Condition(self.lock)
+        self.not_full = multiprocessing.Condition(self.lock)
+        self._finalizer = weakref.finalize(self, _release, self.shm, os.getpid())
+
+    def __getstate__(self):
+        # sync primitives can only be pickled for spawning a process, like multiprocessing.Queue
+        return (self.maxsize, self.capacity, self.shm.name,
+                self.lock, self.not_empty, self.not_full)
+
+    def __setstate__(self, state):
+        self.maxsize, self.capacity, name, self.lock, self.not_empty, self.not_full = state
+        self.shm = _shared_memory(name=name)
+        self._finalizer = weakref.finalize(self, _release, self.shm, None)
+
+    def close(self):
+        self._finalizer()
+
+    def _header(self):
+        return HEADER.unpack_from(self.shm.buf, 0)
+
+    def _write(self, pos, data):
+        pos %= self.capacity
+        first = min(len(data), self.capacity - pos)
+        offset = HEADER.size + pos
+        self.shm.buf[offset:offset + first] = data[:first]
+        if first < len(data):
+            self.shm.buf[HEADER.size:HEADER.size + len(data) - first] = data[first:]
+
+    def _read(self, pos, size):
+        pos %= self.capacity
+        first = min(size, self.capacity - pos)
+        offset = HEADER.size + pos
+        data = bytes(self.shm.buf[offset:offset + first])
+        if first < size:
+            data += bytes(self.shm.buf[HEADER.size:HEADER.size + size - first])
+        return data
+
+    def _fits(self, count, size):
+        head, tail, qsize = self._header()
+        if self.maxsize and qsize + count > self.maxsize:
+            return False
+        return self.capacity - (tail - head) >= size
+
+    def _dumps(self, obj):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if len(data) + RECORD.size <= self.capacity // 4:
+            return RECORD.pack(len(data)) + data
+        shm = _shared_memory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        name = shm.name.encode('utf8')
+        shm.close()
+        return RECORD.pack(OVERFLOW | len(name)) + name
+
+    @staticmethod
+    def _discard(records):
+        '''unlink segments of records not put'''
+        for record in records:
+            length, = RECORD.unpack_from(record)
+            if length & OVERFLOW:
+                shm = _shared_memory(name=record[RECORD.size:].decode('utf8'))
+                shm.close()
+                shm.unlink()
+
+    @staticmethod
+    def _loads(length, data):
+        if not length & OVERFLOW:
+            return pickle.loads(data)
+        shm = _shared_memory(name=data.decode('utf8'))
+        try:
+            return pickle.loads(shm.buf)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _append(self, records):
+        head, tail, qsize = self._header()
+        for record in records:
+            self._write(tail, record)
+            tail += len(record)
+        HEADER.pack_into(self.shm.buf, 0, head, tail, qsize + len(records))
+
+    def _pop(self, count):
+        head, tail, qsize = self._header()
+        result = []
+        for _ in range(min(count, qsize)):
+            length, = RECORD.unpack(self._read(head, RECORD.size))
+            size = length & ~OVERFLOW
+            result.append((length, self._read(head + RECORD.size, size)))
+            head += RECORD.size + size
+        HEADER.pack_into(self.shm.buf, 0, head, tail, qsize - len(result))
+        return result
+
+    @staticmethod
+    def _wait(condition, predicate, block, timeout):
+        if not block:
+            return predicate()
+        return condition.wait_for(predicate, timeout)
+
+    def qsize(self):
+        with self.lock:
+            return self._header()[2]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        with self.lock:
+            return not self._fits(1, RECORD.size)
+
+    def put(self, obj, block=True, timeout=None):
+        return self.put_many([obj], block, timeout)
+
+    def put_nowait(self, obj):
+        return self.put_many([obj], False)
+
+    def put_many(self, objs, block=True, timeout=None):
+        '''
+        put all of objs, or none of them when queue is full
+
+        A batch larger than maxsize or capacity never fits at once, it raises
+        Full without block, or is put in parts when blocking, then a timeout
+        may leave a part of it put.
+        '''
+        records = [self._dumps(obj) for obj in objs]
+        if not records:
+            return True
+        size = sum(len(x) for x in records)
+        try:
+            if (self.maxsize and len(records) > self.maxsize) or size > self.capacity:
+                if not block:
+                    raise self.Full
+                deadline = timeout and time.time() + timeout
+                for i, record in enumerate(records):
+                    try:
+                        self._put_records([record], block,
+                                          deadline and max(deadline - time.time(), 0))
+                    except self.Full:
+                        records = records[i:]
+                        raise
+                return True
+            self._put_records(records, block, timeout)
+        except self.Full:
+            self._discard(records)
+            raise
+        return True
+
+    def _put_records(self, records, block, timeout):
+        size = sum(len(x) for x in records)
+        with self.not_full:
+            if not self._wait(self.not_full, lambda: self._fits(len(records), size),
+                              block, timeout):
+                raise self.Full
+            self._append(records)
+            self.not_empty.notify(len(records))
+
+    def get(self, block=True, timeout=None):
+        return self.get_many(1, block, timeout)[0]
+
+    def get_nowait(self):
+        return self.get_many(1, False)[0]
+
+    def get_many(self, count, block=True, timeout=None):
+        '''get up to count objs, raise Empty when nothing is got'''
+        with self.not_empty:
+            if not self._wait(self.not_empty, lambda: self._header()[2] > 0, block, timeout):
+                raise self.Empty
+            records = self._pop(count)
+            # waiting puts may need room of different sizes
+            self.not_full.notify_all()
+        return [self._loads(length, data) for length, data in records]
@@ -6,12 +6,15 @@
 # Created on 2015-05-22 20:54:01
 
 import time
+import socket
 import umsgpack
 from kombu import Connection, enable_insecure_serializers
 from kombu.serialization import register
 from kombu.exceptions import ChannelError
 import queue as BaseQueue
 
+from .serializer import default_serializer
+
 
 register('umsgpack', umsgpack.packb, umsgpack.unpackb, 'application/x-msgpack')
 enable_insecure_serializers(['umsgpack'])
@@ -27,18 +30,42 @@ class KombuQueue(object):
     Empty = BaseQueue.Empty
     Full = BaseQueue.Full
     max_timeout = 0.3
-
-    def __init__(self, name, url="amqp://", maxsize=0, lazy_limit=True):
+    # seconds a queue size is reused by full() when lazy_limit is enabled
+    qsize_interval = 1.0
+    # seconds get_nowait waits for consumer to deliver a message
+    nowait_timeout = 0.001
+    # seconds waiting for broker to confirm messages published
+    confirm_timeout = 10
+
+    def __init__(self, name, url="amqp://", maxsize=0, lazy_limit=True, prefetch_count=100,
+                 serializer=None, confirm_publish=True):
         """
         Constructor for KombuQueue
 
         url:        http://kombu.readthedocs.org/en/latest/userguide/connections.html#urls
         maxsize:    an integer that sets the upperbound limit on the number of
                     items that can be placed in the queue.
+        prefetch_count: messages delivered ahead to the buffer of consumer
+        serializer: Serializer of messages, see serializer.Serializer. Messages
+                    are serialized before sent to kombu, unless it's legacy.
+        confirm_publish: wait for broker to confirm messages published, put
+                    returns when the broker confirmed the message, put_many
+                    when it confirmed all of them. Only supported by amqp
+                    transport of py-amqp, messages are published without
+                    confirm by other transports.
         """
         self.name = name
+        self.serializer = serializer or default_serializer
         self.conn = Connection(url)
-        self.queue = self.conn.SimpleQueue(self.name, no_ack=True, serializer='umsgpack')
+        self.queue = self.conn.SimpleQueue(self.name, no_ack=False, serializer='umsgpack')
+        if prefetch_count:
+            self.queue.consumer.qos(prefetch_count=prefetch_count)
+
+        # delivery tags of published messages not confirmed yet
+        self.published = 0
+        self.unconfirmed = set()
+        self.nacked = 0
+        self.confirm = confirm_publish and self._confirm_select(self.queue.producer.channel)
 
         self.maxsize = maxsize
         self.lazy_limit = lazy_limit
@@ -47,6 +74,8 @@ class KombuQueue(object):
         else:
             self.qsize_diff_limit = 0
         self.qsize_diff = 0
+        self.last_qsize = 0
+        self.last_qsize_time = 0
 
     def qsize(self):
         try:
@@ -61,10 +90,16 @@ class KombuQueue(object):
             return False
 
     def full(self):
-        if self.maxsize and self.qsize() >= self.maxsize:
-            return True
-        else:
+        if not self.maxsize:
             return False
+        now = time.time()
+        if self.lazy_limit and now - self.last_qsize_time < self.qsize_interval:
+            # estimate with size got a while ago and messages put since then
+            return self.last_qsize + self.qsize_diff >= self.maxsize
+        self.last_qsize = self.qsize()
+        self.last_qsize_time = now
+        self.qsize_diff = 0
+        return self.last_qsize >= self.maxsize
 
     def put(self, obj, block=True, timeout=None):
         if not block:
@@ -84,28 +119,109 @@ class KombuQueue(object):
                 else:
                     time.sleep(self.max_timeout)
 
+    def _dumps(self, obj):
+        if self.serializer.legacy:
+            return obj
+        return self.serializer.dumps(obj)
+
+    def _loads(self, payload):
+        # payload of legacy messages is decoded by kombu
+        if isinstance(payload, bytes):
+            return self.serializer.loads(payload)
+        return payload
+
+    def _confirm_select(self, channel):
+        # confirm_publish option of transport waits for each message published,
+        # confirm mode is selected on the channel to wait once for a batch
+        if not hasattr(channel, 'confirm_select') or not hasattr(channel, 'events'):
+            return False
+        channel.events['basic_ack'].add(self._on_confirm)
+        channel.events['basic_nack'].add(
+            lambda delivery_tag, multiple: self._on_confirm(delivery_tag, multiple, True))
+        channel.confirm_select()
+        return True
+
+    def _on_confirm(self, delivery_tag, multiple, nack=False):
+        if multiple:
+            confirmed = set(x for x in self.unconfirmed if x <= delivery_tag)
+        else:
+            confirmed = self.unconfirmed & set([delivery_tag])
+        self.unconfirmed -= confirmed
+        if nack:
+            self.nacked += len(confirmed)
+
+    def _publish(self, objs):
+        """publish objs and wait once until broker confirmed all of them"""
+        if not self.confirm:
+            for obj in objs:
+                self.queue.put(self._dumps(obj))
+            return
+        self.nacked = 0
+        for obj in objs:
+            self.queue.put(self._dumps(obj))
+            self.published += 1
+            self.unconfirmed.add(self.published)
+        start_time = time.time()
+        while self.unconfirmed:
+            lasted = time.time() - start_time
+            if lasted >= self.confirm_timeout:
+                raise socket.timeout('%d messages not confirmed in %ss' % (
+                    len(self.unconfirmed), self.confirm_timeout))
+            try:
+                # messages delivered meanwhile go to buffer of consumer
+                self.conn.drain_events(timeout=min(self.max_timeout, self.confirm_timeout - lasted))
+            except socket.timeout:
+                pass
+        if self.nacked:
+            # refused by broker, e.g. overflow of a queue with reject-publish
+            raise BaseQueue.Full
+
     def put_nowait(self, obj):
         if self.lazy_limit and self.qsize_diff < self.qsize_diff_limit:
             pass
         elif self.full():
             raise BaseQueue.Full
-        else:
-            self.qsize_diff = 0
-        return self.queue.put(obj)
+        self.qsize_diff += 1
+        return self._publish([obj])
+
+    def put_many(self, objs, block=True, timeout=None):
+        """
+        put objs, confirmed by broker with one wait for all of them
+
+        size limit is checked once for all objs.
+        """
+        start_time = time.time()
+        while self.full():
+            lasted = time.time() - start_time
+            if not block or (timeout and timeout <= lasted):
+                raise BaseQueue.Full
+            time.sleep(min(self.max_timeout, timeout - lasted) if timeout else self.max_timeout)
+        self.qsize_diff += len(objs)
+        self._publish(objs)
+        return True
 
     def get(self, block=True, timeout=None):
+        if not block:
+            return self.get_nowait()
         try:
             ret = self.queue.get(block, timeout)
-            return ret.payload
         except self.queue.Empty:
             raise BaseQueue.Empty
+        ret.ack()
+        return self._loads(ret.payload)
 
     def get_nowait(self):
-        try:
-            ret = self.queue.get_nowait()
-            return ret.payload
-        except self.queue.Empty:
-            raise BaseQueue.Empty
+        # messages are delivered to buffer of consumer, instead of basic_get per message
+        return self.get(True, self.nowait_timeout)
+
+    def get_many(self, count, block=True, timeout=None):
+        """get up to count objs, the rest are taken from buffer of consumer"""
+        result = [self.get(block, timeout)]
+        while len(result) < count and self.queue.buffer:
+            ret = self.queue.buffer.popleft()
+            ret.ack()
+            result.append(self._loads(ret.payload))
+        return result
 
     def delete(self):
         self.queue.queue.delete()
@@ -5,11 +5,13 @@
 #         http://binux.me
 # Created on 2015-04-27 22:48:04
 
+import math
 import time
 import redis
-import umsgpack
 import queue as BaseQueue
 
+from .serializer import default_serializer
+
 
 class RedisQueue(object):
     """
@@ -19,9 +21,11 @@ class RedisQueue(object):
     Empty = BaseQueue.Empty
     Full = BaseQueue.Full
     max_timeout = 0.3
+    batch_size = 1000
 
     def __init__(self, name, host='localhost', port=6379, db=0,
-                 maxsize=0, lazy_limit=True, password=None, cluster_nodes=None):
+                 maxsize=0, lazy_limit=True, password=None, cluster_nodes=None,
+                 serializer=None):
         """
         Constructor for RedisQueue
 
@@ -29,6 +33,7 @@ class RedisQueue(object):
                     items that can be placed in the queue.
         lazy_limit: redis queue is shared via instance, a lazy size limit is used
                     for better performance.
+        serializer: Serializer of messages, see serializer.Serializer
         """
         self.name = name
         if cluster_nodes is not None:
@@ -49,7 +54,9 @@ class RedisQueue(object):
             )
         self.maxsize = maxsize
         self.lazy_limit = lazy_limit
+        self.serializer = serializer or default_serializer
         self.last_qsize = 0
+        self._lpop_count = True
 
     def qsize(self):
         self.last_qsize = self.redis.llen(self.name)
@@ -72,7 +79,7 @@ class RedisQueue(object):
             pass
         elif self.full():
             raise self.Full
-        self.last_qsize = self.redis.rpush(self.name, umsgpack.packb(obj))
+        self.last_qsize = self.redis.rpush(self.name, self.serializer.dumps(obj))
         return True
 
     def put(self, obj, block=True, timeout=None):
@@ -97,24 +104,79 @@ class RedisQueue(object):
         ret = self.redis.lpop(self.name)
         if ret is None:
             raise self.Empty
-        return umsgpack.unpackb(ret)
+        return self.serializer.loads(ret)
 
     def get(self, block=True, timeout=None):
         if not block:
             return self.get_nowait()
 
+        ret = self._blpop(timeout)
+        if ret is None:
+            raise self.Empty
+        return self.serializer.loads(ret)
+
+    def _blpop(self, timeout):
+        # BLPOP timeout of 0 blocks forever, servers before 6.0 accept integer seconds only
+        timeout = max(timeout, 0.001) if timeout else 0
+        try:
+            ret = self.redis.blpop([self.name], timeout=timeout)
+        except redis.ResponseError:
+            ret = self.redis.blpop([self.name], timeout=int(math.ceil(timeout)))
+        return ret[1] if ret else None
+
+    def put_many(self, objs, block=True, timeout=None):
+        """
+        put objs in one round trip, with `batch_size` values per RPUSH
+
+        size limit is checked once for all objs.
+        """
+        objs = [self.serializer.dumps(obj) for obj in objs]
+        if not objs:
+            return True
         start_time = time.time()
-        while True:
+        while not (self.lazy_limit and self.last_qsize < self.maxsize) and self.full():
+            if not block:
+                raise self.Full
+            lasted = time.time() - start_time
+            if timeout and timeout <= lasted:
+                raise self.Full
+            time.sleep(min(self.max_timeout, timeout - lasted) if timeout else self.max_timeout)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for i in range(0, len(objs), self.batch_size):
+            pipe.rpush(self.name, *objs[i:i + self.batch_size])
+        self.last_qsize = pipe.execute()[-1]
+        return True
+
+    def _lpop_many(self, count):
+        if self._lpop_count:
             try:
-                return self.get_nowait()
-            except self.Empty:
-                if timeout:
-                    lasted = time.time() - start_time
-                    if timeout > lasted:
-                        time.sleep(min(self.max_timeout, timeout - lasted))
-                    else:
-                        raise
-                else:
-                    time.sleep(self.max_timeout)
+                return self.redis.lpop(self.name, count) or []
+            except (redis.ResponseError, TypeError):
+                # LPOP with count needs redis 6.2 and redis-py 4
+                self._lpop_count = False
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(self.name, 0, count - 1)
+        pipe.ltrim(self.name, count, -1)
+        return pipe.execute()[0]
+
+    def get_many(self, count, block=True, timeout=None):
+        """
+        get up to count objs in one round trip, raise Empty when queue is empty
+
+        when blocking, BLPOP waits for the first obj and the rest are got
+        without blocking.
+        """
+        ret = self._lpop_many(count)
+        if not ret:
+            if not block:
+                raise self.Empty
+            first = self._blpop(timeout)
+            if first is None:
+                raise self.Empty
+            ret = [first]
+            if count > 1:
+                ret.extend(self._lpop_many(count - 1))
+        return [self.serializer.loads(x) for x in ret]
 
 Queue = RedisQueue
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import datetime
+import threading
+
+import umsgpack
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# 0xc1 is never used by msgpack, messages without it are legacy umsgpack
+MAGIC = b'\xc1'
+
+CODECS = {
+    'msgpack': b'm',
+}
+COMPRESSIONS = {
+    None: b'-',
+    'zstd': b'z',
+    'lz4': b'l',
+}
+
+
+def _default(obj):
+    # naive datetime is taken as utc, like umsgpack does
+    if isinstance(obj, datetime.datetime) and obj.tzinfo is None:
+        return obj.replace(tzinfo=datetime.timezone.utc)
+    raise TypeError('can not serialize %r object' % type(obj).__name__)
+
+
+def _packb(obj):
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True, datetime=True, default=_default)
+    return umsgpack.packb(obj)
+
+
+def _unpackb(data):
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False, timestamp=3)
+    return umsgpack.unpackb(data)
+
+
+class Serializer(object):
+    '''
+    Serializer of messages of networked queues
+
+    Messages are msgpack, packed by C-accelerated msgpack when installed, and
+    compressed by zstd or lz4 when longer than `threshold` bytes. A message
+    starts with a header of magic, codec and compression, so it's readable
+    by any serializer, whatever it's written with. Messages without header
+    are read as umsgpack, written by legacy serializer or older versions.
+
+    `legacy` writes umsgpack without header, readable by older versions, for
+    rolling upgrades.
+    '''
+
+    def __init__(self, codec='msgpack', compression=None, threshold=4096, level=3):
+        self.legacy = codec == 'legacy'
+        if not self.legacy and codec not in CODECS:
+            raise ValueError('unknown serializer: %s' % codec)
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression: %s' % compression)
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstandard is required for zstd compression')
+        if compression == 'lz4' and lz4 is None:
+            raise ImportError('lz4 is required for lz4 compression')
+        self.codec = codec
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+        # zstd contexts are not thread safe
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, query):
+        '''serializer from query arguments of message queue url'''
+        return cls(
+            codec=query.get('serializer', 'msgpack'),
+            compression=query.get('compression') or None,
+            threshold=int(query.get('compress_threshold', 4096)),
+        )
+
+    def _zstd_compressor(self):
+        if not hasattr(self._local, 'compressor'):
+            self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self._local.compressor
+
+    def _zstd_decompressor(self):
+        if not hasattr(self._local, 'decompressor'):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor
+
+    def dumps(self, obj):
+        if self.legacy:
+            return umsgpack.packb(obj)
+        data = _packb(obj)
+        compression = self.compression if len(data) > self.threshold else None
+        if compression == 'zstd':
+            data = self._zstd_compressor().compress(data)
+        elif compression == 'lz4':
+            data = lz4.frame.compress(data)
+        return MAGIC + CODECS[self.codec] + COMPRESSIONS[compression] + data
+
+    def loads(self, data):
+        if data[:1] != MAGIC:
+            return umsgpack.unpackb(data)
+        codec, compression, data = data[1:2], data[2:3], data[3:]
+        if compression == b'z':
+            if zstandard is None:
+                raise ImportError('zstandard is required to read zstd compressed message')
+            data = self._zstd_decompressor().decompress(data)
+        elif compression == b'l':
+            if lz4 is None:
+                raise ImportError('lz4 is required to read lz4 compressed message')
+            data = lz4.frame.decompress(data)
+        elif compression != b'-':
+            raise ValueError('unknown compression of message: %r' % compression)
+        if codec != b'm':
+            raise ValueError('unknown codec of message: %r' % codec)
+        return _unpackb(data)
+
+
+default_serializer = Serializer()
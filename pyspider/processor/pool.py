@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import time
+import zlib
+import logging
+import multiprocessing
+
+import queue as Queue
+
+from pyspider.libs import counter
+from pyspider.message_queue import get_many, put_many
+
+logger = logging.getLogger('processor')
+
+
+def worker_of(project, workers):
+    '''the worker serving project, stable across processes unlike hash()'''
+    return zlib.crc32(project.encode('utf8')) % workers
+
+
+class WorkerStats(object):
+    '''
+    tasks done, seconds busy and projects loaded of each worker, in shared memory
+
+    each worker writes only its own slots, read by the pool
+    '''
+    FIELDS = 3
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.values = multiprocessing.RawArray('d', workers * self.FIELDS)
+
+    def update(self, index, tasks, busy, projects):
+        offset = index * self.FIELDS
+        self.values[offset] += tasks
+        self.values[offset + 1] += busy
+        self.values[offset + 2] = projects
+
+    def get(self, index):
+        offset = index * self.FIELDS
+        return tuple(self.values[offset:offset + self.FIELDS])
+
+
+class ProcessorPool(object):
+    '''
+    front of processor worker processes
+
+    reads (task, response) from the shared inqueue and routes them to the queue
+    of the worker serving the project, by hash of project name, so each worker
+    only loads the projects it serves. Workers put results to the shared
+    status, newtask and result queues themselves.
+
+    Utilization of workers, seconds busy per second, is recorded in counters
+    as `_workers.<n>.utilization`, with `tasks` done, and logged every
+    LOG_INTERVAL seconds. `worker_stats` has the projects loaded and queue
+    size of workers as well.
+
+    Workers are started by `spawn_worker(index)`, returning the process. A
+    worker exited is started again, so its projects are not stalled.
+    '''
+    BATCH_SIZE = 100
+    STATS_INTERVAL = 1
+    LOG_INTERVAL = 60
+
+    def __init__(self, inqueue, worker_queues, stats=None, spawn_worker=None):
+        self.inqueue = inqueue
+        self.worker_queues = worker_queues
+        self.stats = stats or WorkerStats(len(worker_queues))
+        self.spawn_worker = spawn_worker
+        self.processes = []
+        self._quit = False
+        self._last_log = time.time()
+        self._last_stats = (time.time(), [self.stats.get(i) for i in range(len(worker_queues))])
+        self._cnt = {
+            '5m': counter.CounterManager(
+                lambda: counter.TimebaseAverageWindowCounter(30, 10)),
+            '1h': counter.CounterManager(
+                lambda: counter.TimebaseAverageWindowCounter(60, 60)),
+        }
+
+    def route(self, tasks):
+        '''put (task, response) of tasks to the queues of workers serving them'''
+        worker_tasks = dict()
+        for each in tasks:
+            task = each[0]
+            if not isinstance(task, dict) or 'project' not in task:
+                logger.error('invalid task: %r', task)
+                continue
+            index = worker_of(task['project'], len(self.worker_queues))
+            worker_tasks.setdefault(index, []).append(each)
+        for index, tasks in worker_tasks.items():
+            queue = self.worker_queues[index]
+            # a batch larger than maxsize would be put in parts, and a part put again on retry
+            size = getattr(queue, 'maxsize', 0) or len(tasks)
+            for i in range(0, len(tasks), size):
+                while True:
+                    try:
+                        put_many(queue, tasks[i:i + size], timeout=self.STATS_INTERVAL)
+                        break
+                    except Queue.Full:
+                        # queue of a dead worker never drains
+                        self.check_workers()
+
+    def update_counter(self):
+        '''record what workers have done since last update'''
+        now = time.time()
+        last_time, last_values = self._last_stats
+        values = [self.stats.get(i) for i in range(len(self.worker_queues))]
+        for i, (value, last) in enumerate(zip(values, last_values)):
+            key = ('_workers', str(i))
+            for cnt in self._cnt.values():
+                cnt.event(key + ('tasks', ), value[0] - last[0])
+                cnt.event(key + ('utilization', ), value[1] - last[1])
+        self._last_stats = (now, values)
+
+    def start_workers(self):
+        if self.spawn_worker is not None:
+            self.processes = [self.spawn_worker(i) for i in range(len(self.worker_queues))]
+
+    def check_workers(self):
+        '''start workers exited again'''
+        for i, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            logger.error('processor worker %d exited with code %s, restarting',
+                         i, process.exitcode)
+            self.processes[i] = self.spawn_worker(i)
+
+    def log_counter(self):
+        utilization = self.counter('5m', 'avg').get('_workers', {})
+        tasks = self.counter('5m', 'sum').get('_workers', {})
+        logger.info('processor workers in 5m: %s', ', '.join(
+            '#%d %.0f%% busy %d tasks %d projects' % (
+                i, utilization.get(str(i), {}).get('utilization', 0) * 100,
+                tasks.get(str(i), {}).get('tasks', 0), stats['projects'])
+            for i, stats in enumerate(self.worker_stats())))
+
+    def counter(self, _time, _type):
+        return self._cnt[_time].to_dict(_type)
+
+    def worker_stats(self):
+        '''tasks, utilization since last update, projects and queue size of each worker'''
+        now = time.time()
+        last_time, last_values = self._last_stats
+        result = []
+        for i, queue in enumerate(self.worker_queues):
+            tasks, busy, projects = self.stats.get(i)
+            result.append({
+                'tasks': tasks,
+                'utilization': (busy - last_values[i][1]) / max(now - last_time, 1e-6),
+                'projects': projects,
+                'qsize': queue.qsize() if hasattr(queue, 'qsize') else -1,
+            })
+        return result
+
+    def run_once(self):
+        try:
+            tasks = get_many(self.inqueue, self.BATCH_SIZE, timeout=self.STATS_INTERVAL)
+        except Queue.Empty:
+            tasks = []
+        if tasks:
+            self.route(tasks)
+        now = time.time()
+        if now - self._last_stats[0] >= self.STATS_INTERVAL:
+            self.update_counter()
+            self.check_workers()
+        if now - self._last_log >= self.LOG_INTERVAL:
+            self.log_counter()
+            self._last_log = now
+        return len(tasks)
+
+    def quit(self):
+        self._quit = True
+
+    def run(self):
+        logger.info("processor pool of %d workers starting...", len(self.worker_queues))
+        self.start_workers()
+        while not self._quit:
+            try:
+                self.run_once()
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                logger.exception(e)
+        logger.info("processor pool exiting...")
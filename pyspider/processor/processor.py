@@ -17,6 +17,7 @@ from pyspider.libs import utils
 from pyspider.libs.log import LogFormatter
 from pyspider.libs.utils import pretty_unicode, hide_me
 from pyspider.libs.response import rebuild_response
+from pyspider.message_queue import put_many, get_many
 from .project_module import ProjectManager, ProjectFinder
 
 
@@ -62,6 +63,11 @@ class ProcessorResult(object):
 class Processor(object):
     PROCESS_TIME_LIMIT = 30
     EXCEPTION_LIMIT = 3
+    BATCH_SIZE = 100
+    # messages of a batch are put every BATCH_FLUSH_SIZE tasks or BATCH_FLUSH_TIME seconds,
+    # so the scheduler doesn't wait for the whole batch
+    BATCH_FLUSH_SIZE = 20
+    BATCH_FLUSH_TIME = 0.1
 
     RESULT_LOGS_LIMIT = 1000
     RESULT_RESULT_LIMIT = 10
@@ -79,6 +85,13 @@ class Processor(object):
 
         self._quit = False
         self._exceptions = 10
+        # messages to status and newtask queues, put in one round trip after a batch of tasks
+        self._status_batch = None
+        self._newtask_batch = None
+        # set by processor pool, route_task(task, response) sends task of a project served by
+        # another worker to it, report_batch(tasks, seconds) records work done by this worker
+        self.route_task = None
+        self.report_batch = None
         self.project_manager = ProjectManager(projectdb, dict(
             result_queue=self.result_queue,
             enable_stdout_capture=self.enable_stdout_capture,
@@ -102,24 +115,40 @@ class Processor(object):
     def on_task(self, task, response):
         '''Deal one task'''
         start_time = time.time()
+        backoff = response.get('backoff')
+        deferred = response.get('deferred')
         response = rebuild_response(response)
+        if response.content_ref:
+            try:
+                # loaded ahead, so a lost body fails the fetch instead of the callback
+                response.content
+            except (OSError, KeyError) as e:
+                logger.error('response body of %s:%s lost: %r',
+                             task.get('project'), task.get('taskid'), e)
+                response.status_code = 599
+                response.error = 'response body %s lost: %r' % (response.content_ref, e)
+                response.content = b''
 
-        try:
-            assert 'taskid' in task, 'need taskid in task'
-            project = task['project']
-            updatetime = task.get('project_updatetime', None)
-            md5sum = task.get('project_md5sum', None)
-            project_data = self.project_manager.get(project, updatetime, md5sum)
-            assert project_data, "no such project!"
-            if project_data.get('exception'):
-                ret = ProcessorResult(logs=(project_data.get('exception_log'), ),
-                                      exception=project_data['exception'])
-            else:
-                ret = project_data['instance'].run_task(
-                    project_data['module'], task, response)
-        except Exception as e:
-            logstr = traceback.format_exc()
-            ret = ProcessorResult(logs=(logstr, ), exception=e)
+        if deferred:
+            # not fetched as host of task is throttled, scheduler puts the task back
+            ret = ProcessorResult()
+        else:
+            try:
+                assert 'taskid' in task, 'need taskid in task'
+                project = task['project']
+                updatetime = task.get('project_updatetime', None)
+                md5sum = task.get('project_md5sum', None)
+                project_data = self.project_manager.get(project, updatetime, md5sum)
+                assert project_data, "no such project!"
+                if project_data.get('exception'):
+                    ret = ProcessorResult(logs=(project_data.get('exception_log'), ),
+                                          exception=project_data['exception'])
+                else:
+                    ret = project_data['instance'].run_task(
+                        project_data['module'], task, response)
+            except Exception as e:
+                logstr = traceback.format_exc()
+                ret = ProcessorResult(logs=(logstr, ), exception=e)
         process_time = time.time() - start_time
 
         if not ret.extinfo.get('not_send_status', False):
@@ -163,31 +192,40 @@ class Processor(object):
             }
             if 'schedule' in task:
                 status_pack['schedule'] = task['schedule']
+            if backoff:
+                # host of task is throttled by fetcher
+                status_pack['track']['fetch']['backoff'] = backoff
+            if deferred:
+                status_pack['track']['fetch']['deferred'] = True
 
             # FIXME: unicode_obj should used in scheduler before store to database
             # it's used here for performance.
-            self.status_queue.put(utils.unicode_obj(status_pack))
+            self.put_status(utils.unicode_obj(status_pack))
 
         # FIXME: unicode_obj should used in scheduler before store to database
         # it's used here for performance.
         if ret.follows:
             for each in (ret.follows[x:x + 1000] for x in range(0, len(ret.follows), 1000)):
-                self.newtask_queue.put([utils.unicode_obj(newtask) for newtask in each])
+                self.put_newtasks([utils.unicode_obj(newtask) for newtask in each])
 
         for project, msg, url in ret.messages:
             try:
-                self.on_task({
+                message_task = {
                     'taskid': utils.md5string(url),
                     'project': project,
                     'url': url,
                     'process': {
                         'callback': '_on_message',
                     }
-                }, {
+                }
+                message_response = {
                     'status_code': 200,
                     'url': url,
                     'save': (task['project'], msg),
-                })
+                }
+                if self.route_task is not None and self.route_task(message_task, message_response):
+                    continue
+                self.on_task(message_task, message_response)
             except Exception as e:
                 logger.exception('Sending message error.')
                 continue
@@ -202,6 +240,48 @@ class Processor(object):
             ret.result, len(ret.follows), len(ret.messages), ret.exception))
         return True
 
+    def put_status(self, status_pack):
+        if self._status_batch is None:
+            self.status_queue.put(status_pack)
+        else:
+            self._status_batch.append(status_pack)
+
+    def put_newtasks(self, newtasks):
+        if self._newtask_batch is None:
+            self.newtask_queue.put(newtasks)
+        else:
+            self._newtask_batch.append(newtasks)
+
+    def _flush_batch(self):
+        status_batch, self._status_batch = self._status_batch, []
+        newtask_batch, self._newtask_batch = self._newtask_batch, []
+        if status_batch:
+            put_many(self.status_queue, status_batch)
+        if newtask_batch:
+            put_many(self.newtask_queue, newtask_batch)
+
+    def on_tasks(self, tasks):
+        '''
+        Deal with a batch of tasks, messages of them are put to queues together,
+        every BATCH_FLUSH_SIZE tasks or BATCH_FLUSH_TIME seconds
+        '''
+        self._status_batch, self._newtask_batch = [], []
+        count, flush_time = 0, time.time()
+        try:
+            for task, response in tasks:
+                try:
+                    self.on_task(task, response)
+                    self._exceptions = 0
+                except Exception as e:
+                    logger.exception(e)
+                count += 1
+                if count >= self.BATCH_FLUSH_SIZE or time.time() - flush_time >= self.BATCH_FLUSH_TIME:
+                    self._flush_batch()
+                    count, flush_time = 0, time.time()
+        finally:
+            self._flush_batch()
+            self._status_batch, self._newtask_batch = None, None
+
     def quit(self):
         '''Set quit signal'''
         self._quit = True
@@ -212,10 +292,12 @@ class Processor(object):
 
         while not self._quit:
             try:
-                task, response = self.inqueue.get(timeout=1)
-                self.on_task(task, response)
-                self._exceptions = 0
-            except Exception as e:  # Handle Queue.Empty
+                tasks = get_many(self.inqueue, self.BATCH_SIZE, timeout=1)
+                start_time = time.time()
+                self.on_tasks(tasks)
+                if self.report_batch is not None:
+                    self.report_batch(len(tasks), time.time() - start_time)
+            except queue.Empty:
                 continue
             except KeyboardInterrupt:
                 break
@@ -9,6 +9,9 @@ import time
 import json
 import logging
 import queue as Queue
+
+from pyspider.message_queue import get_many
+
 logger = logging.getLogger("result")
 
 
@@ -19,6 +22,8 @@ class ResultWorker(object):
     override this if needed.
     """
 
+    BATCH_SIZE = 100
+
     def __init__(self, resultdb, inqueue):
         self.resultdb = resultdb
         self.inqueue = inqueue
@@ -50,18 +55,23 @@ class ResultWorker(object):
 
         while not self._quit:
             try:
-                task, result = self.inqueue.get(timeout=1)
-                self.on_result(task, result)
+                results = get_many(self.inqueue, self.BATCH_SIZE, timeout=1)
             except Queue.Empty as e:
                 continue
             except KeyboardInterrupt:
                 break
-            except AssertionError as e:
-                logger.error(e)
-                continue
-            except Exception as e:
-                logger.exception(e)
-                continue
+            for task, result in results:
+                try:
+                    self.on_result(task, result)
+                except KeyboardInterrupt:
+                    self._quit = True
+                    break
+                except AssertionError as e:
+                    logger.error(e)
+                    continue
+                except Exception as e:
+                    logger.exception(e)
+                    continue
 
         logger.info("result_worker exiting...")
 
@@ -78,7 +78,8 @@ def connect_rpc(ctx, param, value):
               help='database url for resultdb, default: sqlite')
 @click.option('--message-queue', envvar='AMQP_URL',
               help='connection url to message queue, '
-              'default: builtin multiprocessing.Queue')
+              'default: shared memory queue for all and bench, builtin multiprocessing.Queue '
+              'for others')
 @click.option('--amqp-url', help='[deprecated] amqp url for rabbitmq. '
               'please use --message-queue instead.')
 @click.option('--beanstalk', envvar='BEANSTALK_HOST',
@@ -151,11 +152,23 @@ def cli(ctx, **kwargs):
         kwargs['message_queue'] = ("amqp://guest:guest@%(RABBITMQ_PORT_5672_TCP_ADDR)s"
                                    ":%(RABBITMQ_PORT_5672_TCP_PORT)s/%%2F" % os.environ)
 
-    for name in ('newtask_queue', 'status_queue', 'scheduler2fetcher',
-                 'fetcher2processor', 'processor2result'):
+    queue_names = ('newtask_queue', 'status_queue', 'scheduler2fetcher',
+                   'fetcher2processor', 'processor2result')
+    # components of all and bench are forked from this process, connect them by shared memory
+    # when /dev/shm has room for rings of queues and response bodies
+    kwargs['shared_memory'] = False
+    if not kwargs.get('message_queue') and ctx.invoked_subcommand in (None, 'all', 'bench'):
+        from pyspider.libs.shm_queue import shm_available, DEFAULT_CAPACITY
+        kwargs['shared_memory'] = shm_available(len(queue_names) * DEFAULT_CAPACITY * 2)
+        if not kwargs['shared_memory']:
+            logging.warning('not enough shared memory in /dev/shm, using builtin message queue')
+
+    for name in queue_names:
         if kwargs.get('message_queue'):
             kwargs[name] = utils.Get(lambda name=name: connect_message_queue(
                 name, kwargs.get('message_queue'), kwargs['queue_maxsize']))
+        elif kwargs['shared_memory']:
+            kwargs[name] = connect_message_queue(name, 'shm://', kwargs['queue_maxsize'])
         else:
             kwargs[name] = connect_message_queue(name, kwargs.get('message_queue'),
                                                  kwargs['queue_maxsize'])
@@ -197,28 +210,119 @@ def cli(ctx, **kwargs):
 @click.option('--scheduler-cls', default='pyspider.scheduler.ThreadBaseScheduler', callback=load_cls,
               help='scheduler class to be used.')
 @click.option('--threads', default=None, help='thread number for ThreadBaseScheduler, default: 4')
+@click.option('--task-filter-error-rate', default=0.0,
+              help='false positive rate of the per project bloom filter for new requests, '
+              'skipping taskdb lookup of never seen tasks. 0 to disable')
+@click.option('--task-filter-memory', default=64,
+              help='max memory in MB of the bloom filter of each project')
+@click.option('--snapshot-interval', default=0,
+              help='seconds between snapshots of task queues in data path, '
+              'restarted scheduler loads task queues from snapshots instead of taskdb. 0 to disable')
+@click.option('--taskdb-buffer-size', default=0,
+              help='buffer up to N taskdb writes and flush them in batches, 0 to disable')
+@click.option('--taskdb-buffer-interval', default=1.0,
+              help='max seconds a buffered taskdb write is delayed')
+@click.option('--task-queue-cls', default='pyspider.scheduler.task_queue.TaskQueue',
+              callback=load_cls, help='task queue class to be used, '
+              'pyspider.scheduler.compact_task_queue.CompactTaskQueue for large queues, '
+              'pyspider.scheduler.task_queue.TimingWheelTaskQueue for many delayed tasks')
+@click.option('--limit-by-host', is_flag=True,
+              help='select tasks round-robin by host, with per host limits below')
+@click.option('--host-rate', default=0.0,
+              help='default tasks per second of each host, 0 for no limit')
+@click.option('--host-burst', default=0.0, help='default burst of each host')
+@click.option('--host-concurrency', default=0,
+              help='default max tasks in processing of each host, 0 for no limit')
+@click.option('--shards', default=1,
+              help='run N scheduler processes, each owning a consistent hash subset of projects, '
+              'shards listen xmlrpc on the following N ports of 127.0.0.1')
+@click.option('--split-project', multiple=True,
+              help='spread tasks of the big project over all shards by taskid')
 @click.pass_context
 def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
               inqueue_limit, delete_time, active_tasks, loop_limit, fail_pause_num,
-              scheduler_cls, threads, get_object=False):
+              scheduler_cls, threads, task_filter_error_rate, task_filter_memory,
+              snapshot_interval, taskdb_buffer_size, taskdb_buffer_interval, task_queue_cls,
+              limit_by_host, host_rate, host_burst, host_concurrency, shards, split_project,
+              get_object=False):
     """
     Run Scheduler, only one scheduler is allowed.
     """
     g = ctx.obj
     Scheduler = load_cls(None, None, scheduler_cls)
 
-    kwargs = dict(taskdb=g.taskdb, projectdb=g.projectdb, resultdb=g.resultdb,
-                  newtask_queue=g.newtask_queue, status_queue=g.status_queue,
-                  out_queue=g.scheduler2fetcher, data_path=g.get('data_path', 'data'))
-    if threads:
-        kwargs['threads'] = int(threads)
+    def create_scheduler(**overrides):
+        kwargs = dict(taskdb=g.taskdb, projectdb=g.projectdb, resultdb=g.resultdb,
+                      newtask_queue=g.newtask_queue, status_queue=g.status_queue,
+                      out_queue=g.scheduler2fetcher, data_path=g.get('data_path', 'data'))
+        kwargs.update(overrides)
+        if threads:
+            kwargs['threads'] = int(threads)
+        if taskdb_buffer_size:
+            kwargs['taskdb_buffer_size'] = taskdb_buffer_size
+            kwargs['taskdb_buffer_interval'] = taskdb_buffer_interval
+
+        scheduler = Scheduler(**kwargs)
+        scheduler.INQUEUE_LIMIT = inqueue_limit
+        scheduler.DELETE_TIME = delete_time
+        scheduler.ACTIVE_TASKS = active_tasks
+        scheduler.LOOP_LIMIT = loop_limit
+        scheduler.FAIL_PAUSE_NUM = fail_pause_num
+        scheduler.TASK_FILTER_ERROR_RATE = task_filter_error_rate
+        scheduler.TASK_FILTER_MAX_MEMORY = task_filter_memory * 1024 * 1024
+        scheduler.TASK_QUEUE_SNAPSHOT_INTERVAL = snapshot_interval
+        scheduler.TASK_QUEUE_CLS = load_cls(None, None, task_queue_cls)
+        scheduler.LIMIT_BY_HOST = limit_by_host or bool(host_rate or host_concurrency)
+        scheduler.HOST_RATE = host_rate
+        scheduler.HOST_BURST = host_burst
+        scheduler.HOST_CONCURRENCY = host_concurrency
+        return scheduler
+
+    if shards > 1:
+        from pyspider.scheduler.shard import ShardRing, ShardRouter
+
+        # queues of shards, connected in the process using them
+        shard_queues = []
+        for i in range(shards):
+            queues = utils.ObjectDict()
+            for name in ('newtask_queue', 'status_queue'):
+                if g.get('message_queue'):
+                    queues[name] = utils.Get(lambda name='%s.%d' % (name, i): connect_message_queue(
+                        name, g.get('message_queue'), g.get('queue_maxsize', 100)))
+                else:
+                    queues[name] = connect_message_queue('%s.%d' % (name, i), None,
+                                                         g.get('queue_maxsize', 100))
+            shard_queues.append(queues)
+        ring = ShardRing(shards, split_project)
+
+        def run_shard(i):
+            data_path = os.path.join(g.get('data_path', 'data'), 'shard%d' % i)
+            if not os.path.exists(data_path):
+                os.makedirs(data_path)
+            shard = create_scheduler(newtask_queue=shard_queues[i].newtask_queue,
+                                     status_queue=shard_queues[i].status_queue,
+                                     data_path=data_path)
+            shard.shard_ring = ring
+            shard.shard_id = i
+            utils.run_in_thread(shard.xmlrpc_run, port=xmlrpc_port + 1 + i, bind='127.0.0.1')
+            shard.run()
+
+        for i in range(shards):
+            utils.run_in_subprocess(run_shard, i)
+
+        router = ShardRouter(
+            ring, g.newtask_queue, g.status_queue, g.scheduler2fetcher,
+            [x.newtask_queue for x in shard_queues], [x.status_queue for x in shard_queues],
+            ['http://127.0.0.1:%d/' % (xmlrpc_port + 1 + i) for i in range(shards)])
+        g.instances.append(router)
+        if g.get('testing_mode') or get_object:
+            return router
+        if not no_xmlrpc:
+            utils.run_in_thread(router.xmlrpc_run, port=xmlrpc_port, bind=xmlrpc_host)
+        router.run()
+        return
 
-    scheduler = Scheduler(**kwargs)
-    scheduler.INQUEUE_LIMIT = inqueue_limit
-    scheduler.DELETE_TIME = delete_time
-    scheduler.ACTIVE_TASKS = active_tasks
-    scheduler.LOOP_LIMIT = loop_limit
-    scheduler.FAIL_PAUSE_NUM = fail_pause_num
+    scheduler = create_scheduler()
 
     g.instances.append(scheduler)
     if g.get('testing_mode') or get_object:
@@ -244,6 +348,30 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
 @click.option('--splash-endpoint', help="execute endpoint of splash: http://splash.readthedocs.io/en/stable/api.html#execute")
 @click.option('--fetcher-cls', default='pyspider.fetcher.Fetcher', callback=load_cls,
               help='Fetcher class to be used.')
+@click.option('--max-body-size', type=int, help='default max size of response body in bytes')
+@click.option('--spill-body-size', type=int, help='response body larger than it is spilled to disk')
+@click.option('--spill-dir', help='directory of spilled response bodies')
+@click.option('--spill-ttl', default=86400,
+              help='seconds spilled and stored response bodies not loaded by processor are kept')
+@click.option('--body-store', help='store of response bodies sent to processor by reference, '
+              'shm://, file:///path or redis://host:port/db')
+@click.option('--body-store-size', default=64*1024,
+              help='response bodies smaller than it are sent inline')
+@click.option('--robots-cache', help='robots.txt cache shared by fetchers, '
+              'sqlite:///path/to/robots.db or redis://host:port/db')
+@click.option('--dns-cache-ttl', default=0, help='max seconds resolved hosts are cached, 0 to disable')
+@click.option('--http-cache', help='directory of http response cache')
+@click.option('--http-cache-size', default=1024, help='max size of http response cache in MB')
+@click.option('--http-cache-offline', is_flag=True, help='serve responses from http cache only')
+@click.option('--proxy-pool', help='file of proxies one per line, or comma separated proxies, '
+              'picked by health for tasks without proxy')
+@click.option('--proxy-sticky', default=0, help='seconds requests to a host stick to the same proxy')
+@click.option('--proxy-ban-markers', help='regex of block pages of anti-bot services, '
+              'taken as proxy banned, empty to disable')
+@click.option('--proxy-ban-titles', help='regex of titles of small block pages, '
+              'taken as proxy banned, empty to disable')
+@click.option('--host-concurrency', default=0,
+              help='max concurrent requests per host, adapted to responses of host, 0 for no limit')
 @click.option('--optimize', is_flag=True, help='Enable performance optimization')
 @click.option('--memory-check-interval', default=60, help='Memory check interval in seconds')
 @click.option('--pool-check-interval', default=30, help='Pool check interval in seconds')
@@ -251,7 +379,9 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
 @click.pass_context
 def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, proxy, user_agent,
             timeout, phantomjs_endpoint, puppeteer_endpoint, splash_endpoint, fetcher_cls,
-            optimize, memory_check_interval, pool_check_interval, max_memory_percent,
+            max_body_size, spill_body_size, spill_dir, spill_ttl, body_store, body_store_size, robots_cache,
+            dns_cache_ttl, http_cache, http_cache_size, http_cache_offline, proxy_pool,
+            proxy_sticky, proxy_ban_markers, proxy_ban_titles, host_concurrency, optimize, memory_check_interval, pool_check_interval, max_memory_percent,
             async_mode=True, get_object=False, no_input=False):
     """
     Run Fetcher.
@@ -321,6 +451,41 @@ def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, proxy, u
             fetcher.default_options = copy.deepcopy(fetcher.default_options)
             fetcher.default_options['timeout'] = timeout
 
+    if max_body_size:
+        fetcher.max_body_size = max_body_size
+    if spill_body_size:
+        fetcher.spill_body_size = spill_body_size
+    if spill_dir:
+        fetcher.spill_dir = spill_dir
+    fetcher.spill_ttl = spill_ttl
+    if body_store and not no_input:
+        from pyspider.libs.body_store import connect_body_store
+        fetcher.body_store = connect_body_store(body_store, ttl=spill_ttl)
+        fetcher.body_store_size = body_store_size
+    if dns_cache_ttl != fetcher.dns_cache_ttl:
+        from pyspider.fetcher.dns_cache import DNSCache
+        fetcher.dns_cache_ttl = dns_cache_ttl
+        fetcher.dns_cache = DNSCache(dns_cache_ttl, fetcher.dns_negative_ttl) if dns_cache_ttl else None
+    if http_cache:
+        from pyspider.fetcher.http_cache import HTTPCache
+        fetcher.http_cache = HTTPCache(http_cache, http_cache_size * 1024 * 1024)
+        fetcher.http_cache_offline = http_cache_offline
+    if proxy_pool:
+        from pyspider.fetcher.proxy_pool import ProxyPool, load_proxies
+        ban_patterns = {}
+        if proxy_ban_markers is not None:
+            ban_patterns['ban_markers'] = proxy_ban_markers
+        if proxy_ban_titles is not None:
+            ban_patterns['ban_titles'] = proxy_ban_titles
+        fetcher.proxy_pool = ProxyPool(load_proxies(proxy_pool), sticky_ttl=proxy_sticky,
+                                       **ban_patterns)
+    if host_concurrency:
+        from pyspider.fetcher.host_limiter import HostLimiter
+        fetcher.host_limiter = HostLimiter(max_limit=host_concurrency)
+    if robots_cache:
+        from pyspider.fetcher.robots_cache import connect_robots_backend
+        fetcher.robots_txt_cache.backend = connect_robots_backend(robots_cache)
+
     g.instances.append(fetcher)
     if g.get('testing_mode') or get_object:
         return fetcher
@@ -335,19 +500,64 @@ def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, proxy, u
 @click.option('--processor-cls', default='pyspider.processor.Processor',
               callback=load_cls, help='Processor class to be used.')
 @click.option('--process-time-limit', default=30, help='script process time limit')
+@click.option('--workers', default=1,
+              help='run N processor processes, tasks are routed to them by hash of project, '
+              'each loads only the projects it serves')
 @click.pass_context
-def processor(ctx, processor_cls, process_time_limit, enable_stdout_capture=True, get_object=False):
+def processor(ctx, processor_cls, process_time_limit, workers, enable_stdout_capture=True,
+              get_object=False):
     """
     Run Processor.
     """
     g = ctx.obj
     Processor = load_cls(None, None, processor_cls)
 
-    processor = Processor(projectdb=g.projectdb,
-                          inqueue=g.fetcher2processor, status_queue=g.status_queue,
-                          newtask_queue=g.newtask_queue, result_queue=g.processor2result,
-                          enable_stdout_capture=enable_stdout_capture,
-                          process_time_limit=process_time_limit)
+    def create_processor(inqueue):
+        return Processor(projectdb=g.projectdb,
+                         inqueue=inqueue, status_queue=g.status_queue,
+                         newtask_queue=g.newtask_queue, result_queue=g.processor2result,
+                         enable_stdout_capture=enable_stdout_capture,
+                         process_time_limit=process_time_limit)
+
+    if workers > 1:
+        from pyspider.processor.pool import ProcessorPool, WorkerStats, worker_of
+
+        # workers are forked from this process, connect them by shared memory
+        worker_queues = [connect_message_queue('fetcher2processor.%d' % i, 'shm://',
+                                               g.get('queue_maxsize', 100))
+                         for i in range(workers)]
+        stats = WorkerStats(workers)
+
+        def run_worker(i):
+            worker = create_processor(worker_queues[i])
+
+            def route_task(task, response):
+                index = worker_of(task['project'], workers)
+                if index == i:
+                    return False
+                try:
+                    worker_queues[index].put_nowait((task, response))
+                except worker_queues[index].Full:
+                    # workers waiting on queues of each other would deadlock, do it here
+                    return False
+                return True
+
+            def report_batch(tasks, seconds):
+                stats.update(i, tasks, seconds, len(worker.project_manager.projects))
+
+            worker.route_task = route_task
+            worker.report_batch = report_batch
+            worker.run()
+
+        pool = ProcessorPool(g.fetcher2processor, worker_queues, stats,
+                             spawn_worker=lambda i: utils.run_in_subprocess(run_worker, i))
+        g.instances.append(pool)
+        if g.get('testing_mode') or get_object:
+            return pool
+        pool.run()
+        return
+
+    processor = create_processor(g.fetcher2processor)
 
     g.instances.append(processor)
     if g.get('testing_mode') or get_object:
@@ -624,6 +834,9 @@ def all(ctx, fetcher_num, processor_num, result_worker_num, run_in):
         # fetcher
         fetcher_config = g.config.get('fetcher', {})
         fetcher_config.setdefault('xmlrpc_host', '127.0.0.1')
+        if g.get('shared_memory'):
+            # all components are on this host, pass large bodies by shared memory
+            fetcher_config.setdefault('body_store', 'shm://')
         for i in range(fetcher_num):
             threads.append(run_in(ctx.invoke, fetcher, **fetcher_config))
 
@@ -664,11 +877,13 @@ def all(ctx, fetcher_num, processor_num, result_worker_num, run_in):
               help="only run taskdb bench test")
 @click.option('--message-queue-bench', default=False, is_flag=True,
               help="only run message queue bench test")
+@click.option('--task-queue-bench', default=False, is_flag=True,
+              help="only run scheduler task queue bench test")
 @click.option('--all-bench', default=False, is_flag=True,
               help="only run all bench test")
 @click.pass_context
 def bench(ctx, fetcher_num, processor_num, result_worker_num, run_in, total, show,
-          taskdb_bench, message_queue_bench, all_bench):
+          taskdb_bench, message_queue_bench, task_queue_bench, all_bench):
     """
     Run Benchmark test.
     In bench mode, in-memory sqlite database is used instead of on-disk sqlite database.
@@ -686,7 +901,8 @@ def bench(ctx, fetcher_num, processor_num, result_worker_num, run_in, total, sho
     else:
         run_in = utils.run_in_thread
 
-    all_test = not taskdb_bench and not message_queue_bench and not all_bench
+    all_test = not taskdb_bench and not message_queue_bench and not task_queue_bench \
+        and not all_bench
 
     # test taskdb
     if all_test or taskdb_bench:
@@ -694,6 +910,13 @@ def bench(ctx, fetcher_num, processor_num, result_worker_num, run_in, total, sho
     # test message queue
     if all_test or message_queue_bench:
         bench.bench_test_message_queue(g.scheduler2fetcher)
+    # test scheduler task queue
+    if all_test or task_queue_bench:
+        from pyspider.scheduler.task_queue import TaskQueue, TimingWheelTaskQueue
+        from pyspider.scheduler.compact_task_queue import CompactTaskQueue
+        bench.bench_test_task_queue(TaskQueue)
+        bench.bench_test_task_queue(TimingWheelTaskQueue)
+        bench.bench_test_task_queue(CompactTaskQueue)
     # test all
     if not all_test and not all_bench:
         return
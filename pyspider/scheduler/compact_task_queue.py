@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import array
+import hashlib
+import logging
+import threading
+import time
+
+from .task_queue import AtomInt, HostBackoff
+from .token_bucket import Bucket
+
+logger = logging.getLogger('scheduler')
+
+FREE, PENDING, WAITING, PROCESSING = 0, 1, 2, 3
+EMPTY, DELETED = -1, -2
+
+
+class SlotHeap(object):
+    '''
+    indexed binary heap of slot numbers stored in an array
+
+    `key(slot)` gives the sort key of a slot, position of every slot is kept in
+    the `pos` array shared with the owner, so a slot can be fixed or removed
+    in O(log n).
+    '''
+
+    def __init__(self, key, pos):
+        self.heap = array.array('q')
+        self.key = key
+        self.pos = pos
+
+    def __len__(self):
+        return len(self.heap)
+
+    @property
+    def top(self):
+        if self.heap:
+            return self.heap[0]
+        return -1
+
+    def push(self, slot):
+        self.heap.append(slot)
+        self._sift_up(len(self.heap) - 1)
+
+    def pop(self):
+        return self.remove(self.heap[0])
+
+    def remove(self, slot):
+        heap = self.heap
+        pos = self.pos[slot]
+        last = heap.pop()
+        if pos < len(heap):
+            heap[pos] = last
+            self.pos[last] = pos
+            self.fix(last)
+        self.pos[slot] = -1
+        return slot
+
+    def fix(self, slot):
+        '''restore heap invariant after the key of slot changed'''
+        pos = self.pos[slot]
+        if pos > 0 and self.key(slot) < self.key(self.heap[(pos - 1) >> 1]):
+            self._sift_up(pos)
+        else:
+            self._sift_down(pos)
+
+    def heapify(self):
+        '''rebuild heap after slots appended to `heap` directly'''
+        for pos, slot in enumerate(self.heap):
+            self.pos[slot] = pos
+        for pos in reversed(range(len(self.heap) // 2)):
+            self._sift_down(pos)
+
+    def _sift_up(self, pos):
+        heap, index, key = self.heap, self.pos, self.key
+        slot = heap[pos]
+        slot_key = key(slot)
+        while pos > 0:
+            parentpos = (pos - 1) >> 1
+            parent = heap[parentpos]
+            if not slot_key < key(parent):
+                break
+            heap[pos] = parent
+            index[parent] = pos
+            pos = parentpos
+        heap[pos] = slot
+        index[slot] = pos
+
+    def _sift_down(self, pos):
+        heap, index, key = self.heap, self.pos, self.key
+        endpos = len(heap)
+        slot = heap[pos]
+        slot_key = key(slot)
+        childpos = 2 * pos + 1
+        while childpos < endpos:
+            child_key = key(heap[childpos])
+            rightpos = childpos + 1
+            if rightpos < endpos:
+                right_key = key(heap[rightpos])
+                if right_key < child_key:
+                    childpos, child_key = rightpos, right_key
+            if not child_key < slot_key:
+                break
+            child = heap[childpos]
+            heap[pos] = child
+            index[child] = pos
+            pos = childpos
+            childpos = 2 * pos + 1
+        heap[pos] = slot
+        index[slot] = pos
+
+
+class CompactTaskQueue(object):
+    '''
+    TaskQueue with the same put / get / done / delete semantics, for projects with
+    millions of queued tasks
+
+    taskids are interned as 16 bytes digests (the md5 hex taskids generated by
+    default are decoded, other taskids are hashed and kept aside), priority,
+    exetime and sequence of tasks are kept in packed arrays indexed by slot, the
+    pending, waiting (time queue) and processing heaps only hold slot numbers.
+    Digests are looked up with an open addressing hash table of slots, so there
+    is no python object per task. Slots of finished tasks are reused.
+    '''
+    processing_timeout = 10 * 60
+
+    def __init__(self, rate=0, burst=0):
+        self.mutex = threading.RLock()
+        self.bucket = Bucket(rate=rate, burst=burst)
+        # TaskQueueSnapshot logging put / remove, when snapshot is enabled
+        self.journal = None
+        self.host_backoff = HostBackoff()
+
+        self._digests = bytearray()         # 16 bytes digest of each slot
+        self._names = dict()                # slot -> taskid, when taskid is not a md5 hex
+        self._table = array.array('q', [EMPTY]) * 8  # digest hash -> slot
+        self._table_used = 0                # slots and DELETED marks in table
+        self._count = 0
+        self._priority = array.array('q')
+        self._exetime = array.array('d')
+        self._sequence = array.array('Q')
+        self._state = bytearray()
+        self._pos = array.array('q')
+        self._free = array.array('q')
+
+        priority, exetime, sequence = self._priority, self._exetime, self._sequence
+        self.priority_queue = SlotHeap(lambda s: (-priority[s], sequence[s]), self._pos)
+        self.time_queue = SlotHeap(lambda s: (exetime[s], sequence[s]), self._pos)
+        self.processing = SlotHeap(lambda s: (exetime[s], sequence[s]), self._pos)
+        self._heaps = {
+            PENDING: self.priority_queue,
+            WAITING: self.time_queue,
+            PROCESSING: self.processing,
+        }
+
+    def backoff(self, url, seconds):
+        '''tasks of host of url put in seconds are delayed, see TaskQueue.backoff'''
+        if url:
+            self.host_backoff.hold(url, seconds)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @rate.setter
+    def rate(self, value):
+        self.bucket.rate = value
+
+    @property
+    def burst(self):
+        return self.bucket.burst
+
+    @burst.setter
+    def burst(self, value):
+        self.bucket.burst = value
+
+    @staticmethod
+    def _intern(taskid):
+        '''return (digest, is_md5_hex) of taskid'''
+        if len(taskid) == 32:
+            try:
+                digest = bytes.fromhex(taskid)
+                if digest.hex() == taskid:
+                    return digest, True
+            except (ValueError, TypeError):
+                pass
+        if not isinstance(taskid, bytes):
+            taskid = taskid.encode('utf8')
+        return hashlib.md5(taskid).digest(), False
+
+    def _lookup(self, digest):
+        '''return (table index, slot) of digest, slot is -1 when not found'''
+        table, digests = self._table, self._digests
+        mask = len(table) - 1
+        index = int.from_bytes(digest[:8], 'little') & mask
+        while True:
+            slot = table[index]
+            if slot == EMPTY:
+                return index, -1
+            if slot >= 0 and digests[slot * 16:slot * 16 + 16] == digest:
+                return index, slot
+            index = (index + 1) & mask
+
+    def _slot(self, taskid):
+        return self._lookup(self._intern(taskid)[0])[1]
+
+    def _taskid(self, slot):
+        if slot in self._names:
+            return self._names[slot]
+        return self._digests[slot * 16:slot * 16 + 16].hex()
+
+    def _resize_table(self):
+        size = 8
+        while size < self._count * 4:
+            size <<= 1
+        table = array.array('q', [EMPTY]) * size
+        mask = size - 1
+        digests, state = self._digests, self._state
+        for slot in range(len(state)):
+            if state[slot] == FREE:
+                continue
+            index = int.from_bytes(digests[slot * 16:slot * 16 + 8], 'little') & mask
+            while table[index] != EMPTY:
+                index = (index + 1) & mask
+            table[index] = slot
+        self._table = table
+        self._table_used = self._count
+
+    def _alloc(self, taskid, priority, exetime, sequence, state):
+        '''intern taskid which is not in queue, return its slot'''
+        digest, is_hex = self._intern(taskid)
+        if self._free:
+            slot = self._free.pop()
+            self._digests[slot * 16:slot * 16 + 16] = digest
+            self._priority[slot] = priority
+            self._exetime[slot] = exetime
+            self._sequence[slot] = sequence
+            self._state[slot] = state
+        else:
+            slot = len(self._state)
+            self._digests += digest
+            self._priority.append(priority)
+            self._exetime.append(exetime)
+            self._sequence.append(sequence)
+            self._state.append(state)
+            self._pos.append(-1)
+        if not is_hex:
+            self._names[slot] = taskid
+        self._count += 1
+
+        # reuse DELETED marks on the probe path
+        table = self._table
+        mask = len(table) - 1
+        index = int.from_bytes(digest[:8], 'little') & mask
+        while table[index] >= 0:
+            index = (index + 1) & mask
+        if table[index] == EMPTY:
+            self._table_used += 1
+        table[index] = slot
+        if self._table_used * 2 > len(table):
+            self._resize_table()
+        return slot
+
+    def _release(self, slot):
+        index, _ = self._lookup(bytes(self._digests[slot * 16:slot * 16 + 16]))
+        self._table[index] = DELETED
+        self._names.pop(slot, None)
+        self._state[slot] = FREE
+        self._free.append(slot)
+        self._count -= 1
+
+    def _move(self, slot, state):
+        self._state[slot] = state
+        self._heaps[state].push(slot)
+
+    def _push(self, taskid, priority, exetime, sequence, state):
+        slot = self._alloc(taskid, priority, exetime, sequence, state)
+        self._heaps[state].push(slot)
+
+    def check_update(self):
+        '''
+        Check time queue and processing queue
+
+        put tasks to priority queue when execute time arrived or process timeout
+        '''
+        self._check_time_queue()
+        self._check_processing()
+
+    def _check_time_queue(self):
+        now = time.time()
+        with self.mutex:
+            while self.time_queue and self._exetime[self.time_queue.top] < now:
+                slot = self.time_queue.pop()
+                self._exetime[slot] = 0
+                self._move(slot, PENDING)
+
+    def _check_processing(self):
+        now = time.time()
+        with self.mutex:
+            while self.processing and self._exetime[self.processing.top] < now:
+                slot = self.processing.pop()
+                self._exetime[slot] = 0
+                self._move(slot, PENDING)
+                logger.info("processing: retry %s", self._taskid(slot))
+
+    def put(self, taskid, priority=0, exetime=0, url=None):
+        '''Put a task into task queue, see TaskQueue.put, limit by host is not supported'''
+        now = time.time()
+        priority = int(priority or 0)
+        exetime = float(exetime or 0)
+
+        with self.mutex:
+            slot = self._slot(taskid)
+            if slot >= 0:
+                state = self._state[slot]
+                if state == PROCESSING:
+                    # force update a processing task is not allowed
+                    return
+                # merge into the queued task, like PriorityTaskQueue does
+                new_priority = max(priority, self._priority[slot])
+                new_exetime = min(exetime, self._exetime[slot])
+                if new_priority != self._priority[slot] or new_exetime != self._exetime[slot]:
+                    self._priority[slot] = new_priority
+                    self._exetime[slot] = new_exetime
+                    self._heaps[state].fix(slot)
+            else:
+                exetime = self.host_backoff.delay(url, exetime)
+                if exetime and exetime > now:
+                    self._push(taskid, priority, exetime, AtomInt.get_value(), WAITING)
+                else:
+                    self._push(taskid, priority, 0, AtomInt.get_value(), PENDING)
+
+            if self.journal is not None:
+                self.journal.put(taskid, priority, exetime)
+
+    def get(self):
+        '''Get a task from queue when bucket available'''
+        if self.bucket.get() < 1:
+            return None
+        now = time.time()
+        with self.mutex:
+            if not self.priority_queue:
+                return None
+            self.bucket.desc()
+            slot = self.priority_queue.pop()
+            self._exetime[slot] = now + self.processing_timeout
+            self._move(slot, PROCESSING)
+            return self._taskid(slot)
+
+    def done(self, taskid):
+        '''Mark task done'''
+        with self.mutex:
+            slot = self._slot(taskid)
+            if slot < 0 or self._state[slot] != PROCESSING:
+                return False
+            self.processing.remove(slot)
+            self._release(slot)
+            if self.journal is not None:
+                self.journal.remove(taskid)
+        return True
+
+    def delete(self, taskid):
+        with self.mutex:
+            slot = self._slot(taskid)
+            if slot < 0:
+                return False
+            self._heaps[self._state[slot]].remove(slot)
+            self._release(slot)
+            if self.journal is not None:
+                self.journal.remove(taskid)
+        return True
+
+    def size(self):
+        return self._count
+
+    def iter_tasks(self):
+        '''
+        yield (taskid, priority, exetime, sequence) of all tasks in queue,
+        exetime of processing tasks is 0 as they would be retried
+        '''
+        with self.mutex:
+            for slot, state in enumerate(self._state):
+                if state == FREE:
+                    continue
+                exetime = 0 if state == PROCESSING else self._exetime[slot]
+                yield self._taskid(slot), self._priority[slot], exetime, self._sequence[slot]
+
+    def bulk_load(self, tasks):
+        '''
+        load (taskid, priority, exetime, sequence) tasks into an empty queue,
+        heaps are built once after all tasks loaded
+        '''
+        now = time.time()
+        max_sequence = 0
+        with self.mutex:
+            for taskid, priority, exetime, sequence in tasks:
+                if self._slot(taskid) >= 0:
+                    continue
+                max_sequence = max(max_sequence, sequence)
+                if exetime and exetime > now:
+                    slot = self._alloc(taskid, priority, exetime, sequence, WAITING)
+                    self.time_queue.heap.append(slot)
+                else:
+                    slot = self._alloc(taskid, priority, 0, sequence, PENDING)
+                    self.priority_queue.heap.append(slot)
+            self.priority_queue.heapify()
+            self.time_queue.heapify()
+        # keep the FIFO order of loaded tasks before new tasks
+        AtomInt.update(max_sequence)
+
+    def is_processing(self, taskid):
+        '''
+        return True if taskid is in processing
+        '''
+        slot = self._slot(taskid)
+        return slot >= 0 and self._state[slot] == PROCESSING
+
+    def __len__(self):
+        return self.size()
+
+    def __contains__(self, taskid):
+        return self._slot(taskid) >= 0
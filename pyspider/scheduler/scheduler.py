@@ -16,7 +16,11 @@ from collections import deque
 
 from pyspider.libs import counter, utils
 from pyspider.libs.base_handler import BaseHandler
+from pyspider.libs.bloom_filter import BloomFilter
+from pyspider.message_queue import get_many
 from .task_queue import TaskQueue
+from .task_queue_snapshot import TaskQueueSnapshot
+from .taskdb_buffer import BufferedTaskDB
 
 logger = logging.getLogger('scheduler')
 
@@ -31,8 +35,19 @@ class Project(object):
         self.scheduler = scheduler
 
         self.active_tasks = deque(maxlen=scheduler.ACTIVE_TASKS)
-        self.task_queue = TaskQueue()
+        self.crawl_config = {}
+        self.task_queue = scheduler._new_task_queue(self)
         self.task_loaded = False
+        self.task_loading = False  # tasks are being loaded from taskdb by chunks
+        self.task_load_cursor = None
+        self.task_load_count = 0
+        self.task_load_total = 0
+        self.task_load_start = 0
+        self.task_snapshot = None  # TaskQueueSnapshot of task_queue
+        self.task_filter = None  # BloomFilter of all taskids in taskdb
+        self.task_filter_ready = False
+        self.task_filter_loading = []  # statuses of tasks left to add to task_filter
+        self.task_filter_cursor = None
         self._selected_tasks = False  # selected tasks after recent pause
         self._send_finished_event_wait = 0  # wait for scheduler.FAIL_PAUSE_NUM loop steps before sending the event
 
@@ -129,6 +144,7 @@ class Project(object):
         self.min_tick = info.get('min_tick', 0)
         self.retry_delay = info.get('retry_delay', {})
         self.crawl_config = info.get('crawl_config', {})
+        self.scheduler._set_host_limit(self, self.task_queue)
 
     @property
     def active(self):
@@ -160,13 +176,37 @@ class Scheduler(object):
     FAIL_PAUSE_NUM = 10
     PAUSE_TIME = 5*60
     UNPAUSE_CHECK_NUM = 3
+    # false positive rate of the per project taskid filter, which let new requests skip
+    # the taskdb lookup, 0 to disable
+    TASK_FILTER_ERROR_RATE = 0
+    TASK_FILTER_MAX_MEMORY = 64 * 1024 * 1024
+    TASK_LOAD_CHUNK = 1000
+    TASK_LOAD_TIME = 0.5  # max seconds spent on loading tasks in one loop
+    # seconds between snapshots of task queues in data_path, 0 to disable
+    TASK_QUEUE_SNAPSHOT_INTERVAL = 0
+    # TaskQueue implementation, CompactTaskQueue uses less memory for large queues
+    TASK_QUEUE_CLS = TaskQueue
+    # select tasks round-robin by host, with rate / burst and max concurrent tasks
+    # for each host, 0 for no limit. Can be overridden with host_rate, host_burst,
+    # host_concurrency and host_key ('host' or 'domain') in crawl_config.
+    LIMIT_BY_HOST = False
+    HOST_RATE = 0
+    HOST_BURST = 0
+    HOST_CONCURRENCY = 0
+    # ShardRing of sharded schedulers and the shard of this scheduler, see shard.py
+    shard_ring = None
+    shard_id = None
 
     TASK_PACK = 1
     STATUS_PACK = 2  # current not used
     REQUEST_PACK = 3  # current not used
 
     def __init__(self, taskdb, projectdb, newtask_queue, status_queue,
-                 out_queue, data_path='./data', resultdb=None):
+                 out_queue, data_path='./data', resultdb=None,
+                 taskdb_buffer_size=0, taskdb_buffer_interval=1.0):
+        if taskdb_buffer_size:
+            # write-behind: insert/update are coalesced and flushed in batches
+            taskdb = BufferedTaskDB(taskdb, taskdb_buffer_size, taskdb_buffer_interval)
         self.taskdb = taskdb
         self.projectdb = projectdb
         self.resultdb = resultdb
@@ -210,11 +250,37 @@ class Scheduler(object):
         ):
             return
         for project in self.projectdb.check_update(self._last_update_project):
+            if not self._own_project(project['name']):
+                continue
             self._update_project(project)
             logger.debug("project: %s updated.", project['name'])
         self._force_update_project = False
         self._last_update_project = now
 
+    def _own_project(self, name):
+        '''whether this scheduler has tasks of project'''
+        return self.shard_ring is None or self.shard_id in self.shard_ring.shards_of_project(name)
+
+    def _is_primary(self, name):
+        '''whether this scheduler handles project level events of project'''
+        return self.shard_ring is None or self.shard_ring.shard_of(name) == self.shard_id
+
+    def _own_task(self, project, taskid):
+        return self.shard_ring is None or self.shard_ring.shard_of(project, taskid) == self.shard_id
+
+    def _is_split(self, name):
+        '''whether tasks of project are spread over shards'''
+        return self.shard_ring is not None and len(self.shard_ring.shards_of_project(name)) > 1
+
+    def _shards_done(self, name):
+        '''
+        no task of project is active on other shards, tasks of a project split over
+        shards are done when none is active in taskdb
+        '''
+        if not self._is_split(name):
+            return True
+        return not self.taskdb.status_count(name).get(self.taskdb.ACTIVE, 0)
+
     get_info_attributes = ['min_tick', 'retry_delay', 'crawl_config']
 
     def _update_project(self, project):
@@ -226,7 +292,7 @@ class Scheduler(object):
 
         project = self.projects[project['name']]
 
-        if project._send_on_get_info:
+        if project._send_on_get_info and self._is_primary(project.name):
             # update project runtime info from processor by sending a _on_get_info
             # request, result is in status_page.track.save
             project._send_on_get_info = False
@@ -250,33 +316,247 @@ class Scheduler(object):
                 project.task_loaded = True
         else:
             if project.task_loaded:
-                project.task_queue = TaskQueue()
+                self._close_task_snapshot(project)
+                project.task_queue = self._new_task_queue(project)
                 project.task_loaded = False
+                project.task_loading = False
 
             if project not in self._cnt['all']:
                 self._update_project_cnt(project.name)
 
     scheduler_task_fields = ['taskid', 'project', 'schedule', ]
 
+    def _new_task_queue(self, project, rate=0, burst=0):
+        task_queue = self.TASK_QUEUE_CLS(rate, burst)
+        self._set_host_limit(project, task_queue)
+        return task_queue
+
+    def _set_host_limit(self, project, task_queue):
+        '''apply per host limits of project to task_queue'''
+        if not self.LIMIT_BY_HOST:
+            return
+        if not hasattr(task_queue, 'set_host_limit'):
+            logger.warning('%s does not support limit by host', type(task_queue).__name__)
+            return
+        crawl_config = project.crawl_config or {}
+        task_queue.set_host_limit(
+            rate=crawl_config.get('host_rate', self.HOST_RATE),
+            burst=crawl_config.get('host_burst', self.HOST_BURST),
+            concurrency=crawl_config.get('host_concurrency', self.HOST_CONCURRENCY),
+            key=crawl_config.get('host_key', 'host'),
+        )
+
     def _load_tasks(self, project):
-        '''load tasks from database'''
-        task_queue = project.task_queue
+        '''
+        start loading tasks from database
 
-        for task in self.taskdb.load_tasks(
-                self.taskdb.ACTIVE, project.name, self.scheduler_task_fields
-        ):
+        tasks are loaded chunk by chunk in _check_task_loading, so the project starts
+        dispatching from the first chunk.
+        '''
+        project.task_load_cursor = None
+        project.task_load_count = 0
+        project.task_load_total = self.taskdb.status_count(project.name).get(self.taskdb.ACTIVE, 0)
+        project.task_load_start = time.time()
+        project.task_loaded = True
+        if self._use_task_snapshot(project.name) and self._load_task_snapshot(project):
+            return
+        project.task_loading = True
+
+    def _load_tasks_chunk(self, project):
+        '''load next chunk of tasks of project from database'''
+        task_queue = project.task_queue
+        fields = self.scheduler_task_fields
+        if self.LIMIT_BY_HOST:
+            fields = fields + ['url']
+        try:
+            tasks, cursor = self.taskdb.load_tasks_page(
+                self.taskdb.ACTIVE, project.name, fields,
+                cursor=project.task_load_cursor, limit=self.TASK_LOAD_CHUNK)
+        except NotImplementedError:
+            # taskdb without paging, load all at once
+            tasks, cursor = self.taskdb.load_tasks(
+                self.taskdb.ACTIVE, project.name, fields), None
+
+        for task in tasks:
             taskid = task['taskid']
+            if not self._own_task(project.name, taskid):
+                continue
             _schedule = task.get('schedule', self.default_schedule)
             priority = _schedule.get('priority', self.default_schedule['priority'])
             exetime = _schedule.get('exetime', self.default_schedule['exetime'])
-            task_queue.put(taskid, priority, exetime)
-        project.task_loaded = True
-        logger.debug('project: %s loaded %d tasks.', project.name, len(task_queue))
+            task_queue.put(taskid, priority, exetime, url=task.get('url'))
+            project.task_load_count += 1
+        project.task_load_cursor = cursor
+        if cursor is not None:
+            return
+
+        project.task_loading = False
+        logger.info('project: %s loaded %d tasks in %.1fs.', project.name, len(task_queue),
+                    time.time() - project.task_load_start)
+        if self._use_task_snapshot(project.name):
+            project.task_snapshot = TaskQueueSnapshot(self._task_snapshot_path(project.name))
+            project.task_snapshot.dump(task_queue)
+            task_queue.journal = project.task_snapshot
+        self._on_tasks_loaded(project)
+
+    def _on_tasks_loaded(self, project):
+        self._load_task_filter(project)
 
         if project not in self._cnt['all']:
             self._update_project_cnt(project.name)
         self._cnt['all'].value((project.name, 'pending'), len(project.task_queue))
 
+    def _check_task_loading(self):
+        '''Load tasks of starting projects, spending at most TASK_LOAD_TIME in a loop'''
+        start = time.time()
+        for project in list(self.projects.values()):
+            while project.task_loading:
+                self._load_tasks_chunk(project)
+                if time.time() - start > self.TASK_LOAD_TIME:
+                    return
+            while project.task_filter_loading:
+                self._load_task_filter_chunk(project)
+                if time.time() - start > self.TASK_LOAD_TIME:
+                    return
+
+    def _use_task_snapshot(self, project_name):
+        '''
+        snapshots are not used for projects split over shards, active tasks owned
+        by a shard can't be counted from taskdb to verify the snapshot
+        '''
+        return bool(self.TASK_QUEUE_SNAPSHOT_INTERVAL) and not self._is_split(project_name)
+
+    def _task_snapshot_path(self, project_name):
+        if self.shard_ring is None:
+            name = 'scheduler.%s.queue' % project_name
+        else:
+            name = 'scheduler.%s.%d-%d.queue' % (project_name, self.shard_id,
+                                                 self.shard_ring.shards)
+        return os.path.join(self.data_path, name)
+
+    def _load_task_snapshot(self, project):
+        '''
+        load task queue of project from snapshot, return False when snapshot is missing
+        or out of sync with taskdb: active tasks counted differently, or tasks updated
+        after the snapshot is synced.
+        '''
+        snapshot = TaskQueueSnapshot(self._task_snapshot_path(project.name))
+        task_queue = self._new_task_queue(project, project.task_queue.rate,
+                                          project.task_queue.burst)
+        if not snapshot.load(task_queue):
+            return False
+        if len(task_queue) != project.task_load_total:
+            logger.info('project: %s task queue snapshot out of date (%d tasks, %d in taskdb)',
+                        project.name, len(task_queue), project.task_load_total)
+            return False
+        try:
+            updatetime = self.taskdb.last_updatetime(project.name)
+        except NotImplementedError:
+            updatetime = None
+        if updatetime and updatetime > snapshot.synced:
+            logger.info('project: %s task queue snapshot out of date (synced at %s, '
+                        'taskdb updated at %s)', project.name, snapshot.synced, updatetime)
+            return False
+
+        task_queue.journal = snapshot
+        project.task_snapshot = snapshot
+        project.task_queue = task_queue
+        project.task_load_count = len(task_queue)
+        project.task_loading = False
+        logger.info('project: %s loaded %d tasks from snapshot in %.1fs.', project.name,
+                    len(task_queue), time.time() - project.task_load_start)
+        self._on_tasks_loaded(project)
+        return True
+
+    def _try_dump_task_snapshots(self, force=False):
+        '''Flush delta logs, and dump snapshots every TASK_QUEUE_SNAPSHOT_INTERVAL'''
+        now = time.time()
+        for project in list(self.projects.values()):
+            snapshot = project.task_snapshot
+            if snapshot is None:
+                continue
+            if force or now - snapshot.created > self.TASK_QUEUE_SNAPSHOT_INTERVAL:
+                snapshot.dump(project.task_queue)
+            else:
+                snapshot.flush()
+
+    def _close_task_snapshot(self, project):
+        if project.task_snapshot is None:
+            return
+        project.task_snapshot.dump(project.task_queue)
+        project.task_snapshot.close()
+        project.task_queue.journal = None
+        project.task_snapshot = None
+
+    def _task_filter_path(self, project_name):
+        return os.path.join(self.data_path, 'scheduler.%s.bloom' % project_name)
+
+    def _load_task_filter(self, project):
+        '''
+        load taskid filter of project from data_path, or start rebuilding it from
+        taskdb when missing or out of sync with taskdb
+
+        the filter is rebuilt chunk by chunk in _check_task_loading, taskids inserted
+        by on_new_request meanwhile are added as well. It's used only after all tasks
+        in taskdb are added.
+        '''
+        if not self.TASK_FILTER_ERROR_RATE or project.task_filter is not None:
+            return
+        total = sum(self.taskdb.status_count(project.name).values())
+        path = self._task_filter_path(project.name)
+
+        task_filter = BloomFilter.load(path)
+        if task_filter is not None and (
+                task_filter.count != total
+                or (task_filter.count > task_filter.capacity
+                    and task_filter.num_bits < self.TASK_FILTER_MAX_MEMORY * 8)
+                or task_filter.error_rate != self.TASK_FILTER_ERROR_RATE
+        ):
+            logger.info('project: %s task filter out of date (%d tasks, %d in taskdb), rebuilding',
+                        project.name, task_filter.count, total)
+            task_filter = None
+        if task_filter is not None:
+            project.task_filter = task_filter
+            project.task_filter_ready = True
+            return
+
+        project.task_filter = BloomFilter(max(total * 2, 10000), self.TASK_FILTER_ERROR_RATE,
+                                          self.TASK_FILTER_MAX_MEMORY)
+        project.task_filter_loading = [self.taskdb.ACTIVE, self.taskdb.SUCCESS,
+                                       self.taskdb.FAILED, self.taskdb.BAD]
+        project.task_filter_cursor = None
+
+    def _load_task_filter_chunk(self, project):
+        '''add next chunk of taskids of project in taskdb to task filter'''
+        status = project.task_filter_loading[0]
+        try:
+            tasks, cursor = self.taskdb.load_tasks_page(
+                status, project.name, ['taskid', ],
+                cursor=project.task_filter_cursor, limit=self.TASK_LOAD_CHUNK)
+        except NotImplementedError:
+            tasks, cursor = self.taskdb.load_tasks(status, project.name, ['taskid', ]), None
+        for task in tasks:
+            project.task_filter.add(task['taskid'])
+        project.task_filter_cursor = cursor
+        if cursor is not None:
+            return
+        project.task_filter_loading.pop(0)
+        if project.task_filter_loading:
+            return
+
+        # a task inserted while building may be added twice, count what's in taskdb
+        # so the filter is not taken as out of date on next start
+        project.task_filter.count = sum(self.taskdb.status_count(project.name).values())
+        project.task_filter_ready = True
+        project.task_filter.dump(self._task_filter_path(project.name))
+        logger.info('project: %s task filter built with %d tasks', project.name,
+                    len(project.task_filter))
+
+    def _dump_task_filters(self):
+        for project in list(self.projects.values()):
+            if project.task_filter_ready and project.task_filter.changed:
+                project.task_filter.dump(self._task_filter_path(project.name))
+
     def _update_project_cnt(self, project_name):
         status_count = self.taskdb.status_count(project_name)
         self._cnt['all'].value(
@@ -326,7 +606,8 @@ class Scheduler(object):
         self.projects[task['project']].task_queue.put(
             task['taskid'],
             priority=_schedule.get('priority', self.default_schedule['priority']),
-            exetime=_schedule.get('exetime', self.default_schedule['exetime'])
+            exetime=_schedule.get('exetime', self.default_schedule['exetime']),
+            url=task.get('url'),
         )
 
     def send_task(self, task, force=True):
@@ -343,26 +624,41 @@ class Scheduler(object):
             else:
                 raise
 
+    def send_tasks(self, tasks):
+        '''
+        dispatch tasks to fetcher, in one round trip when out queue supports it
+
+        tasks are kept in send_buffer when out queue is full
+        '''
+        if len(tasks) < 2 or not hasattr(self.out_queue, 'put_many'):
+            for task in tasks:
+                self.send_task(task)
+            return
+        try:
+            self.out_queue.put_many(tasks, block=False)
+        except Queue.Full:
+            self._send_buffer.extendleft(tasks)
+
     def _check_task_done(self):
         '''Check status queue'''
         cnt = 0
         try:
             while True:
-                task = self.status_queue.get_nowait()
-                # check _on_get_info result here
-                if task.get('taskid') == '_on_get_info' and 'project' in task and 'track' in task:
-                    if task['project'] not in self.projects:
+                for task in get_many(self.status_queue, self.LOOP_LIMIT, block=False):
+                    # check _on_get_info result here
+                    if task.get('taskid') == '_on_get_info' and 'project' in task and 'track' in task:
+                        if task['project'] not in self.projects:
+                            continue
+                        project = self.projects[task['project']]
+                        project.on_get_info(task['track'].get('save') or {})
+                        logger.info(
+                            '%s on_get_info %r', task['project'], task['track'].get('save', {})
+                        )
                         continue
-                    project = self.projects[task['project']]
-                    project.on_get_info(task['track'].get('save') or {})
-                    logger.info(
-                        '%s on_get_info %r', task['project'], task['track'].get('save', {})
-                    )
-                    continue
-                elif not self.task_verify(task):
-                    continue
-                self.on_task_status(task)
-                cnt += 1
+                    elif not self.task_verify(task):
+                        continue
+                    self.on_task_status(task)
+                    cnt += 1
         except Queue.Empty:
             pass
         return cnt
@@ -385,14 +681,16 @@ class Scheduler(object):
         tasks = {}
         while len(tasks) < self.LOOP_LIMIT:
             try:
-                task = self.newtask_queue.get_nowait()
+                messages = get_many(self.newtask_queue, self.LOOP_LIMIT - len(tasks), block=False)
             except Queue.Empty:
                 break
 
-            if isinstance(task, list):
-                _tasks = task
-            else:
-                _tasks = (task, )
+            _tasks = []
+            for message in messages:
+                if isinstance(message, list):
+                    _tasks.extend(message)
+                else:
+                    _tasks.append(message)
 
             for task in _tasks:
                 if not self.task_verify(task):
@@ -428,6 +726,8 @@ class Scheduler(object):
                 continue
             if int(project.min_tick) == 0:
                 continue
+            if not self._is_primary(project.name):
+                continue
             if self._last_tick % int(project.min_tick) != 0:
                 continue
             self.on_select_task({
@@ -536,10 +836,14 @@ class Scheduler(object):
                 project._send_finished_event_wait = 0
 
             # check and send finished event to project
-            if not project_cnt and len(task_queue) == 0 and project._selected_tasks:
+            if not project_cnt and len(task_queue) == 0 and project._selected_tasks \
+                    and self._is_primary(project.name):
                 # wait for self.FAIL_PAUSE_NUM steps to make sure all tasks in queue have been processed
                 if project._send_finished_event_wait < self.FAIL_PAUSE_NUM:
                     project._send_finished_event_wait += 1
+                elif not self._shards_done(project.name):
+                    # tasks of project on other shards are not done, check again later
+                    project._send_finished_event_wait = 0
                 else:
                     project._selected_tasks = False
                     project._send_finished_event_wait = 0
@@ -558,8 +862,11 @@ class Scheduler(object):
                         },
                     })
 
+        project_taskids = dict()
         for project, taskid in taskids:
-            self._load_put_task(project, taskid)
+            project_taskids.setdefault(project, []).append(taskid)
+        for project, _taskids in project_taskids.items():
+            self._load_put_tasks(project, _taskids)
 
         return cnt_dict
 
@@ -573,6 +880,24 @@ class Scheduler(object):
             return
         task = self.on_select_task(task)
 
+    def _load_put_tasks(self, project, taskids):
+        '''load selected tasks of a project in one taskdb query and send them in select order'''
+        try:
+            tasks = dict((task['taskid'], task) for task in self.taskdb.get_tasks(
+                project, taskids, fields=self.request_task_fields))
+        except ValueError:
+            logger.error('bad task pack in %s, fallback to load one by one', project)
+            for taskid in taskids:
+                self._load_put_task(project, taskid)
+            return
+        selected = []
+        for taskid in taskids:
+            task = tasks.get(taskid)
+            if not task:
+                continue
+            selected.append(self.on_select_task(task, send=False))
+        self.send_tasks(selected)
+
     def _print_counter_log(self):
         # print top 5 active counters
         keywords = ('pending', 'success', 'retry', 'failed')
@@ -616,6 +941,7 @@ class Scheduler(object):
         self._cnt['1h'].dump(os.path.join(self.data_path, 'scheduler.1h'))
         self._cnt['1d'].dump(os.path.join(self.data_path, 'scheduler.1d'))
         self._cnt['all'].dump(os.path.join(self.data_path, 'scheduler.all'))
+        self._dump_task_filters()
 
     def _try_dump_cnt(self):
         '''Dump counters every 60 seconds'''
@@ -625,6 +951,15 @@ class Scheduler(object):
             self._dump_cnt()
             self._print_counter_log()
 
+    def _try_flush_taskdb(self):
+        '''Flush buffered taskdb writes when buffer is full or flush interval passed'''
+        if isinstance(self.taskdb, BufferedTaskDB):
+            self.taskdb.flush(force=False)
+
+    def _flush_taskdb(self):
+        if isinstance(self.taskdb, BufferedTaskDB):
+            self.taskdb.flush()
+
     def _check_delete(self):
         '''Check project delete'''
         now = time.time()
@@ -638,12 +973,16 @@ class Scheduler(object):
 
             logger.warning("deleting project: %s!", project.name)
             del self.projects[project.name]
-            self.taskdb.drop(project.name)
-            self.projectdb.drop(project.name)
-            if self.resultdb:
-                self.resultdb.drop(project.name)
+            if self._is_primary(project.name):
+                self.taskdb.drop(project.name)
+                self.projectdb.drop(project.name)
+                if self.resultdb:
+                    self.resultdb.drop(project.name)
             for each in self._cnt.values():
                 del each[project.name]
+            if os.path.exists(self._task_filter_path(project.name)):
+                os.remove(self._task_filter_path(project.name))
+            TaskQueueSnapshot(self._task_snapshot_path(project.name)).remove_files()
 
     def __len__(self):
         return sum(len(x.task_queue) for x in self.projects.values())
@@ -660,12 +999,15 @@ class Scheduler(object):
         '''comsume queues and feed tasks to fetcher, once'''
 
         self._update_projects()
+        self._check_task_loading()
         self._check_task_done()
         self._check_request()
         while self._check_cronjob():
             pass
         self._check_select()
         self._check_delete()
+        self._try_flush_taskdb()
+        self._try_dump_task_snapshots()
         self._try_dump_cnt()
 
     def run(self):
@@ -687,6 +1029,8 @@ class Scheduler(object):
                 continue
 
         logger.info("scheduler exiting...")
+        self._flush_taskdb()
+        self._try_dump_task_snapshots(force=True)
         self._dump_cnt()
 
     def trigger_on_start(self, project):
@@ -821,19 +1165,26 @@ class Scheduler(object):
             """
             try:
                 result = {}
-                # Add task queue sizes
-                result['task_queue'] = self.task_queue.qsize() if hasattr(self.task_queue, 'qsize') else -1
-                result['task_queue_priority'] = self.task_queue_priority.qsize() if hasattr(self.task_queue_priority, 'qsize') else -1
-                result['result_queue'] = self.result_queue.qsize() if hasattr(self.result_queue, 'qsize') else -1
-
-                # Add processing queue sizes
-                if hasattr(self, 'status_queue'):
-                    result['status_queue'] = self.status_queue.qsize() if hasattr(self.status_queue, 'qsize') else -1
-
-                # Add other queues if available
-                if hasattr(self, 'newtask_queue'):
-                    result['newtask_queue'] = self.newtask_queue.qsize() if hasattr(self.newtask_queue, 'qsize') else -1
-
+                for name in ('newtask_queue', 'status_queue', 'out_queue'):
+                    queue = getattr(self, name, None)
+                    result[name] = queue.qsize() if hasattr(queue, 'qsize') else -1
+
+                # progress of projects loading tasks from taskdb
+                result['task_loading'] = dict(
+                    (project.name, {
+                        'loaded': project.task_load_count,
+                        'total': project.task_load_total,
+                        'done': not project.task_loading,
+                        'time': time.time() - project.task_load_start,
+                    }) for project in list(self.projects.values()) if project.task_loaded
+                )
+
+                # pending and processing tasks of hosts, when limited by host
+                result['hosts'] = dict(
+                    (project.name, project.task_queue.hosts.hosts())
+                    for project in list(self.projects.values())
+                    if getattr(project.task_queue, 'hosts', None) is not None
+                )
                 return result
             except Exception as e:
                 logger.exception("Error in get_queue_stats: %s", e)
@@ -892,6 +1243,11 @@ class Scheduler(object):
             logger.debug('overflow task %(project)s:%(taskid)s %(url)s', task)
             return
 
+        project = self.projects[task['project']]
+        if project.task_filter_ready and task['taskid'] not in project.task_filter:
+            # never seen, skip taskdb lookup
+            return self.on_new_request(task)
+
         oldtask = self.taskdb.get_task(task['project'], task['taskid'],
                                        fields=self.merge_task_fields)
         if oldtask:
@@ -905,6 +1261,10 @@ class Scheduler(object):
         self.insert_task(task)
         self.put_task(task)
 
+        task_filter = self.projects[task['project']].task_filter
+        if task_filter is not None:
+            task_filter.add(task['taskid'])
+
         project = task['project']
         self._cnt['5m'].event((project, 'pending'), +1)
         self._cnt['1h'].event((project, 'pending'), +1)
@@ -974,6 +1334,14 @@ class Scheduler(object):
             logger.error("Bad status pack: %s", e)
             return None
 
+        backoff = task['track'].get('fetch', {}).get('backoff')
+        task_queue = self.projects[task['project']].task_queue
+        if backoff and hasattr(task_queue, 'backoff'):
+            # fetcher is throttled by host of task
+            task_queue.backoff(task.get('url'), backoff)
+
+        if task['track'].get('fetch', {}).get('deferred'):
+            return self.on_task_deferred(task)
         if procesok:
             ret = self.on_task_done(task)
         else:
@@ -1011,6 +1379,26 @@ class Scheduler(object):
         logger.info('task done %(project)s:%(taskid)s %(url)s', task)
         return task
 
+    def on_task_deferred(self, task):
+        '''
+        Called when a task is sent back by fetcher without fetched, as its host is
+        throttled, called by `on_task_status`
+
+        the task is put back after backoff, not counted as a retry
+        '''
+        if 'schedule' not in task:
+            old_task = self.taskdb.get_task(task['project'], task['taskid'], fields=['schedule'])
+            if old_task is None:
+                logging.error('unknown status pack: %s' % task)
+                return
+            task['schedule'] = old_task.get('schedule', {})
+
+        backoff = task['track']['fetch'].get('backoff') or 0
+        task['schedule']['exetime'] = time.time() + backoff
+        self.put_task(task)
+        logger.info('task deferred %.1fs %%(project)s:%%(taskid)s %%(url)s' % backoff, task)
+        return task
+
     def on_task_failed(self, task):
         '''Called when a task is failed, called by `on_task_status`'''
 
@@ -1035,6 +1423,10 @@ class Scheduler(object):
                 next_exetime = -1
             elif 'age' in task['schedule'] and next_exetime > task['schedule'].get('age'):
                 next_exetime = task['schedule'].get('age')
+        if next_exetime >= 0:
+            # not before host is available again, e.g. Retry-After
+            backoff = task.get('track', {}).get('fetch', {}).get('backoff') or 0
+            next_exetime = max(next_exetime, backoff)
 
         if next_exetime < 0:
             task['status'] = self.taskdb.FAILED
@@ -1064,8 +1456,8 @@ class Scheduler(object):
                 retried, retries), task)
             return task
 
-    def on_select_task(self, task):
-        '''Called when a task is selected to fetch & process'''
+    def on_select_task(self, task, send=True):
+        '''Called when a task is selected to fetch & process, send=False leaves sending to caller'''
         # inject informations about project
         logger.info('select %(project)s:%(taskid)s %(url)s', task)
 
@@ -1081,7 +1473,8 @@ class Scheduler(object):
             task = BaseHandler.task_join_crawl_config(task, project_info.crawl_config)
 
         project_info.active_tasks.appendleft((time.time(), task))
-        self.send_task(task)
+        if send:
+            self.send_task(task)
         return task
 
 
@@ -1236,6 +1629,10 @@ class OneScheduler(Scheduler):
                 self.result_worker.on_result(_task, _result)
         self.running_task -= 1
 
+    def send_tasks(self, tasks):
+        for task in tasks:
+            self.send_task(task)
+
     def send_task(self, task, force=True):
         if self.fetcher.http_client.free_size() <= 0:
             if force:
@@ -1274,6 +1671,7 @@ class OneScheduler(Scheduler):
     def quit(self):
         self.ioloop.stop()
         logger.info("scheduler exiting...")
+        self._flush_taskdb()
 
 
 import random
@@ -1287,7 +1685,7 @@ class ThreadBaseScheduler(Scheduler):
 
         super(ThreadBaseScheduler, self).__init__(*args, **kwargs)
 
-        if isinstance(self.taskdb, SQLiteMixin):
+        if isinstance(getattr(self.taskdb, 'taskdb', self.taskdb), SQLiteMixin):
             self.threads = 1
         else:
             self.threads = threads
@@ -1393,6 +1791,13 @@ class ThreadBaseScheduler(Scheduler):
         i = hash(taskid)
         self._run_in_thread(Scheduler._load_put_task, self, project, taskid, _i=i)
 
+    def _load_put_tasks(self, project, taskids):
+        # split the batch across worker threads, each thread loads its part in one query
+        size = max(1, -(-len(taskids) // self.threads))
+        for i in range(0, len(taskids), size):
+            self._run_in_thread(Scheduler._load_put_tasks, self, project, taskids[i:i + size],
+                                _i=i // size)
+
     def run_once(self):
         super(ThreadBaseScheduler, self).run_once()
         self._wait_thread()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import bisect
+import hashlib
+import json
+import logging
+import time
+
+import queue as Queue
+
+logger = logging.getLogger('scheduler')
+
+
+class ShardRing(object):
+    '''
+    consistent hash ring of scheduler shards
+
+    A project is owned by one shard. Tasks of projects in `split_projects` are
+    spread over all shards by taskid, project level tasks of them (on_start,
+    on_finished, _on_get_info, _on_cronjob) belong to the shard owning the
+    project name, called the primary shard of project.
+    '''
+
+    project_taskids = ('on_start', 'on_finished', '_on_get_info', '_on_cronjob')
+
+    def __init__(self, shards, split_projects=(), replicas=64):
+        self.shards = shards
+        self.split_projects = set(split_projects or ())
+        self.ring = []
+        for shard in range(shards):
+            for i in range(replicas):
+                self.ring.append((self._hash('%d-%d' % (shard, i)), shard))
+        self.ring.sort()
+        self.keys = [x[0] for x in self.ring]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf8')).hexdigest()[:16], 16)
+
+    def _lookup(self, key):
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.keys)
+        return self.ring[index][1]
+
+    def shard_of(self, project, taskid=None):
+        '''the shard owning task of project'''
+        if taskid and project in self.split_projects and taskid not in self.project_taskids:
+            return self._lookup('%s:%s' % (project, taskid))
+        return self._lookup(project)
+
+    def shards_of_project(self, project):
+        '''shards having tasks of project'''
+        if project in self.split_projects:
+            return list(range(self.shards))
+        return [self._lookup(project)]
+
+
+def merge_counter(results, avg=False):
+    '''merge dump_counter results of shards, sum values of same key, or average'''
+    merged = dict()
+    counts = dict()
+    for result in results:
+        for key, value in (result or {}).items():
+            if isinstance(value, dict):
+                merged.setdefault(key, []).append(value)
+            elif isinstance(value, (int, float)) and key in merged:
+                merged[key] += value
+                counts[key] += 1
+            else:
+                merged[key] = value
+                counts[key] = 1
+    for key, value in merged.items():
+        if isinstance(value, list):
+            merged[key] = merge_counter(value, avg)
+        elif avg and counts.get(key, 1) > 1:
+            merged[key] = value / counts[key]
+    return merged
+
+
+class ShardRouter(object):
+    '''
+    front of sharded schedulers
+
+    routes messages from newtask_queue and status_queue to the queues of the
+    owning shards, and serves the scheduler xmlrpc interface by merging results
+    of shards, which listen on their own xmlrpc ports.
+    '''
+    LOOP_LIMIT = 1000
+    LOOP_INTERVAL = 0.1
+
+    def __init__(self, ring, newtask_queue, status_queue, out_queue,
+                 shard_newtask_queues, shard_status_queues, shard_rpc_urls):
+        self.ring = ring
+        self.newtask_queue = newtask_queue
+        self.status_queue = status_queue
+        self.out_queue = out_queue
+        self.shard_newtask_queues = shard_newtask_queues
+        self.shard_status_queues = shard_status_queues
+        self.shard_rpc_urls = shard_rpc_urls
+        self._quit = False
+
+    def route_newtask(self, task):
+        '''put new task, or list of new tasks, to the queues of owning shards'''
+        tasks = task if isinstance(task, list) else [task]
+        shard_tasks = dict()
+        for each in tasks:
+            if not isinstance(each, dict) or 'project' not in each:
+                logger.error('invalid newtask: %r', each)
+                continue
+            shard = self.ring.shard_of(each['project'], each.get('taskid'))
+            shard_tasks.setdefault(shard, []).append(each)
+        for shard, tasks in shard_tasks.items():
+            self.shard_newtask_queues[shard].put(tasks if len(tasks) > 1 else tasks[0])
+
+    def route_status(self, task):
+        '''put status of task to the queue of owning shard'''
+        if not isinstance(task, dict) or 'project' not in task:
+            logger.error('invalid status pack: %r', task)
+            return
+        if task.get('taskid') == '_on_get_info':
+            # every shard of project needs the project info
+            shards = self.ring.shards_of_project(task['project'])
+        else:
+            shards = [self.ring.shard_of(task['project'], task.get('taskid'))]
+        for shard in shards:
+            self.shard_status_queues[shard].put(task)
+
+    def _route(self, queue, route):
+        cnt = 0
+        while cnt < self.LOOP_LIMIT:
+            try:
+                task = queue.get_nowait()
+            except Queue.Empty:
+                break
+            route(task)
+            cnt += 1
+        return cnt
+
+    def run_once(self):
+        return self._route(self.status_queue, self.route_status) + \
+            self._route(self.newtask_queue, self.route_newtask)
+
+    def run(self):
+        logger.info("scheduler shard router starting...")
+        while not self._quit:
+            try:
+                if not self.run_once():
+                    time.sleep(self.LOOP_INTERVAL)
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                logger.exception(e)
+        logger.info("scheduler shard router exiting...")
+
+    def _call_shards(self, method, *args, shards=None):
+        '''call xmlrpc method of shards (default all), None for shards not available'''
+        import xmlrpc.client as xmlrpc_client
+        if shards is None:
+            shards = range(len(self.shard_rpc_urls))
+        results = []
+        for url in [self.shard_rpc_urls[x] for x in shards]:
+            try:
+                rpc = xmlrpc_client.ServerProxy(url, allow_none=True, use_builtin_types=True)
+                results.append(getattr(rpc, method)(*args))
+            except Exception as e:
+                logger.error('call %s of scheduler shard %s failed: %r', method, url, e)
+                results.append(None)
+        return results
+
+    def quit(self):
+        self._quit = True
+        self._call_shards('_quit')
+        if hasattr(self, 'xmlrpc_server'):
+            self.xmlrpc_ioloop.add_callback(self.xmlrpc_server.stop)
+            self.xmlrpc_ioloop.add_callback(self.xmlrpc_ioloop.stop)
+
+    def size(self):
+        return sum(x or 0 for x in self._call_shards('size'))
+
+    def counter(self, _time, _type):
+        return merge_counter(self._call_shards('counter', _time, _type), avg=_type == 'avg')
+
+    def newtask(self, task):
+        if hasattr(task, 'data') and isinstance(task.data, bytes):
+            import umsgpack
+            task = umsgpack.unpackb(task.data)
+        if not isinstance(task, dict) or not task.get('project') or not task.get('taskid'):
+            return False
+        self.route_newtask(task)
+        return True
+
+    def send_task(self, task):
+        if hasattr(task, 'data') and isinstance(task.data, bytes):
+            import umsgpack
+            task = umsgpack.unpackb(task.data)
+        self.out_queue.put(task)
+        return True
+
+    def update_project(self):
+        return all(self._call_shards('update_project'))
+
+    def get_active_tasks(self, project=None, limit=100):
+        shards = self.ring.shards_of_project(project) if project else None
+        results = self._call_shards('get_active_tasks', project, limit, shards=shards)
+        tasks = [x for result in results for x in (result or [])]
+        tasks.sort(key=lambda x: x[0], reverse=True)
+        return json.loads(json.dumps(tasks[:limit]))
+
+    def get_queue_stats(self):
+        result = {}
+        for name, queue in (('newtask_queue', self.newtask_queue),
+                            ('status_queue', self.status_queue),
+                            ('out_queue', self.out_queue)):
+            result[name] = queue.qsize() if hasattr(queue, 'qsize') else -1
+        result['shards'] = self._call_shards('get_queue_stats')
+        for key in ('task_loading', 'hosts'):
+            result[key] = dict()
+            for stats in result['shards']:
+                result[key].update((stats or {}).get(key, {}))
+        return result
+
+    def get_projects_pause_status(self):
+        result = dict()
+        for status in self._call_shards('get_projects_pause_status'):
+            for project, paused in (status or {}).items():
+                result[project] = result.get(project, False) or paused
+        return result
+
+    def webui_update(self):
+        results = [x or {} for x in self._call_shards('webui_update')]
+        pause_status = dict()
+        for result in results:
+            for project, paused in result.get('pause_status', {}).items():
+                pause_status[project] = pause_status.get(project, False) or paused
+        counter = dict()
+        for key in ('5m_time', '5m', '1h', '1d', 'all'):
+            counter[key] = merge_counter([x.get('counter', {}).get(key) for x in results],
+                                         avg=key == '5m_time')
+        return {
+            'pause_status': pause_status,
+            'counter': counter,
+        }
+
+    def xmlrpc_run(self, port=23333, bind='127.0.0.1', log_requests=False):
+        '''Start xmlrpc interface of all shards'''
+        from pyspider.libs.wsgi_xmlrpc import WSGIXMLRPCApplication
+
+        application = WSGIXMLRPCApplication()
+        application.register_function(self.quit, '_quit')
+        for name in ('size', 'counter', 'newtask', 'send_task', 'update_project',
+                     'get_active_tasks', 'get_queue_stats', 'get_projects_pause_status',
+                     'webui_update'):
+            application.register_function(getattr(self, name), name)
+
+        import tornado.wsgi
+        import tornado.ioloop
+        import tornado.httpserver
+
+        self.xmlrpc_ioloop = tornado.ioloop.IOLoop()
+        container = tornado.wsgi.WSGIContainer(application)
+        self.xmlrpc_server = tornado.httpserver.HTTPServer(container)
+        self.xmlrpc_server.listen(port=port, address=bind)
+
+        logger.info('scheduler.xmlrpc listening on %s:%s', bind, port)
+        self.xmlrpc_ioloop.start()
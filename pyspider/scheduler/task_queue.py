@@ -7,8 +7,11 @@
 
 import heapq
 import logging
+import sys
 import threading
 import time
+from collections import deque
+from urllib.parse import urlsplit
 
 try:
     from UserDict import DictMixin
@@ -17,6 +20,7 @@ except ImportError:
         from collections import Mapping as DictMixin
     except ImportError:
         from collections.abc import Mapping as DictMixin
+from .timing_wheel import TimingWheel
 from .token_bucket import Bucket
 import queue as Queue
 
@@ -40,6 +44,12 @@ class AtomInt(object):
         cls.__mutex__.release()
         return value
 
+    @classmethod
+    def update(cls, value):
+        '''make sure next value is greater than value'''
+        with cls.__mutex__:
+            cls.__value__ = max(cls.__value__, value)
+
 
 class InQueueTask(DictMixin):
     __slots__ = ('taskid', 'priority', 'exetime', 'sequence')
@@ -74,48 +84,126 @@ class PriorityTaskQueue(Queue.Queue):
     TaskQueue
 
     Same taskid items will been merged
+
+    The heap is indexed: the position of every task in `queue` is tracked in
+    `queue_index`, so merging a better priority / earlier exetime (decrease-key)
+    and deleting a task only sift the affected entry, O(log n), instead of
+    re-heapifying the whole queue or leaving dead entries behind.
     '''
 
     def _init(self, maxsize):
         self.queue = []
         self.queue_dict = dict()
+        self.queue_index = dict()
 
     def _qsize(self, len=len):
         return len(self.queue_dict)
 
-    def _put(self, item, heappush=heapq.heappush):
+    def _put(self, item):
         if item.taskid in self.queue_dict:
             task = self.queue_dict[item.taskid]
-            changed = False
-            if item < task:
-                changed = True
-            task.priority = max(item.priority, task.priority)
-            task.exetime = min(item.exetime, task.exetime)
-            if changed:
-                self._resort()
+            priority = max(item.priority, task.priority)
+            exetime = min(item.exetime, task.exetime)
+            if priority != task.priority or exetime != task.exetime:
+                task.priority = priority
+                task.exetime = exetime
+                self._fix(self.queue_index[task.taskid])
         else:
-            heappush(self.queue, item)
+            self.queue.append(item)
             self.queue_dict[item.taskid] = item
+            self.queue_index[item.taskid] = len(self.queue) - 1
+            self._sift_up(len(self.queue) - 1)
 
-    def _get(self, heappop=heapq.heappop):
-        while self.queue:
-            item = heappop(self.queue)
-            if item.taskid is None:
-                continue
-            self.queue_dict.pop(item.taskid, None)
-            return item
-        return None
+    def _get(self):
+        if not self.queue:
+            return None
+        item = self._remove(0)
+        self.queue_dict.pop(item.taskid, None)
+        return item
 
     @property
     def top(self):
-        while self.queue and self.queue[0].taskid is None:
-            heapq.heappop(self.queue)
         if self.queue:
             return self.queue[0]
         return None
 
     def _resort(self):
         heapq.heapify(self.queue)
+        self.queue_index = dict((item.taskid, i) for i, item in enumerate(self.queue))
+
+    def bulk_put(self, tasks):
+        '''put new tasks and heapify once'''
+        with self.mutex:
+            for task in tasks:
+                if task.taskid in self.queue_dict:
+                    continue
+                self.queue.append(task)
+                self.queue_dict[task.taskid] = task
+            self._resort()
+
+    def pop_expired(self, now=None):
+        '''remove and return tasks with exetime before now'''
+        if now is None:
+            now = time.time()
+        tasks = []
+        with self.mutex:
+            while self.queue and self.queue[0].exetime < now:
+                task = self._remove(0)
+                self.queue_dict.pop(task.taskid, None)
+                tasks.append(task)
+        return tasks
+
+    def _remove(self, pos):
+        '''remove and return the item at heap position pos'''
+        queue = self.queue
+        item = queue[pos]
+        last = queue.pop()
+        del self.queue_index[item.taskid]
+        if pos < len(queue):
+            queue[pos] = last
+            self.queue_index[last.taskid] = pos
+            self._fix(pos)
+        return item
+
+    def _fix(self, pos):
+        '''restore heap invariant after the item at pos changed'''
+        if pos > 0 and self.queue[pos] < self.queue[(pos - 1) >> 1]:
+            self._sift_up(pos)
+        else:
+            self._sift_down(pos)
+
+    def _sift_up(self, pos):
+        queue, index = self.queue, self.queue_index
+        item = queue[pos]
+        while pos > 0:
+            parentpos = (pos - 1) >> 1
+            parent = queue[parentpos]
+            if not item < parent:
+                break
+            queue[pos] = parent
+            index[parent.taskid] = pos
+            pos = parentpos
+        queue[pos] = item
+        index[item.taskid] = pos
+
+    def _sift_down(self, pos):
+        queue, index = self.queue, self.queue_index
+        endpos = len(queue)
+        item = queue[pos]
+        childpos = 2 * pos + 1
+        while childpos < endpos:
+            rightpos = childpos + 1
+            if rightpos < endpos and queue[rightpos] < queue[childpos]:
+                childpos = rightpos
+            child = queue[childpos]
+            if not child < item:
+                break
+            queue[pos] = child
+            index[child.taskid] = pos
+            pos = childpos
+            childpos = 2 * pos + 1
+        queue[pos] = item
+        index[item.taskid] = pos
 
     def __contains__(self, taskid):
         return taskid in self.queue_dict
@@ -128,7 +216,250 @@ class PriorityTaskQueue(Queue.Queue):
         self.put(item)
 
     def __delitem__(self, taskid):
-        self.queue_dict.pop(taskid).taskid = None
+        self.queue_dict.pop(taskid)
+        self._remove(self.queue_index[taskid])
+
+
+def host_of(url, key='host'):
+    '''
+    host of url that politeness limits apply to
+
+    key='domain' groups subdomains by registered domain, guessed from the last
+    labels of hostname (example.com, example.co.uk).
+    '''
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    if key == 'domain' and not host.replace('.', '').isdigit():
+        labels = host.split('.')
+        n = 3 if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3 else 2
+        host = '.'.join(labels[-n:])
+    return sys.intern(host)
+
+
+class HostPriorityQueue(object):
+    '''
+    priority queue of pending tasks split by host, a drop-in for the
+    PriorityTaskQueue of pending tasks in TaskQueue
+
+    get_nowait takes the task of highest priority from hosts in round-robin, a
+    host is skipped when its token bucket (rate / burst per host) is empty or it
+    has `concurrency` tasks in processing. Tasks of unknown host ('') are not
+    limited. Blocked hosts are parked until their bucket refills or a task of
+    them is released, so get_nowait does not scan idle hosts.
+    '''
+
+    def __init__(self, rate=0, burst=0, concurrency=0, key='host'):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.key = key
+        self.mutex = threading.RLock()
+        self.queues = dict()        # host -> PriorityTaskQueue
+        self.buckets = dict()       # host -> Bucket
+        self.inflight = dict()      # host -> tasks in processing
+        self.task_host = dict()     # taskid -> host, of pending and processing tasks
+        self.queue_dict = dict()    # taskid -> pending task
+        self.ready = deque()        # hosts may be ready, in round-robin order
+        self.ready_set = set()
+        self.sleeping = []          # heap of (wakeup time, host) waiting for bucket
+        self.backoff_until = dict()  # host -> time, of hosts held by backoff
+        self.sleeping_set = set()
+
+    def set_limit(self, rate=0, burst=0, concurrency=0, key='host'):
+        with self.mutex:
+            self.rate = rate
+            self.burst = burst
+            self.concurrency = concurrency
+            self.key = key
+            for bucket in self.buckets.values():
+                bucket.rate = float(rate)
+                bucket.burst = float(burst or max(rate, 1))
+            for host in list(self.queues):
+                self._wake(host)
+
+    def set_host(self, taskid, url):
+        '''remember host of a new task, tasks without url are not limited'''
+        if taskid not in self.task_host:
+            self.task_host[taskid] = host_of(url, self.key) if url else ''
+
+    @property
+    def queue(self):
+        return list(self.queue_dict.values())
+
+    def qsize(self):
+        return len(self.queue_dict)
+
+    __len__ = qsize
+
+    def _limited(self, host):
+        return host and (self.rate or self.concurrency)
+
+    def _wake(self, host):
+        '''put host into ready list unless it is blocked'''
+        if host in self.ready_set or host in self.sleeping_set or host not in self.queues:
+            return
+        if self._limited(host) and self.concurrency \
+                and self.inflight.get(host, 0) >= self.concurrency:
+            return
+        self.ready.append(host)
+        self.ready_set.add(host)
+
+    def put(self, task):
+        with self.mutex:
+            host = self.task_host.setdefault(task.taskid, '')
+            if host not in self.queues:
+                self.queues[host] = PriorityTaskQueue()
+            self.queues[host].put(task)
+            self.queue_dict[task.taskid] = self.queues[host][task.taskid]
+            self._wake(host)
+
+    def bulk_put(self, tasks):
+        for task in tasks:
+            self.put(task)
+
+    def _bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = Bucket(rate=self.rate, burst=self.burst or max(self.rate, 1))
+        return self.buckets[host]
+
+    def _cleanup(self, host):
+        '''drop state of a host without tasks, after its bucket refilled'''
+        queue = self.queues.get(host)
+        if queue is not None and queue.qsize():
+            return
+        if self.inflight.get(host) or host in self.sleeping_set:
+            return
+        bucket = self.buckets.get(host)
+        if bucket is not None and bucket.get() < bucket.burst:
+            return
+        self.queues.pop(host, None)
+        self.buckets.pop(host, None)
+        self.inflight.pop(host, None)
+
+    def get_nowait(self):
+        now = time.time()
+        with self.mutex:
+            while self.sleeping and self.sleeping[0][0] <= now:
+                _, host = heapq.heappop(self.sleeping)
+                if self.backoff_until.get(host, 0) > now:
+                    # held longer by backoff, which has its own entry
+                    continue
+                self.backoff_until.pop(host, None)
+                self.sleeping_set.discard(host)
+                self._wake(host)
+                self._cleanup(host)
+
+            while self.ready:
+                host = self.ready.popleft()
+                self.ready_set.discard(host)
+                if host in self.sleeping_set:
+                    continue
+                queue = self.queues.get(host)
+                if queue is None or not queue.qsize():
+                    self._cleanup(host)
+                    continue
+                limited = self._limited(host)
+                if limited and self.concurrency and self.inflight.get(host, 0) >= self.concurrency:
+                    # woken up by release
+                    continue
+                if limited and self.rate:
+                    bucket = self._bucket(host)
+                    if bucket.get() < 1:
+                        heapq.heappush(self.sleeping, (now + 1.0 / self.rate, host))
+                        self.sleeping_set.add(host)
+                        continue
+                    bucket.desc()
+
+                task = queue.get_nowait()
+                del self.queue_dict[task.taskid]
+                self.inflight[host] = self.inflight.get(host, 0) + 1
+                self._wake(host)
+                return task
+        raise Queue.Empty
+
+    def release(self, taskid):
+        '''task of taskid is not in processing any more'''
+        with self.mutex:
+            host = self.task_host.get(taskid)
+            if self.inflight.get(host):
+                self.inflight[host] -= 1
+                self._wake(host)
+                self._cleanup(host)
+
+    def backoff(self, host, seconds):
+        '''hold tasks of host for seconds, e.g. when fetcher is throttled by it'''
+        if not host:
+            return
+        with self.mutex:
+            until = time.time() + seconds
+            if until <= self.backoff_until.get(host, 0):
+                return
+            self.backoff_until[host] = until
+            heapq.heappush(self.sleeping, (until, host))
+            self.sleeping_set.add(host)
+
+    def forget(self, taskid):
+        '''task of taskid is removed from task queue'''
+        self.task_host.pop(taskid, None)
+
+    def hosts(self):
+        '''return {host: (pending, processing)}'''
+        with self.mutex:
+            return dict((host, (self.queues[host].qsize() if host in self.queues else 0,
+                                self.inflight.get(host, 0)))
+                        for host in set(self.queues) | set(self.inflight))
+
+    def __contains__(self, taskid):
+        return taskid in self.queue_dict
+
+    def __getitem__(self, taskid):
+        return self.queue_dict[taskid]
+
+    def __delitem__(self, taskid):
+        with self.mutex:
+            self.queue_dict.pop(taskid)
+            del self.queues[self.task_host[taskid]][taskid]
+
+
+class HostBackoff(object):
+    '''
+    hosts held by backoff, when not limited by host
+
+    tasks of a held host put later are delayed until the host is released,
+    tasks queued already are not.
+    '''
+    max_hosts = 10000
+
+    def __init__(self, key='host'):
+        self.key = key
+        self.until = dict()  # host -> time
+
+    def hold(self, url, seconds):
+        host = host_of(url, self.key)
+        if not host:
+            return
+        now = time.time()
+        if now + seconds > self.until.get(host, 0):
+            self.until[host] = now + seconds
+        if len(self.until) > self.max_hosts:
+            for host, until in list(self.until.items()):
+                if until <= now:
+                    del self.until[host]
+
+    def delay(self, url, exetime):
+        '''exetime of a task of url put now'''
+        if not self.until or not url:
+            return exetime
+        host = host_of(url, self.key)
+        until = self.until.get(host)
+        if until is None:
+            return exetime
+        if until <= time.time():
+            del self.until[host]
+            return exetime
+        return max(exetime or 0, until)
 
 
 class TaskQueue(object):
@@ -143,6 +474,38 @@ class TaskQueue(object):
         self.time_queue = PriorityTaskQueue()
         self.processing = PriorityTaskQueue()
         self.bucket = Bucket(rate=rate, burst=burst)
+        # TaskQueueSnapshot logging put / remove, when snapshot is enabled
+        self.journal = None
+        # HostPriorityQueue replacing priority_queue, when limited by host
+        self.hosts = None
+        self.host_backoff = HostBackoff()
+
+    def set_host_limit(self, rate=0, burst=0, concurrency=0, key='host'):
+        '''
+        limit tasks selected per host with a token bucket of rate / burst and max
+        `concurrency` tasks in processing, 0 for no limit
+
+        Only tasks put with url after the first call are limited, it should be
+        called before tasks loaded.
+        '''
+        with self.mutex:
+            if self.hosts is None:
+                self.hosts = HostPriorityQueue()
+                self.hosts.bulk_put(self.priority_queue.queue)
+                self.priority_queue = self.hosts
+            self.hosts.set_limit(rate, burst, concurrency, key)
+
+    def backoff(self, url, seconds):
+        '''
+        hold tasks of host of url for seconds, tasks queued are held only when
+        limited by host, tasks put later are delayed otherwise
+        '''
+        if not url:
+            return
+        if self.hosts is not None:
+            self.hosts.backoff(host_of(url, self.hosts.key), seconds)
+        else:
+            self.host_backoff.hold(url, seconds)
 
     @property
     def rate(self):
@@ -172,8 +535,7 @@ class TaskQueue(object):
     def _check_time_queue(self):
         now = time.time()
         self.mutex.acquire()
-        while self.time_queue.qsize() and self.time_queue.top and self.time_queue.top.exetime < now:
-            task = self.time_queue.get_nowait()  # type: InQueueTask
+        for task in self.time_queue.pop_expired(now):
             task.exetime = 0
             self.priority_queue.put(task)
         self.mutex.release()
@@ -181,16 +543,15 @@ class TaskQueue(object):
     def _check_processing(self):
         now = time.time()
         self.mutex.acquire()
-        while self.processing.qsize() and self.processing.top and self.processing.top.exetime < now:
-            task = self.processing.get_nowait()
-            if task.taskid is None:
-                continue
+        for task in self.processing.pop_expired(now):
             task.exetime = 0
+            if self.hosts is not None:
+                self.hosts.release(task.taskid)
             self.priority_queue.put(task)
             logger.info("processing: retry %s", task.taskid)
         self.mutex.release()
 
-    def put(self, taskid, priority=0, exetime=0):
+    def put(self, taskid, priority=0, exetime=0, url=None):
         """
         Put a task into task queue
 
@@ -204,6 +565,8 @@ class TaskQueue(object):
         Thus, we store a global atom self increasing value into task.sequence which represent
         the task enqueue sequence. When the comparison of exetime and priority have no
         difference, we compare task.sequence to ensure that the entire queue is ordered.
+
+        url is used to find the host of task when limited by host.
         """
         now = time.time()
 
@@ -214,17 +577,24 @@ class TaskQueue(object):
             self.priority_queue.put(task)
         elif taskid in self.time_queue:
             self.time_queue.put(task)
-        elif taskid in self.processing and self.processing[taskid].taskid:
+        elif taskid in self.processing:
             # force update a processing task is not allowed as there are so many
             # problems may happen
-            pass
+            self.mutex.release()
+            return
         else:
+            if self.hosts is not None:
+                self.hosts.set_host(taskid, url)
+            else:
+                exetime = self.host_backoff.delay(url, exetime)
             if exetime and exetime > now:
                 self.time_queue.put(task)
             else:
                 task.exetime = 0
                 self.priority_queue.put(task)
 
+        if self.journal is not None:
+            self.journal.put(taskid, priority, exetime)
         self.mutex.release()
 
     def get(self):
@@ -250,6 +620,11 @@ class TaskQueue(object):
             self.mutex.acquire()
             if taskid in self.processing:
                 del self.processing[taskid]
+                if self.hosts is not None:
+                    self.hosts.release(taskid)
+                    self.hosts.forget(taskid)
+                if self.journal is not None:
+                    self.journal.remove(taskid)
             self.mutex.release()
             return True
         return False
@@ -260,10 +635,18 @@ class TaskQueue(object):
         if taskid in self.priority_queue:
             self.mutex.acquire()
             del self.priority_queue[taskid]
+            if self.hosts is not None:
+                self.hosts.forget(taskid)
+            if self.journal is not None:
+                self.journal.remove(taskid)
             self.mutex.release()
         elif taskid in self.time_queue:
             self.mutex.acquire()
             del self.time_queue[taskid]
+            if self.hosts is not None:
+                self.hosts.forget(taskid)
+            if self.journal is not None:
+                self.journal.remove(taskid)
             self.mutex.release()
         elif taskid in self.processing:
             self.done(taskid)
@@ -272,11 +655,46 @@ class TaskQueue(object):
     def size(self):
         return self.priority_queue.qsize() + self.time_queue.qsize() + self.processing.qsize()
 
+    def iter_tasks(self):
+        '''
+        yield (taskid, priority, exetime, sequence) of all tasks in queue,
+        exetime of processing tasks is 0 as they would be retried
+        '''
+        with self.mutex:
+            for queue in (self.priority_queue, self.time_queue):
+                for task in queue.queue:
+                    yield task.taskid, task.priority, task.exetime, task.sequence
+            for task in self.processing.queue:
+                yield task.taskid, task.priority, 0, task.sequence
+
+    def bulk_load(self, tasks):
+        '''
+        load (taskid, priority, exetime, sequence) tasks into an empty queue,
+        heaps are built once after all tasks loaded
+        '''
+        now = time.time()
+        max_sequence = 0
+        pending, waiting = [], []
+        with self.mutex:
+            for taskid, priority, exetime, sequence in tasks:
+                task = InQueueTask(taskid, priority, exetime)
+                task.sequence = sequence
+                max_sequence = max(max_sequence, sequence)
+                if exetime and exetime > now:
+                    waiting.append(task)
+                else:
+                    task.exetime = 0
+                    pending.append(task)
+            self.priority_queue.bulk_put(pending)
+            self.time_queue.bulk_put(waiting)
+        # keep the FIFO order of loaded tasks before new tasks
+        AtomInt.update(max_sequence)
+
     def is_processing(self, taskid):
         '''
         return True if taskid is in processing
         '''
-        return taskid in self.processing and self.processing[taskid].taskid
+        return taskid in self.processing
 
     def __len__(self):
         return self.size()
@@ -284,9 +702,22 @@ class TaskQueue(object):
     def __contains__(self, taskid):
         if taskid in self.priority_queue or taskid in self.time_queue:
             return True
-        if taskid in self.processing and self.processing[taskid].taskid:
-            return True
-        return False
+        return taskid in self.processing
+
+
+class TimingWheelTaskQueue(TaskQueue):
+    '''
+    TaskQueue with time queue and processing queue in timing wheels, for
+    projects with millions of delayed recrawls and retries
+
+    tasks are moved to priority queue up to `tick` seconds after their exetime.
+    '''
+    tick = 1.0
+
+    def __init__(self, rate=0, burst=0):
+        super(TimingWheelTaskQueue, self).__init__(rate, burst)
+        self.time_queue = TimingWheel(self.tick)
+        self.processing = TimingWheel(self.tick)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import array
+import struct
+import logging
+
+from pyspider.libs import utils
+
+logger = logging.getLogger('scheduler')
+
+
+class TaskQueueSnapshot(object):
+    '''
+    Snapshot of TaskQueue on disk, for restarting scheduler without scanning taskdb
+
+    <path> is a compact snapshot of all tasks in queue, stored as packed arrays:
+
+        magic | header(created, count, blob size)
+        | priority[count] int64 | exetime[count] double | sequence[count] uint64
+        | taskid length[count] uint32 | taskid blob
+
+    <path>.log is a delta log of put / remove appended after the snapshot, it's
+    replayed on load and truncated by next dump. Tasks in processing are saved as
+    pending (exetime=0), as they are when loaded from taskdb.
+
+    A mark with the time is appended to the log when it's flushed, at most every
+    MARK_INTERVAL seconds. `synced` is the time of the last mark or dump loaded,
+    taskdb changed after it is not in the snapshot.
+    '''
+
+    MAGIC = b'PYSQUEUE1'
+    HEADER = struct.Struct('<dQQ')
+    LOG_RECORD = struct.Struct('<BIqd')  # op, taskid length, priority, exetime
+    OP_PUT = 1
+    OP_REMOVE = 2
+    OP_MARK = 3
+    MARK_INTERVAL = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + '.log'
+        self.created = 0
+        self.synced = 0
+        self._log = None
+
+    def put(self, taskid, priority, exetime):
+        '''log a put to task queue'''
+        self._write_log(self.OP_PUT, taskid, priority, exetime)
+
+    def remove(self, taskid):
+        '''log a task removed from task queue'''
+        self._write_log(self.OP_REMOVE, taskid, 0, 0)
+
+    def _write_log(self, op, taskid, priority, exetime):
+        if self._log is None:
+            self._log = open(self.log_path, 'ab')
+        taskid = utils.utf8(taskid)
+        self._log.write(self.LOG_RECORD.pack(op, len(taskid), int(priority or 0),
+                                             float(exetime or 0)) + taskid)
+
+    def flush(self):
+        now = time.time()
+        if now - self.synced >= self.MARK_INTERVAL:
+            self._write_log(self.OP_MARK, '', 0, now)
+            self.synced = now
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def dump(self, task_queue):
+        '''write snapshot of task_queue and truncate delta log'''
+        priorities = array.array('q')
+        exetimes = array.array('d')
+        sequences = array.array('Q')
+        lengths = array.array('I')
+        taskids = []
+        with task_queue.mutex:
+            now = time.time()
+            for taskid, priority, exetime, sequence in task_queue.iter_tasks():
+                taskids.append(utils.utf8(taskid))
+                priorities.append(int(priority or 0))
+                exetimes.append(float(exetime or 0))
+                sequences.append(sequence)
+
+            blob = b''.join(taskids)
+            lengths.extend(len(x) for x in taskids)
+            tmp = '%s.tmp' % self.path
+            try:
+                with open(tmp, 'wb') as fp:
+                    fp.write(self.MAGIC)
+                    fp.write(self.HEADER.pack(now, len(taskids), len(blob)))
+                    for each in (priorities, exetimes, sequences, lengths):
+                        each.tofile(fp)
+                    fp.write(blob)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logger.warning("can't dump task queue snapshot to %s: %s", self.path, e)
+                return False
+
+            self.close()
+            self._log = open(self.log_path, 'wb')
+            self.created = self.synced = now
+        return True
+
+    def load(self, task_queue):
+        '''
+        load snapshot into an empty task_queue and replay delta log,
+        return False when snapshot is missing or broken
+        '''
+        try:
+            with open(self.path, 'rb') as fp:
+                if fp.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError('bad magic')
+                self.created, count, blob_size = self.HEADER.unpack(fp.read(self.HEADER.size))
+                priorities = array.array('q')
+                exetimes = array.array('d')
+                sequences = array.array('Q')
+                lengths = array.array('I')
+                for each in (priorities, exetimes, sequences, lengths):
+                    each.fromfile(fp, count)
+                blob = fp.read(blob_size)
+                if len(blob) != blob_size:
+                    raise ValueError('truncated file')
+        except Exception as e:
+            logger.debug("can't load task queue snapshot from %s: %s", self.path, e)
+            return False
+
+        def tasks():
+            offset = 0
+            for i in range(count):
+                taskid = utils.text(blob[offset:offset + lengths[i]])
+                offset += lengths[i]
+                yield taskid, priorities[i], exetimes[i], sequences[i]
+
+        task_queue.bulk_load(tasks())
+        self.synced = self.created
+        self._replay_log(task_queue)
+        return True
+
+    def _replay_log(self, task_queue):
+        if not os.path.exists(self.log_path):
+            return
+        size = self.LOG_RECORD.size
+        with open(self.log_path, 'rb') as fp:
+            while True:
+                record = fp.read(size)
+                if len(record) < size:
+                    break
+                op, length, priority, exetime = self.LOG_RECORD.unpack(record)
+                taskid = fp.read(length)
+                if len(taskid) < length:
+                    break
+                taskid = utils.text(taskid)
+                if op == self.OP_PUT:
+                    task_queue.put(taskid, priority, exetime)
+                elif op == self.OP_REMOVE:
+                    task_queue.delete(taskid)
+                elif op == self.OP_MARK:
+                    self.synced = exetime
+
+    def remove_files(self):
+        self.close()
+        for path in (self.path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
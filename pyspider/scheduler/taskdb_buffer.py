@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import copy
+import logging
+import threading
+import time
+
+logger = logging.getLogger('scheduler')
+
+
+class WriteBuffer(object):
+    '''
+    pending taskdb writes shared by all copies of a BufferedTaskDB
+
+    writes are coalesced per (project, taskid): an insert followed by updates
+    becomes one insert, updates are merged field by field.
+    '''
+
+    def __init__(self, size=1000, interval=1.0):
+        self.size = size
+        self.interval = interval
+        self.mutex = threading.RLock()
+        self.flush_mutex = threading.Lock()
+        self.pending = dict()   # (project, taskid) -> [is_insert, obj]
+        self.flushing = dict()  # the batch being written, still visible to readers
+        self.last_flush = time.time()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, project, taskid, obj, insert=False):
+        obj = copy.deepcopy(obj)
+        with self.mutex:
+            key = (project, taskid)
+            if key in self.pending:
+                entry = self.pending[key]
+                entry[0] = entry[0] or insert
+                entry[1].update(obj)
+            else:
+                self.pending[key] = [insert, obj]
+
+    def get(self, project, taskid):
+        '''return (is_insert, obj) of the pending write of taskid, or None'''
+        with self.mutex:
+            key = (project, taskid)
+            entry = self.pending.get(key)
+            flushing = self.flushing.get(key)
+            if entry is None and flushing is None:
+                return None
+            if entry is None:
+                return flushing[0], copy.deepcopy(flushing[1])
+            if flushing is None:
+                return entry[0], copy.deepcopy(entry[1])
+            obj = copy.deepcopy(flushing[1])
+            obj.update(copy.deepcopy(entry[1]))
+            return entry[0] or flushing[0], obj
+
+    def pending_inserts(self, project):
+        with self.mutex:
+            keys = set(k for k, v in self.pending.items() if v[0] and k[0] == project)
+            keys.update(k for k, v in self.flushing.items() if v[0] and k[0] == project)
+        return [k[1] for k in keys]
+
+    def discard(self, project):
+        with self.mutex:
+            for key in [k for k in self.pending if k[0] == project]:
+                del self.pending[key]
+
+    def need_flush(self):
+        if len(self.pending) >= self.size:
+            return True
+        return bool(self.pending) and time.time() - self.last_flush >= self.interval
+
+    def flush(self, taskdb):
+        '''write pending tasks to taskdb, grouped by project and batched'''
+        with self.flush_mutex:
+            with self.mutex:
+                self.flushing, self.pending = self.pending, dict()
+                self.last_flush = time.time()
+                batch = self.flushing
+            if not batch:
+                return 0
+
+            projects = dict()
+            for (project, taskid), (insert, obj) in batch.items():
+                inserts, updates = projects.setdefault(project, ([], []))
+                (inserts if insert else updates).append((taskid, obj))
+
+            for project, (inserts, updates) in projects.items():
+                if inserts:
+                    self._write(taskdb.insert_many, taskdb.insert, project, inserts)
+                if updates:
+                    self._write(taskdb.update_many, taskdb.update, project, updates)
+
+            with self.mutex:
+                self.flushing = dict()
+            return len(batch)
+
+    @staticmethod
+    def _write(write_many, write_one, project, tasks):
+        try:
+            write_many(project, tasks)
+            return
+        except Exception as e:
+            logger.error('batch write of %d tasks in %s failed: %r, retry one by one',
+                         len(tasks), project, e)
+        for taskid, obj in tasks:
+            try:
+                write_one(project, taskid, obj)
+            except Exception as e:
+                logger.exception('write task %s:%s failed: %r', project, taskid, e)
+
+
+class BufferedTaskDB(object):
+    '''
+    write-behind wrapper of taskdb for scheduler
+
+    insert and update are buffered and flushed in batches with insert_many /
+    update_many when the buffer is full or `interval` seconds passed since last
+    flush (checked by `flush(force=False)` from scheduler loop). get_task and
+    get_tasks see pending writes, everything else is passed to the wrapped taskdb.
+    '''
+
+    def __init__(self, taskdb, size=1000, interval=1.0, buffer=None):
+        self.taskdb = taskdb
+        self.buffer = buffer or WriteBuffer(size, interval)
+
+    def __getattr__(self, name):
+        return getattr(self.taskdb, name)
+
+    def copy(self):
+        return BufferedTaskDB(self.taskdb.copy(), buffer=self.buffer)
+
+    def flush(self, force=True):
+        if force or self.buffer.need_flush():
+            return self.buffer.flush(self.taskdb)
+        return 0
+
+    def insert(self, project, taskid, obj={}):
+        obj = dict(obj)
+        obj['taskid'] = taskid
+        obj['project'] = project
+        self.buffer.add(project, taskid, obj, insert=True)
+        if len(self.buffer) >= self.buffer.size:
+            self.flush()
+
+    def update(self, project, taskid, obj={}, **kwargs):
+        obj = dict(obj)
+        obj.update(kwargs)
+        self.buffer.add(project, taskid, obj)
+        if len(self.buffer) >= self.buffer.size:
+            self.flush()
+
+    @staticmethod
+    def _merge(task, pending, fields=None):
+        insert, obj = pending
+        if task is None:
+            if not insert:
+                # update of a task not in database, it's a noop when flushed
+                return None
+            task = dict()
+        for key, value in obj.items():
+            if fields and key not in fields:
+                continue
+            task[key] = value
+        return task
+
+    def get_task(self, project, taskid, fields=None):
+        pending = self.buffer.get(project, taskid)
+        if pending and pending[0]:
+            return self._merge(None, pending, fields)
+        task = self.taskdb.get_task(project, taskid, fields=fields)
+        if pending:
+            return self._merge(task, pending, fields)
+        return task
+
+    def get_tasks(self, project, taskids, fields=None):
+        inserts = set(self.buffer.pending_inserts(project))
+        todo = []
+        for taskid in taskids:
+            pending = self.buffer.get(project, taskid) if taskid in inserts else None
+            if pending:
+                yield self._merge(None, pending, fields)
+            else:
+                todo.append(taskid)
+        for task in self.taskdb.get_tasks(project, todo, fields=fields):
+            pending = self.buffer.get(project, task.get('taskid'))
+            if pending:
+                task = self._merge(task, pending, fields)
+            yield task
+
+    def load_tasks(self, status, project=None, fields=None):
+        self.flush()
+        return self.taskdb.load_tasks(status, project, fields)
+
+    def load_tasks_page(self, status, project, fields=None, cursor=None, limit=1000):
+        self.flush()
+        return self.taskdb.load_tasks_page(status, project, fields, cursor, limit)
+
+    def status_count(self, project):
+        self.flush()
+        return self.taskdb.status_count(project)
+
+    def last_updatetime(self, project):
+        self.flush()
+        return self.taskdb.last_updatetime(project)
+
+    def drop(self, project):
+        self.buffer.discard(project)
+        return self.taskdb.drop(project)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import time
+
+
+class TimingWheel(object):
+    '''
+    Hierarchical timing wheel of InQueueTask, ordered by exetime
+
+    A drop-in for the PriorityTaskQueue used as time queue or processing queue
+    of TaskQueue: put and delete are O(1), expiry is amortized O(1) per task.
+
+    Time is cut into ticks of `tick` seconds. Level 0 has `slots` buckets of one
+    tick, level n has `slots` buckets of slots ** n ticks, tasks further away
+    than the last level are kept in an overflow bucket. When the wheel turns
+    past the start of a bucket of a higher level, its tasks are cascaded down
+    to lower levels. A task expires at most one tick after its exetime, never
+    before it.
+
+    Same taskid items will been merged, like PriorityTaskQueue.
+    '''
+
+    def __init__(self, tick=1.0, slots=64, levels=4, now=None):
+        self.tick = float(tick)
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[dict() for _ in range(slots)] for _ in range(levels)]
+        self.overflow = dict()
+        self.expired = dict()
+        self.queue_dict = dict()
+        self.location = dict()  # taskid -> bucket
+        # next tick to be processed
+        self.current = int((time.time() if now is None else now) // self.tick)
+
+    @property
+    def queue(self):
+        return list(self.queue_dict.values())
+
+    def qsize(self):
+        return len(self.queue_dict)
+
+    __len__ = qsize
+
+    def _bucket(self, task):
+        tick = int(task.exetime // self.tick)
+        delta = tick - self.current
+        if delta < 0:
+            return self.expired
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                return self.wheels[level][(tick // span) % self.slots]
+            span *= self.slots
+        return self.overflow
+
+    def _insert(self, task):
+        bucket = self._bucket(task)
+        bucket[task.taskid] = task
+        self.location[task.taskid] = bucket
+
+    def put(self, task):
+        if task.taskid in self.queue_dict:
+            old = self.queue_dict[task.taskid]
+            old.priority = max(task.priority, old.priority)
+            if task.exetime < old.exetime:
+                old.exetime = task.exetime
+                del self.location[old.taskid][old.taskid]
+                self._insert(old)
+        else:
+            self.queue_dict[task.taskid] = task
+            self._insert(task)
+
+    def bulk_put(self, tasks):
+        for task in tasks:
+            self.put(task)
+
+    def _cascade(self, bucket):
+        tasks = list(bucket.values())
+        bucket.clear()
+        for task in tasks:
+            self._insert(task)
+
+    def _turn(self):
+        '''process tick `current`'''
+        current = self.current
+        span = self.slots ** self.levels
+        if current % span == 0:
+            self._cascade(self.overflow)
+        for level in reversed(range(1, self.levels)):
+            span //= self.slots
+            if current % span == 0:
+                self._cascade(self.wheels[level][(current // span) % self.slots])
+        bucket = self.wheels[0][current % self.slots]
+        for taskid, task in bucket.items():
+            self.expired[taskid] = task
+            self.location[taskid] = self.expired
+        bucket.clear()
+        self.current += 1
+
+    def _rebuild(self, current):
+        for level in self.wheels:
+            for bucket in level:
+                bucket.clear()
+        self.overflow.clear()
+        self.current = current
+        for task in self.queue_dict.values():
+            if self.location[task.taskid] is not self.expired:
+                self._insert(task)
+
+    def pop_expired(self, now=None):
+        '''remove and return tasks whose tick is over'''
+        now_tick = int((time.time() if now is None else now) // self.tick)
+        if len(self.expired) == len(self.queue_dict):
+            # nothing in the wheel, jump ahead
+            self.current = max(self.current, now_tick)
+        elif now_tick - self.current > max(self.slots, len(self.queue_dict)):
+            # turning tick by tick costs more than re-inserting every task
+            self._rebuild(now_tick)
+        while self.current < now_tick:
+            self._turn()
+        if not self.expired:
+            return []
+        tasks = list(self.expired.values())
+        self.expired.clear()
+        for task in tasks:
+            del self.queue_dict[task.taskid]
+            del self.location[task.taskid]
+        return tasks
+
+    def __contains__(self, taskid):
+        return taskid in self.queue_dict
+
+    def __getitem__(self, taskid):
+        return self.queue_dict[taskid]
+
+    def __delitem__(self, taskid):
+        self.queue_dict.pop(taskid)
+        del self.location.pop(taskid)[taskid]
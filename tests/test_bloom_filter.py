@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import shutil
+import unittest
+
+from pyspider.libs.bloom_filter import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+    data_path = './data/tests/bloom'
+
+    @classmethod
+    def setUpClass(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        os.makedirs(self.data_path)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+
+    def test_10_add(self):
+        bf = BloomFilter(100, 0.001)
+        self.assertNotIn('a', bf)
+        self.assertTrue(bf.add('a'))
+        self.assertFalse(bf.add('a'))
+        self.assertIn('a', bf)
+        self.assertTrue(bf.add(u'中文'))
+        self.assertIn(u'中文', bf)
+        self.assertEqual(len(bf), 3)
+        self.assertTrue(bf.changed)
+
+    def test_20_false_positive_rate(self):
+        bf = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bf.add('taskid%d' % i)
+        for i in range(10000):
+            self.assertIn('taskid%d' % i, bf)
+        false_positive = sum(1 for i in range(10000) if 'other%d' % i in bf)
+        self.assertLess(false_positive, 10000 * 0.01 * 2)
+
+    def test_30_max_bytes(self):
+        bf = BloomFilter(10000, 0.001, max_bytes=1024)
+        self.assertEqual(bf.num_bits, 1024 * 8)
+        self.assertLess(bf.capacity, 10000)
+        for i in range(10000):
+            bf.add('taskid%d' % i)
+        # error rate grows, but no false negative
+        for i in range(10000):
+            self.assertIn('taskid%d' % i, bf)
+
+    def test_40_dump_and_load(self):
+        path = os.path.join(self.data_path, 'test.bloom')
+        bf = BloomFilter(1000, 0.001)
+        for i in range(100):
+            bf.add('taskid%d' % i)
+        self.assertTrue(bf.dump(path))
+        self.assertFalse(bf.changed)
+
+        bf2 = BloomFilter.load(path)
+        self.assertEqual(bf2.count, 100)
+        self.assertEqual(bf2.num_bits, bf.num_bits)
+        self.assertEqual(bf2.num_hashes, bf.num_hashes)
+        self.assertEqual(bf2.error_rate, 0.001)
+        for i in range(100):
+            self.assertIn('taskid%d' % i, bf2)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_50_load_broken(self):
+        self.assertIsNone(BloomFilter.load(os.path.join(self.data_path, 'missing.bloom')))
+
+        path = os.path.join(self.data_path, 'broken.bloom')
+        BloomFilter(1000, 0.001).dump(path)
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(data[:-10])
+        self.assertIsNone(BloomFilter.load(path))
+
+        with open(path, 'wb') as fp:
+            fp.write(b'not a bloom filter')
+        self.assertIsNone(BloomFilter.load(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -134,6 +134,81 @@ class TaskDBCase(object):
         self.assertEqual(tasks[0]['taskid'], 'taskid')
         self.assertNotIn('project', tasks[0])
 
+    def test_55_get_tasks(self):
+        tasks = []
+        for i in range(5):
+            task = dict(self.sample_task, taskid='taskid%d' % i, status=self.taskdb.SUCCESS)
+            tasks.append((task['taskid'], task))
+        self.taskdb.insert_many('get_tasks_project', tasks)
+
+        saved = self.taskdb.GET_TASKS_CHUNK
+        self.taskdb.GET_TASKS_CHUNK = 2
+        try:
+            taskids = ['taskid0', 'missing1', 'taskid1', 'taskid2', 'missing2', 'taskid3', 'taskid4']
+            result = list(self.taskdb.get_tasks('get_tasks_project', taskids,
+                                                fields=['taskid', 'url']))
+            self.assertEqual(sorted(t['taskid'] for t in result),
+                             ['taskid0', 'taskid1', 'taskid2', 'taskid3', 'taskid4'])
+            self.assertEqual(result[0]['url'], self.sample_task['url'])
+            self.assertNotIn('status', result[0])
+
+            result = list(self.taskdb.get_tasks('get_tasks_project', iter(['taskid4', 'missing'])))
+            self.assertEqual(len(result), 1)
+            self.assertEqual(result[0]['taskid'], 'taskid4')
+            self.assertEqual(result[0]['schedule'], self.sample_task['schedule'])
+        finally:
+            self.taskdb.GET_TASKS_CHUNK = saved
+
+        self.assertEqual(list(self.taskdb.get_tasks('get_tasks_project', ['missing'])), [])
+        self.assertEqual(list(self.taskdb.get_tasks('no_such_project', ['taskid0'])), [])
+
+    def test_56_load_tasks_page(self):
+        tasks = []
+        for i in range(7):
+            tasks.append(('taskid%d' % i, dict(self.sample_task, status=self.taskdb.ACTIVE)))
+        tasks.append(('success', dict(self.sample_task, status=self.taskdb.SUCCESS)))
+        self.taskdb.insert_many('page_project', tasks)
+
+        try:
+            page, cursor = self.taskdb.load_tasks_page(self.taskdb.ACTIVE, 'page_project',
+                                                       fields=['url'], limit=3)
+        except NotImplementedError:
+            raise unittest.SkipTest('load_tasks_page not implemented')
+        self.assertEqual(len(page), 3)
+        self.assertIsNotNone(cursor)
+        self.assertIn('taskid', page[0])
+        self.assertEqual(page[0]['url'], self.sample_task['url'])
+        self.assertNotIn('schedule', page[0])
+        taskids = [t['taskid'] for t in page]
+
+        # writes between pages don't make tasks skipped or loaded twice
+        self.taskdb.update('page_project', taskids[0], status=self.taskdb.SUCCESS)
+        self.taskdb.insert('page_project', 'taskid', dict(self.sample_task, status=self.taskdb.ACTIVE))
+        while cursor is not None:
+            page, cursor = self.taskdb.load_tasks_page(self.taskdb.ACTIVE, 'page_project',
+                                                       fields=['taskid'], cursor=cursor, limit=3)
+            self.assertLessEqual(len(page), 3)
+            taskids.extend(t['taskid'] for t in page)
+        self.assertEqual(sorted(taskids), ['taskid%d' % i for i in range(7)])
+
+        page, cursor = self.taskdb.load_tasks_page(self.taskdb.BAD, 'page_project')
+        self.assertEqual((page, cursor), ([], None))
+        page, cursor = self.taskdb.load_tasks_page(self.taskdb.ACTIVE, 'no_such_project')
+        self.assertEqual((page, cursor), ([], None))
+
+    def test_57_last_updatetime(self):
+        try:
+            self.assertIsNone(self.taskdb.last_updatetime('no_such_project'))
+        except NotImplementedError:
+            raise unittest.SkipTest('last_updatetime not implemented')
+        start = time.time()
+        self.taskdb.insert('updatetime_project', 'taskid', self.sample_task)
+        updatetime = self.taskdb.last_updatetime('updatetime_project')
+        self.assertGreaterEqual(updatetime, start)
+        time.sleep(0.01)
+        self.taskdb.update('updatetime_project', 'taskid', status=self.taskdb.SUCCESS)
+        self.assertGreater(self.taskdb.last_updatetime('updatetime_project'), updatetime)
+
     def test_60_relist_projects(self):
         if hasattr(self.taskdb, '_list_project'):
             self.taskdb._list_project()
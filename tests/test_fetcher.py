@@ -398,8 +398,424 @@ class TestFetcher(unittest.TestCase):
 
         self.assertEqual(response.status_code, 403, result)
 
+    def test_a210_max_body_size(self):
+        request = copy.deepcopy(self.sample_task_http)
+        request['url'] = self.httpbin+'/stream-bytes/100000?chunk_size=1000'
+        request['fetch']['max_body_size'] = 4096
+        result = self.fetcher.sync_fetch(request)
+        response = rebuild_response(result)
+
+        self.assertEqual(response.status_code, 200, result)
+        self.assertEqual(len(response.content), 4096)
+        self.assertTrue(result['truncated'])
+
+        request['fetch']['body_overflow'] = 'abort'
+        result = self.fetcher.sync_fetch(request)
+        self.assertEqual(result['status_code'], 599, result)
+
+    def test_a220_spill_body_size(self):
+        request = copy.deepcopy(self.sample_task_http)
+        request['url'] = self.httpbin+'/bytes/10000'
+        request['fetch']['spill_body_size'] = 1024
+        result = self.fetcher.sync_fetch(request)
+        response = rebuild_response(result)
+
+        self.assertEqual(response.status_code, 200, result)
+        self.assertEqual(result['content'], b'')
+        self.assertIn('content_ref', result)
+        self.assertEqual(len(response.content), 10000)
+
     # PhantomJS tests have been removed as PhantomJS is deprecated
 
+class TestFetcherIntake(unittest.TestCase):
+
+    class FakeIOLoop(object):
+        def __init__(self):
+            self.callbacks = []
+
+        def add_callback(self, callback, *args):
+            self.callbacks.append(args)
+
+        def stop(self):
+            pass
+
+    class BrokenQueue(object):
+        def __init__(self):
+            self.gets = 0
+
+        def get(self, block=True, timeout=None):
+            self.gets += 1
+            raise ConnectionError('connection lost')
+
+    def intake(self, inqueue, poolsize):
+        import threading
+        fetcher = Fetcher(inqueue, Queue(), poolsize=poolsize)
+        fetcher.ioloop = self.FakeIOLoop()
+        fetcher.intake_timeout = 0.1
+        fetcher._slots = threading.BoundedSemaphore(poolsize)
+        return fetcher, utils.run_in_thread(fetcher._intake_loop)
+
+    def free_slots(self, fetcher, poolsize):
+        slots = 0
+        while fetcher._slots.acquire(blocking=False):
+            slots += 1
+        for _ in range(slots):
+            fetcher._slots.release()
+        return slots
+
+    def test_10_slots(self):
+        inqueue = Queue(10)
+        for i in range(5):
+            inqueue.put({'taskid': str(i), 'project': 'project', 'url': 'data:,%d' % i})
+        fetcher, thread = self.intake(inqueue, 3)
+        time.sleep(0.5)
+        # no more tasks than slots of the pool are taken
+        self.assertEqual(len(fetcher.ioloop.callbacks), 3)
+        for _ in range(2):
+            fetcher._inflight += 1
+            fetcher._on_dispatch_done(None)
+        time.sleep(0.5)
+        self.assertEqual([x[0]['taskid'] for x in fetcher.ioloop.callbacks],
+                         [str(i) for i in range(5)])
+        fetcher.quit()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_20_broken_inqueue(self):
+        inqueue = self.BrokenQueue()
+        fetcher, thread = self.intake(inqueue, 3)
+        fetcher.intake_error_interval = 0.2
+        time.sleep(0.5)
+        fetcher.quit()
+        thread.join(1)
+        # errors are paced, and slots are given back
+        self.assertLessEqual(inqueue.gets, 4)
+        self.assertEqual(self.free_slots(fetcher, 3), 3)
+
+    def test_30_dispatch_sync(self):
+        import threading
+        fetcher = Fetcher(None, None, poolsize=1, async_mode=False)
+        fetcher._slots = threading.BoundedSemaphore(1)
+        fetcher._slots.acquire()
+        fetcher._dispatch({'taskid': 'taskid', 'project': 'project', 'url': 'data:,hello'})
+        # result of sync fetch is done, slot is released
+        self.assertEqual(fetcher._inflight, 0)
+        self.assertEqual(self.free_slots(fetcher, 1), 1)
+
+
+class TestBodySpool(unittest.TestCase):
+
+    def test_truncate(self):
+        from pyspider.fetcher.body_spool import BodySpool
+        spool = BodySpool(max_size=10)
+        self.assertTrue(spool.write(b'12345'))
+        self.assertFalse(spool.write(b'67890abc'))
+        self.assertTrue(spool.truncated)
+        self.assertEqual(spool.finish(), (b'1234567890', None))
+
+    def test_abort(self):
+        from pyspider.fetcher.body_spool import BodySpool
+        spool = BodySpool(max_size=10, overflow='abort')
+        self.assertFalse(spool.write(b'12345678901'))
+        self.assertTrue(spool.aborted)
+
+    def test_spill(self):
+        import tempfile
+        from pyspider.fetcher.body_spool import BodySpool, clear_spool
+        spill_dir = tempfile.mkdtemp()
+
+        def spill(body):
+            spool = BodySpool(spill_size=4, spill_dir=spill_dir)
+            for i in range(0, len(body), 3):
+                spool.write(body[i:i + 3])
+            return spool.finish()
+
+        content, content_ref = spill(b'123456789')
+        self.assertEqual(content, b'')
+        self.assertTrue(content_ref.startswith('spool://' + spill_dir))
+        # same body of another response is a file of its own
+        self.assertNotEqual(spill(b'123456789')[1], content_ref)
+        self.assertEqual(len(os.listdir(spill_dir)), 2)
+
+        # removed once loaded
+        self.assertEqual(rebuild_response({'content_ref': content_ref}).content, b'123456789')
+        self.assertEqual(len(os.listdir(spill_dir)), 1)
+        with self.assertRaises(FileNotFoundError):
+            rebuild_response({'content_ref': content_ref}).content
+
+        # files never loaded are removed after ttl
+        clear_spool(spill_dir, ttl=3600)
+        self.assertEqual(len(os.listdir(spill_dir)), 1)
+        clear_spool(spill_dir, ttl=-1)
+        self.assertEqual(os.listdir(spill_dir), [])
+        os.rmdir(spill_dir)
+
+
+class TestRobotsCache(unittest.TestCase):
+    robots_txt = (
+        'User-agent: *\n'
+        'Disallow: /private\n'
+        'Allow: /private/public\n'
+        'Disallow: /*.pdf$\n'
+        '\n'
+        'User-agent: BadBot\n'
+        'Disallow: /\n'
+    )
+
+    def test_rules(self):
+        from pyspider.fetcher.robots_cache import RobotsRules
+        rules = RobotsRules(self.robots_txt)
+        self.assertTrue(rules.can_fetch('pyspider/0.3', 'http://a.com/'))
+        self.assertFalse(rules.can_fetch('pyspider/0.3', 'http://a.com/private/a'))
+        self.assertTrue(rules.can_fetch('pyspider/0.3', 'http://a.com/private/public/a'))
+        self.assertFalse(rules.can_fetch('pyspider/0.3', 'http://a.com/a.pdf'))
+        self.assertTrue(rules.can_fetch('pyspider/0.3', 'http://a.com/a.pdf?a=b'))
+        self.assertFalse(rules.can_fetch('BadBot/1.0', 'http://a.com/'))
+        self.assertTrue(RobotsRules(None).can_fetch('BadBot/1.0', 'http://a.com/'))
+
+    def test_single_flight(self):
+        import asyncio
+        from pyspider.fetcher.robots_cache import RobotsCache
+        loads = []
+
+        async def load(url):
+            loads.append(url)
+            await asyncio.sleep(0.01)
+            return self.robots_txt
+
+        async def run():
+            cache = RobotsCache(max_size=2)
+            result = await asyncio.gather(*[
+                cache.can_fetch('pyspider', 'http://a.com/private/%d' % i, load) for i in range(10)])
+            self.assertEqual(result, [False] * 10)
+            self.assertEqual(loads, ['http://a.com/robots.txt'])
+            await cache.can_fetch('pyspider', 'http://b.com/', load)
+            await cache.can_fetch('pyspider', 'http://c.com/', load)
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get('http://a.com'))
+
+        asyncio.run(run())
+
+    def test_sqlite_backend(self):
+        import shutil
+        import tempfile
+        from pyspider.fetcher.robots_cache import RobotsCache, connect_robots_backend
+        path = tempfile.mkdtemp()
+        try:
+            url = 'sqlite:///' + os.path.join(path, 'robots.db')
+            RobotsCache(backend=connect_robots_backend(url)).put('http://a.com', self.robots_txt)
+            rules = RobotsCache(backend=connect_robots_backend(url)).get('http://a.com')
+            self.assertFalse(rules.can_fetch('pyspider', 'http://a.com/private'))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestHTTPCache(unittest.TestCase):
+
+    def test_lru(self):
+        import shutil
+        import tempfile
+        from pyspider.fetcher.http_cache import HTTPCache
+        path = tempfile.mkdtemp()
+        try:
+            cache = HTTPCache(path, max_size=250)
+            self.assertEqual(cache.key('get', 'http://A.com:80/?b=1&a=2#x'),
+                             cache.key('GET', 'http://a.com/?a=2&b=1'))
+            for i in range(5):
+                cache.put(cache.key('GET', 'http://a.com/%d' % i), {
+                    'url': 'http://a.com/%d' % i,
+                    'status_code': 200,
+                    'headers': {'ETag': 'etag'},
+                    'content': b'x' * 100,
+                })
+                self.assertIsNotNone(cache.get(cache.key('GET', 'http://a.com/0')))
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get(cache.key('GET', 'http://a.com/1')))
+            self.assertEqual(cache.get(cache.key('GET', 'http://a.com/0'))['content'], b'x' * 100)
+            self.assertFalse(cache.cacheable({'status_code': 200,
+                                              'headers': {'Cache-Control': 'no-store'}}))
+        finally:
+            shutil.rmtree(path)
+
+    def test_shared_file(self):
+        import shutil
+        import tempfile
+        from pyspider.fetcher.http_cache import HTTPCache
+        path = tempfile.mkdtemp()
+        try:
+            caches = [HTTPCache(path, max_size=250), HTTPCache(path, max_size=250)]
+            for i in range(4):
+                caches[i % 2].put('key%d' % i, {'status_code': 200, 'content': b'x' * 100})
+            # size of bodies put by both fetchers is counted
+            self.assertEqual(len(caches[0]), 2)
+            self.assertEqual(caches[1].stats()['size'], 200)
+            self.assertIsNone(caches[1].get('key0'))
+            self.assertIsNotNone(caches[0].get('key3'))
+
+            caches[0].put('key3', {'status_code': 200, 'content': b'x' * 10})
+            caches[1].delete('key2')
+            self.assertEqual(HTTPCache(path, max_size=250).stats()['size'], 10)
+        finally:
+            shutil.rmtree(path)
+
+
+class TestHTTPCacheFetch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        requests = self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append((self.path, self.headers.get('If-None-Match')))
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.send_header('X-Revalidated', 'yes')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', '7')
+                self.end_headers()
+                self.wfile.write(b'content')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def setUp(self):
+        import tempfile
+        from pyspider.fetcher.http_cache import HTTPCache
+        self.path = tempfile.mkdtemp()
+        self.fetcher = Fetcher(None, None)
+        self.fetcher.http_cache = HTTPCache(self.path)
+        del self.requests[:]
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def fetch(self, path, **fetch):
+        task = {'taskid': path, 'project': 'project', 'url': self.url + path, 'fetch': fetch}
+        return self.fetcher.ioloop.run_sync(
+            lambda: self.fetcher.async_fetch(task, lambda *args: None))
+
+    def test_10_revalidate(self):
+        result = self.fetch('/a')
+        self.assertEqual(result['status_code'], 200)
+        self.assertNotIn('from_cache', result)
+
+        result = self.fetch('/a')
+        self.assertEqual(self.requests, [('/a', None), ('/a', '"v1"')])
+        self.assertEqual(result['status_code'], 200)
+        self.assertTrue(result['from_cache'])
+        self.assertEqual(utils.text(result['content']), 'content')
+        self.assertEqual(result['headers'].get('X-Revalidated'), 'yes')
+        self.assertEqual(self.fetcher.http_cache.get(
+            self.fetcher.http_cache.key('GET', self.url + '/a'))['headers']['X-Revalidated'], 'yes')
+
+        # not cached when disabled
+        result = self.fetch('/a', http_cache=False)
+        self.assertEqual(self.requests[-1], ('/a', None))
+        self.assertNotIn('from_cache', result)
+
+    def test_20_offline(self):
+        self.fetch('/a')
+        result = self.fetch('/a', http_cache='offline')
+        self.assertTrue(result['from_cache'])
+        self.assertEqual(utils.text(result['content']), 'content')
+
+        result = self.fetch('/b', http_cache='offline')
+        self.assertEqual(result['status_code'], 599)
+        self.assertIn('offline', result['error'])
+        self.assertEqual(self.requests, [('/a', None)])
+
+        self.fetcher.http_cache_offline = True
+        result = self.fetch('/a')
+        self.assertTrue(result['from_cache'])
+        self.assertEqual(self.requests, [('/a', None)])
+
+
+class TestDNSCache(unittest.TestCase):
+
+    def test_cache(self):
+        import asyncio
+        import socket
+        from pyspider.fetcher.dns_cache import DNSCache
+        queries = []
+
+        async def query(host):
+            queries.append(host)
+            await asyncio.sleep(0.01)
+            if host == 'bad.test':
+                raise socket.gaierror(socket.EAI_NONAME, 'not found')
+            return ['10.0.0.1'], 60
+
+        async def run():
+            cache = DNSCache(ttl=300)
+            cache._query = query
+            result = await asyncio.gather(*[cache.resolve('a.test') for _ in range(5)])
+            self.assertEqual(result, [['10.0.0.1']] * 5)
+            self.assertEqual(await cache.resolve('127.0.0.1'), ['127.0.0.1'])
+            for _ in range(2):
+                with self.assertRaises(socket.gaierror):
+                    await cache.resolve('bad.test')
+            self.assertEqual(queries, ['a.test', 'bad.test'])
+
+            # refreshed in background after prefetch ratio of ttl
+            addresses, expire, _ = cache.cache['a.test']
+            cache.cache['a.test'] = (addresses, expire, 0)
+            self.assertEqual(await cache.resolve('a.test'), ['10.0.0.1'])
+            await asyncio.sleep(0.05)
+            self.assertEqual(queries.count('a.test'), 2)
+
+        asyncio.run(run())
+
+    def test_fetch_all_addresses(self):
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from pyspider.fetcher.dns_cache import DNSCache
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        async def query(host):
+            # nothing listens on the first address
+            return ['::1', '127.0.0.1'], 60
+
+        fetcher = Fetcher(None, None)
+        fetcher.dns_cache = DNSCache(ttl=300)
+        fetcher.dns_cache._query = query
+        task = {'taskid': 'taskid', 'project': 'project',
+                'url': 'http://dns.test:%d/' % server.server_address[1]}
+        result = fetcher.ioloop.run_sync(lambda: fetcher.async_fetch(task, lambda *args: None))
+        self.assertEqual(result['status_code'], 200)
+        self.assertEqual(utils.text(result['content']), 'ok')
+
+
 @unittest.skipIf(os.environ.get('IGNORE_SPLASH') or os.environ.get('IGNORE_ALL'), 'no splash server for test.')
 class TestSplashFetcher(unittest.TestCase):
     @property
@@ -605,3 +1021,498 @@ class TestSplashFetcher(unittest.TestCase):
         self.assertIn('c=d', data['headers'].get('Cookie'), response.content)
         self.assertIn('a=b', data['headers'].get('Cookie'), response.content)
         self.fetcher.proxy = None
+
+
+class TestProxyPool(unittest.TestCase):
+
+    def test_health(self):
+        from pyspider.fetcher.proxy_pool import ProxyPool
+        pool = ProxyPool(['a:1', 'http://b:2'], cooldown=60, max_failures=2, sticky_ttl=60)
+        self.assertIn('http://a:1', pool)
+        self.assertIn('b:2', pool)
+
+        for _ in range(20):
+            pool.report('a:1', 'x.com', 200, 0.1)
+            pool.report('b:2', 'x.com', 200, 2.0)
+        self.assertGreater(pool.score(pool.proxies['http://a:1']),
+                           pool.score(pool.proxies['http://b:2']))
+
+        proxy = pool.choose('x.com')
+        self.assertEqual(pool.choose('x.com'), proxy)
+
+        # banned proxy is put on cooldown and unstuck from host
+        pool.report(proxy, 'x.com', 429, 0.1)
+        other = ({'http://a:1', 'http://b:2'} - {proxy}).pop()
+        self.assertEqual(set(pool.choose('y.com') for _ in range(10)), {other})
+        self.assertEqual(pool.choose('x.com'), other)
+
+        self.assertTrue(pool.is_banned(200, b'<div id="cf-chl-widget">'))
+        pool.report(other, 'x.com', 599, None)
+        self.assertEqual(pool.proxies[other].cooldown_until, 0)
+        pool.report(other, 'x.com', 599, None)
+        self.assertGreater(pool.proxies[other].cooldown_until, 0)
+
+        stats = dict((x['proxy'], x) for x in pool.stats())
+        self.assertEqual(stats[proxy]['bans'], 1)
+        self.assertGreater(stats[other]['cooldown'], 0)
+
+    def test_failure_latency(self):
+        from pyspider.fetcher.proxy_pool import ProxyPool
+        pool = ProxyPool(['a:1', 'b:2', 'c:3'], max_failures=10, failure_latency=10)
+        pool.report('a:1', 'x.com', 200, 0.5)
+        # timed out proxy is scored as slow, not as untried
+        pool.report('b:2', 'x.com', 599, None)
+        self.assertEqual(pool.proxies['http://b:2'].latency, 10)
+        self.assertEqual(pool.mean_latency(), 5.25)
+        a, b, c = (pool.proxies[x] for x in ('http://a:1', 'http://b:2', 'http://c:3'))
+        self.assertEqual(pool.score(c), pool.score(c, 5.25))
+        self.assertGreater(pool.score(a), pool.score(c))
+        self.assertGreater(pool.score(c), pool.score(b))
+
+    def test_ban_detection(self):
+        from pyspider.fetcher.proxy_pool import ProxyPool
+
+        pool = ProxyPool()
+        self.assertTrue(pool.is_banned(403))
+        self.assertFalse(pool.is_banned(404, b'<title>Access Denied</title>'))
+
+        # challenge markers, whatever size of page
+        self.assertTrue(pool.is_banned(
+            200, b'<script src="/cdn-cgi/challenge-platform/h/b/orchestrate/jsch/v1"></script>'))
+        self.assertTrue(pool.is_banned(200, b'<iframe src="https://geo.captcha-delivery.com/c">'))
+        self.assertTrue(pool.is_banned(200, b'<script src="/_Incapsula_Resource?a=1"></script>' +
+                                       b'<p>text</p>' * 10000))
+
+        # block page titles, only of small pages
+        self.assertTrue(pool.is_banned(200, '<title>Just a moment...</title>'))
+        self.assertTrue(pool.is_banned(200, b'<title>\n  Access Denied\n</title><h1>denied</h1>'))
+        article = b'<title>Access Denied: a review</title>' + b'<p>text</p>' * 10000
+        self.assertFalse(pool.is_banned(200, article))
+
+        # pages mentioning a captcha or denied access are not block pages
+        self.assertFalse(pool.is_banned(200, b'<title>Login</title><div class="g-recaptcha">'))
+        self.assertFalse(pool.is_banned(200, b'<p>access denied errors of S3 explained</p>'))
+
+        pool = ProxyPool(ban_status_codes=[429], ban_markers=r'blocked-by-waf',
+                         ban_titles=None)
+        self.assertFalse(pool.is_banned(403))
+        self.assertTrue(pool.is_banned(200, b'<div class="blocked-by-waf">'))
+        self.assertFalse(pool.is_banned(200, b'<title>Just a moment...</title>'))
+
+
+class TestHostLimiter(unittest.TestCase):
+
+    def test_aimd(self):
+        import asyncio
+        from pyspider.fetcher.host_limiter import HostLimiter, parse_retry_after
+
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertAlmostEqual(parse_retry_after('Thu, 01 Jan 1970 00:00:00 GMT'), 0)
+        self.assertIsNone(parse_retry_after('soon'))
+
+        async def run():
+            limiter = HostLimiter(max_limit=8, initial=2)
+            started = []
+
+            async def request(i):
+                await limiter.acquire('a.com')
+                started.append(i)
+
+            tasks = [asyncio.ensure_future(request(i)) for i in range(4)]
+            await asyncio.sleep(0.01)
+            self.assertEqual(started, [0, 1])
+            self.assertEqual(len(limiter.hosts['a.com'].waiters), 2)
+
+            # success raises limit by 1 / limit, the next waiter starts
+            limiter.release('a.com', 200, 0.1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(started, [0, 1, 2])
+            self.assertAlmostEqual(limiter.hosts['a.com'].limit, 2.5)
+
+            # throttled, limit halved and host held by Retry-After
+            limiter.release('a.com', 429, 0.1, {'Retry-After': '1'})
+            self.assertAlmostEqual(limiter.hosts['a.com'].limit, 1.25)
+            self.assertGreater(limiter.backoff('a.com'), 0.5)
+            await asyncio.sleep(0.01)
+            self.assertEqual(started, [0, 1, 2])
+            limiter.release('a.com', 200, 0.1)
+            limiter.release('a.com', 200, 0.1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(started, [0, 1, 2])
+            await asyncio.wait_for(asyncio.gather(*tasks), 2)
+            self.assertEqual(started, [0, 1, 2, 3])
+            self.assertIn('a.com', limiter.stats())
+
+        asyncio.run(run())
+
+    def test_defer(self):
+        import asyncio
+        from pyspider.fetcher.host_limiter import HostLimiter
+
+        async def run():
+            limiter = HostLimiter(max_limit=8, initial=2)
+            self.assertEqual(limiter.defer('a.com'), 0)
+            await limiter.acquire('a.com')
+            self.assertEqual(limiter.defer('a.com'), 0)
+            await limiter.acquire('a.com')
+            # at its limit, a task would wait for host
+            self.assertGreaterEqual(limiter.defer('a.com'), 1)
+            limiter.release('a.com', 200, 0.1)
+            self.assertEqual(limiter.defer('a.com'), 0)
+            limiter.release('a.com', 429, 0.1, {'Retry-After': '30'})
+            self.assertGreater(limiter.defer('a.com'), 25)
+            self.assertEqual(limiter.defer('b.com'), 0)
+
+        asyncio.run(run())
+
+    def test_dispatch_deferred(self):
+        import threading
+        from pyspider.fetcher.host_limiter import HostLimiter
+        outqueue = Queue(10)
+        fetcher = Fetcher(None, outqueue, poolsize=1)
+        fetcher.host_limiter = HostLimiter()
+        fetcher.host_limiter._state('a.com').blocked_until = time.time() + 60
+        fetcher._slots = threading.BoundedSemaphore(1)
+        fetcher._slots.acquire()
+        fetcher._dispatch({'taskid': 'taskid', 'project': 'project', 'url': 'http://a.com/'})
+        # sent back at once, slot is not held by a task of blocked host
+        self.assertTrue(fetcher._slots.acquire(blocking=False))
+        self.assertEqual(fetcher._inflight, 0)
+        task, result = outqueue.get(timeout=1)
+        self.assertEqual(task['taskid'], 'taskid')
+        self.assertTrue(result['deferred'])
+        self.assertGreater(result['backoff'], 50)
+
+
+class TestPlaywrightPool(unittest.TestCase):
+
+    class FakePage(object):
+        def __init__(self, context):
+            self.context = context
+            self.memory = 0
+
+        def set_default_timeout(self, timeout):
+            pass
+
+        async def evaluate(self, script):
+            return self.memory
+
+        async def set_extra_http_headers(self, headers):
+            pass
+
+        async def goto(self, url, **kwargs):
+            pass
+
+    class FakeContext(object):
+        def __init__(self, browser, options):
+            self.browser = browser
+            self.options = options
+            self.closed = False
+
+        async def route(self, pattern, handler):
+            pass
+
+        async def new_page(self):
+            return TestPlaywrightPool.FakePage(self)
+
+        async def clear_cookies(self):
+            pass
+
+        async def close(self):
+            self.closed = True
+
+    class FakeBrowser(object):
+        def __init__(self):
+            self.contexts = []
+
+        async def new_context(self, **options):
+            context = TestPlaywrightPool.FakeContext(self, options)
+            self.contexts.append(context)
+            return context
+
+        def open(self):
+            return [x for x in self.contexts if not x.closed]
+
+        async def close(self):
+            pass
+
+    def manager(self, **kwargs):
+        from unittest import mock
+        from pyspider.fetcher import playwright_manager
+
+        patcher = mock.patch.object(playwright_manager, 'has_playwright', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        manager = playwright_manager.PlaywrightManager(**kwargs)
+        manager._browser = self.FakeBrowser()
+        manager._initialized = True
+        return manager
+
+    def test_10_reuse(self):
+        import asyncio
+
+        async def run():
+            manager = self.manager(max_pages=4, warm_pages=0, max_page_uses=2)
+            page, new = await manager.get_page('http://p1', 'ua')
+            self.assertTrue(new)
+            self.assertEqual(page.context.options['proxy'], {'server': 'http://p1'})
+            self.assertEqual(page.context.options['user_agent'], 'ua')
+            await manager.release_page(page)
+
+            again, new = await manager.get_page('http://p1', 'ua')
+            self.assertIs(again, page)
+            self.assertFalse(new)
+            # worn out after max_page_uses
+            await manager.release_page(again)
+            self.assertTrue(page.context.closed)
+
+            other, new = await manager.get_page('http://p2', 'ua')
+            self.assertTrue(new)
+            await manager.release_page(other, error=True)
+            self.assertTrue(other.context.closed)
+
+            stats = manager.stats()
+            self.assertEqual(stats['hits'], 1)
+            self.assertEqual(stats['misses'], 2)
+            self.assertEqual(stats['recycled'], 1)
+            self.assertEqual(stats['pages'], 0)
+
+        asyncio.run(run())
+
+    def test_20_warm_capped(self):
+        import asyncio
+
+        async def run():
+            manager = self.manager(max_pages=4, warm_pages=3)
+            await manager.warm('http://p1')
+            await manager.warm('http://p2')
+            await manager.warm('http://p3')
+            self.assertEqual(len(manager._pages), 4)
+            self.assertEqual(len(manager._browser.open()), 4)
+            self.assertEqual(len(manager._idle[('http://p1', None)]), 3)
+            self.assertEqual(len(manager._idle[('http://p2', None)]), 1)
+            self.assertEqual(len(manager._idle[('http://p3', None)]), 0)
+
+            # pages created concurrently are counted against max_pages too
+            manager = self.manager(max_pages=4, warm_pages=3)
+            await asyncio.gather(*[manager.warm('http://p%d' % i) for i in range(3)])
+            self.assertEqual(len(manager._browser.open()), 4)
+
+        asyncio.run(run())
+
+    def test_30_evict_and_wait(self):
+        import asyncio
+        from pyspider.libs.errors import ProcessError
+
+        async def run():
+            manager = self.manager(max_pages=2, warm_pages=0)
+            page1, _ = await manager.get_page('http://p1')
+            page2, _ = await manager.get_page('http://p1')
+            await manager.release_page(page1)
+
+            # idle page of another key is closed to make room
+            page3, new = await manager.get_page('http://p2')
+            self.assertTrue(new)
+            self.assertTrue(page1.context.closed)
+            self.assertEqual(len(manager._browser.open()), 2)
+
+            # all pages in use, waits for a page released
+            waiting = asyncio.ensure_future(manager.get_page('http://p3'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            self.assertEqual(len(manager._browser.open()), 2)
+            await manager.release_page(page2)
+            page4, new = await asyncio.wait_for(waiting, 1)
+            self.assertTrue(new)
+            self.assertTrue(page2.context.closed)
+            self.assertEqual(len(manager._browser.open()), 2)
+
+            # waiting for the same key, gets the page released
+            waiting = asyncio.ensure_future(manager.get_page('http://p2'))
+            await asyncio.sleep(0.01)
+            await manager.release_page(page3)
+            page, new = await asyncio.wait_for(waiting, 1)
+            self.assertIs(page, page3)
+            self.assertFalse(new)
+
+            # waiters fail when manager closed
+            waiting = asyncio.ensure_future(manager.get_page('http://p1'))
+            await asyncio.sleep(0.01)
+            await manager.close()
+            with self.assertRaises(ProcessError):
+                await asyncio.wait_for(waiting, 1)
+            self.assertEqual(manager._pages, {})
+
+        asyncio.run(run())
+
+    def test_40_recycle_on_memory(self):
+        import asyncio
+
+        async def run():
+            manager = self.manager(max_pages=2, warm_pages=0, max_page_memory=1)
+            page, _ = await manager.get_page()
+            page.memory = 2 * 1024 * 1024
+            await manager.release_page(page)
+            self.assertTrue(page.context.closed)
+            self.assertEqual(manager.stats()['recycled'], 1)
+
+        asyncio.run(run())
+
+
+class TestHTTP2Fetch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        try:
+            import h2.config
+            import h2.connection
+            import h2.events
+            import pycurl
+        except ImportError:
+            raise unittest.SkipTest('h2 and pycurl are required')
+        if not pycurl.version_info()[4] & pycurl.VERSION_HTTP2:
+            raise unittest.SkipTest('libcurl is built without http2')
+
+        self.connections = 0
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.url = 'http://127.0.0.1:%d' % self.server.getsockname()[1]
+
+        def serve(sock):
+            # h2c server of prior knowledge, replies path of each stream
+            conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+            conn.initiate_connection()
+            sock.sendall(conn.data_to_send())
+            while True:
+                data = sock.recv(65535)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        path = dict(event.headers)[b':path']
+                        conn.send_headers(event.stream_id, [(':status', '200'),
+                                                            ('content-type', 'text/plain')])
+                        conn.send_data(event.stream_id, path, end_stream=True)
+                sock.sendall(conn.data_to_send())
+            sock.close()
+
+        def accept():
+            while True:
+                try:
+                    sock, _ = self.server.accept()
+                except OSError:
+                    break
+                self.connections += 1
+                utils.run_in_thread(serve, sock)
+        utils.run_in_thread(accept)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.close()
+
+    def test_multiplex(self):
+        from tornado import gen
+        fetcher = Fetcher(None, None, poolsize=20)
+        fetcher.http2_connections = 1
+        tasks = [{
+            'taskid': str(i),
+            'project': 'project',
+            'url': '%s/%d' % (self.url, i),
+            'fetch': {'fetch_type': 'http2'},
+        } for i in range(10)]
+        results = fetcher.ioloop.run_sync(lambda: gen.multi(
+            [fetcher.async_fetch(task, lambda *args: None) for task in tasks]))
+        for i, result in enumerate(results):
+            self.assertEqual(result['status_code'], 200, result)
+            self.assertEqual(utils.text(result['content']), '/%d' % i)
+            self.assertIn('orig_url', result)
+        self.assertEqual(self.connections, 1)
+
+
+class TestOptimizedFetcherIntake(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import aiohttp
+        except ImportError:
+            raise unittest.SkipTest('aiohttp is required')
+
+    def test_process_queue(self):
+        import asyncio
+        from pyspider.fetcher.optimized_async_fetcher import OptimizedAsyncFetcher
+        from pyspider.fetcher.host_limiter import HostLimiter
+        from pyspider.libs.multiprocessing_queue import Queue
+        fetcher = OptimizedAsyncFetcher(auto_optimize=False)
+        fetcher.intake_batch = 2
+        fetcher.inqueue, fetcher.outqueue = Queue(10), Queue(10)
+        fetcher.host_limiter = HostLimiter()
+        fetcher.host_limiter._state('blocked.com').blocked_until = time.time() + 60
+
+        async def async_fetch(task):
+            await asyncio.sleep(task['delay'])
+            return {'status_code': 200, 'url': task['url']}
+        fetcher.async_fetch = async_fetch
+
+        for url, delay in (('http://slow.com/', 1), ('http://a.com/1', 0.05),
+                           ('http://blocked.com/', 0), ('http://a.com/2', 0.05)):
+            fetcher.inqueue.put({'taskid': url, 'url': url, 'delay': delay})
+
+        async def run():
+            process = asyncio.ensure_future(fetcher.process_queue())
+            results = []
+            for _ in range(3):
+                # results are put as fetched, slots freed are refilled while the slow one runs
+                results.append(await asyncio.get_event_loop().run_in_executor(
+                    None, lambda: fetcher.outqueue.get(timeout=0.9)))
+            process.cancel()
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual([task['url'] for task, result in results],
+                         ['http://a.com/1', 'http://blocked.com/', 'http://a.com/2'])
+        self.assertTrue(results[1][1]['deferred'])
+        self.assertGreater(results[1][1]['backoff'], 50)
+
+
+class TestOptimizedHTTP2Proxy(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import httpx
+            from pyspider.fetcher.optimized_async_fetcher import OptimizedAsyncFetcher
+        except ImportError:
+            raise unittest.SkipTest('httpx and aiohttp are required')
+        from pyspider.fetcher.proxy_pool import ProxyPool
+        self.fetcher = OptimizedAsyncFetcher(auto_optimize=False)
+        self.fetcher.proxy_pool = ProxyPool(['127.0.0.1:3128'])
+        self.clients = []
+
+        def get_http2_client(scheme, proxy=None):
+            self.clients.append(proxy)
+            return httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, text=str(request.url))))
+        self.fetcher.get_http2_client = get_http2_client
+
+    def test_proxy(self):
+        import asyncio
+        task = {'url': 'http://example.com/', 'fetch': {'fetch_type': 'http2'}}
+        result = asyncio.run(self.fetcher.http2_fetch(task['url'], task))
+        self.assertEqual(result['status_code'], 200)
+        # proxy is picked from pool, and reported
+        self.assertEqual(self.clients, ['http://127.0.0.1:3128'])
+        self.assertEqual(self.fetcher.proxy_pool.stats()[0]['requests'], 1)
+
+        task['fetch']['proxy'] = 'localhost:8080'
+        asyncio.run(self.fetcher.http2_fetch(task['url'], task))
+        task['fetch']['proxy'] = False
+        asyncio.run(self.fetcher.http2_fetch(task['url'], task))
+        self.assertEqual(self.clients[1:], ['localhost:8080', None])
+
+    def test_client_per_proxy(self):
+        from pyspider.fetcher.optimized_async_fetcher import OptimizedAsyncFetcher
+        fetcher = OptimizedAsyncFetcher(auto_optimize=False)
+        direct = fetcher.get_http2_client('http')
+        proxied = fetcher.get_http2_client('http', 'localhost:8080')
+        self.assertIsNot(direct, proxied)
+        self.assertIs(proxied, fetcher.get_http2_client('http', 'http://localhost:8080'))
@@ -443,6 +443,40 @@ class TestProcessor(unittest.TestCase):
         self.assertGreater(len(status['track']['process']['logs']), 0)
         self.assertIsNotNone(status['track']['process']['exception'])
 
+    def test_55_lost_body(self):
+        while not self.newtask_queue.empty():
+            self.newtask_queue.get()
+        while not self.status_queue.empty():
+            self.status_queue.get()
+
+        task = {
+            "process": {
+                "callback": "index_page"
+            },
+            "project": "test_project",
+            "taskid": "data:,test_lost_body",
+            "url": "data:,test_lost_body"
+        }
+        fetch_result = {
+            "orig_url": task['url'],
+            "content": b"",
+            "content_ref": "spool:///nonexistent/pyspider-spool/body",
+            "headers": {},
+            "status_code": 200,
+            "url": task['url'],
+            "time": 0,
+        }
+
+        self.in_queue.put((task, fetch_result))
+        time.sleep(1)
+        status = self.status_queue.get(timeout=3)
+        # a body removed before processed fails the fetch, so the task is retried
+        self.assertEqual(status['track']['fetch']['ok'], False)
+        self.assertEqual(status['track']['fetch']['status_code'], 599)
+        self.assertIn('lost', status['track']['fetch']['error'])
+        self.assertEqual(status['track']['process']['ok'], False)
+        self.assertTrue(self.newtask_queue.empty())
+
     def test_60_call_broken_project(self):
         # clear new task queue
         while not self.newtask_queue.empty():
@@ -575,3 +609,104 @@ class TestProcessor(unittest.TestCase):
 
         import projects.test_project3
         self.assertIsNotNone(projects.test_project3.Handler)
+
+
+
+class TestProcessorBatch(unittest.TestCase):
+
+    def test_flush(self):
+        class FakeQueue(object):
+            def __init__(self):
+                self.puts = []
+
+            def put_many(self, objs, block=True, timeout=None):
+                self.puts.append(list(objs))
+
+        status_queue, newtask_queue = FakeQueue(), FakeQueue()
+        processor = Processor(None, None, status_queue, newtask_queue, None,
+                              enable_projects_import=False)
+        processor.BATCH_FLUSH_SIZE = 3
+
+        def on_task(task, response):
+            processor.put_status(task)
+            if task % 2:
+                processor.put_newtasks([task])
+            if task == 7:
+                time.sleep(processor.BATCH_FLUSH_TIME)
+        processor.on_task = on_task
+
+        # put every 3 tasks, or when a task takes too long
+        processor.on_tasks([(i, None) for i in range(10)])
+        self.assertEqual(status_queue.puts, [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]])
+        self.assertEqual(newtask_queue.puts, [[[1]], [[3], [5]], [[7]], [[9]]])
+        self.assertIsNone(processor._status_batch)
+
+
+import queue as BaseQueue
+from pyspider.processor.pool import ProcessorPool, worker_of
+
+
+class TestProcessorPool(unittest.TestCase):
+
+    def setUp(self):
+        self.inqueue = Queue(100)
+        self.worker_queues = [Queue(100) for _ in range(3)]
+        self.pool = ProcessorPool(self.inqueue, self.worker_queues)
+
+    def test_10_route(self):
+        projects = ['project%d' % i for i in range(10)]
+        for project in projects * 3:
+            self.inqueue.put(({'taskid': project, 'project': project}, {}))
+        self.inqueue.put(('invalid', {}))
+        time.sleep(0.1)
+        self.assertEqual(self.pool.run_once(), 31)
+
+        routed = dict()
+        for index, queue in enumerate(self.worker_queues):
+            while True:
+                try:
+                    task, response = queue.get(timeout=0.5)
+                except BaseQueue.Empty:
+                    break
+                routed.setdefault(task['project'], set()).add(index)
+        self.assertEqual(sorted(routed), sorted(projects))
+        for project, workers in routed.items():
+            self.assertEqual(workers, set([worker_of(project, 3)]))
+
+    def test_20_utilization(self):
+        self.pool.stats.update(1, 10, 0.5, 2)
+        self.assertEqual(self.pool.stats.get(1), (10, 0.5, 2))
+        self.pool.update_counter()
+        self.pool.stats.update(1, 5, 0.25, 3)
+        stats = self.pool.worker_stats()
+        self.assertEqual(stats[1]['tasks'], 15)
+        self.assertGreater(stats[1]['utilization'], 0)
+        self.assertEqual(stats[0]['tasks'], 0)
+
+        counter = self.pool.counter('5m', 'sum')
+        self.assertEqual(counter['_workers']['1']['tasks'], 10)
+        self.assertEqual(counter['_workers']['1']['utilization'], 0.5)
+        self.assertEqual(stats[1]['projects'], 3)
+
+    def test_30_restart_worker(self):
+        class FakeProcess(object):
+            exitcode = None
+
+            def is_alive(self):
+                return self.exitcode is None
+
+        spawned = []
+
+        def spawn_worker(index):
+            spawned.append(index)
+            return FakeProcess()
+
+        pool = ProcessorPool(self.inqueue, self.worker_queues, spawn_worker=spawn_worker)
+        pool.start_workers()
+        self.assertEqual(spawned, [0, 1, 2])
+        pool.processes[1].exitcode = 1
+        pool.check_workers()
+        self.assertEqual(spawned, [0, 1, 2, 1])
+        self.assertTrue(all(x.is_alive() for x in pool.processes))
+        pool.update_counter()
+        pool.log_counter()
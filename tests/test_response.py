@@ -93,3 +93,57 @@ class TestResponse(unittest.TestCase):
         response = self.get('file://abc')
         with self.assertRaisesRegex(Exception, 'HTTP 599'):
             response.raise_for_status()
+
+
+class TestBodyStore(unittest.TestCase):
+
+    def _test_store(self, store):
+        from pyspider.libs.body_store import offload_body
+        result = offload_body(store, {'status_code': 200, 'content': b'<html>body</html>'}, 10)
+        self.assertEqual(result['content'], b'')
+        self.assertEqual(result['content_length'], 17)
+        response = rebuild_response(result)
+        self.assertEqual(response.content, b'<html>body</html>')
+        self.assertEqual(response.doc('html').text(), 'body')
+
+        small = {'status_code': 200, 'content': b'small'}
+        self.assertIs(offload_body(store, small, 10), small)
+
+    def test_file(self):
+        import shutil
+        import tempfile
+        from pyspider.libs.body_store import connect_body_store
+        path = tempfile.mkdtemp()
+        try:
+            store = connect_body_store('file://' + path)
+            self._test_store(store)
+            self.assertEqual(store.put(b'abc'), store.put(b'abc'))
+            store.clear(ttl=-1)
+            self.assertEqual(os.listdir(path), [])
+        finally:
+            shutil.rmtree(path)
+
+    def test_shm(self):
+        from pyspider.libs.body_store import connect_body_store, load_body
+        store = connect_body_store('shm://')
+        self._test_store(store)
+        ref = store.put(b'abc')
+        self.assertEqual(load_body(ref), b'abc')
+        with self.assertRaises(FileNotFoundError):
+            load_body(ref)
+
+    @unittest.skipUnless(os.path.isdir('/dev/shm'), 'segments are not listed in /dev/shm')
+    def test_shm_clear(self):
+        import time
+        from urllib.parse import urlparse
+        from pyspider.libs.body_store import connect_body_store, load_body
+        store = connect_body_store('shm://')
+        old, new = store.put(b'old'), store.put(b'new')
+        path = os.path.join('/dev/shm', urlparse(old).netloc)
+        os.utime(path, (time.time() - 7200, time.time() - 7200))
+        # bodies never loaded are removed after ttl
+        store.clear(ttl=3600)
+        self.assertFalse(os.path.exists(path))
+        with self.assertRaises(FileNotFoundError):
+            load_body(old)
+        self.assertEqual(load_body(new), b'new')
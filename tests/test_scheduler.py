@@ -869,5 +869,391 @@ class TestProject(unittest.TestCase):
         self.scheduler.FAIL_PAUSE_NUM = fail_pause_num
 
 
+from pyspider.scheduler.taskdb_buffer import BufferedTaskDB
+
+class TestBufferedTaskDB(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = taskdb.TaskDB(':memory:')
+        self.taskdb = BufferedTaskDB(self.raw, size=100, interval=0.1)
+
+    def test_10_merged_read(self):
+        self.raw.insert('project', 'a', {'url': 'a', 'status': 1, 'schedule': {'age': 1}})
+        self.taskdb.insert('project', 'b', {'url': 'b', 'status': 1})
+        self.taskdb.update('project', 'b', status=2)
+        self.taskdb.update('project', 'a', status=3)
+        self.taskdb.update('project', 'c', status=3)
+        self.assertEqual(len(self.taskdb.buffer), 3)
+        self.assertIsNone(self.raw.get_task('project', 'b'))
+
+        task = self.taskdb.get_task('project', 'b')
+        self.assertEqual(task['url'], 'b')
+        self.assertEqual(task['status'], 2)
+        task = self.taskdb.get_task('project', 'a', fields=['status', 'schedule'])
+        self.assertEqual(task['status'], 3)
+        self.assertEqual(task['schedule'], {'age': 1})
+        self.assertNotIn('url', task)
+        self.assertIsNone(self.taskdb.get_task('project', 'c'))
+
+        tasks = dict((t['taskid'], t) for t in self.taskdb.get_tasks('project', ['a', 'b', 'c']))
+        self.assertEqual(sorted(tasks), ['a', 'b'])
+        self.assertEqual(tasks['a']['status'], 3)
+        self.assertEqual(tasks['b']['status'], 2)
+
+    def test_20_flush_on_interval(self):
+        self.taskdb.insert('project', 'a', {'url': 'a', 'status': 1})
+        self.assertEqual(self.taskdb.flush(force=False), 0)
+        self.assertIsNone(self.raw.get_task('project', 'a'))
+        time.sleep(0.15)
+        self.assertEqual(self.taskdb.flush(force=False), 1)
+        self.assertEqual(self.raw.get_task('project', 'a')['status'], 1)
+        self.assertEqual(len(self.taskdb.buffer), 0)
+
+    def test_30_flush_on_size(self):
+        self.taskdb.buffer.size = 3
+        self.taskdb.insert('project', 'a', {'url': 'a', 'status': 1})
+        self.taskdb.insert('project', 'b', {'url': 'b', 'status': 1})
+        self.taskdb.update('project', 'a', status=2)
+        self.assertIsNone(self.raw.get_task('project', 'a'))
+        self.taskdb.insert('project', 'c', {'url': 'c', 'status': 1})
+        self.assertEqual(len(self.taskdb.buffer), 0)
+        self.assertEqual(self.raw.get_task('project', 'a')['status'], 2)
+        self.assertEqual(self.raw.status_count('project'), {1: 2, 2: 1})
+
+    def test_40_flush_on_quit(self):
+        data_path = './data/tests/buffered'
+        shutil.rmtree(data_path, ignore_errors=True)
+        os.makedirs(data_path)
+        scheduler = Scheduler(taskdb=self.raw, projectdb=projectdb.ProjectDB(':memory:'),
+                              newtask_queue=Queue(10), status_queue=Queue(10),
+                              out_queue=Queue(10), data_path=data_path,
+                              taskdb_buffer_size=100, taskdb_buffer_interval=60)
+        scheduler.taskdb.insert('project', 'a', {'url': 'a', 'status': 1})
+        self.assertIsNone(self.raw.get_task('project', 'a'))
+        scheduler.quit()
+        scheduler.run()
+        self.assertEqual(self.raw.get_task('project', 'a')['status'], 1)
+
+
+class TestTaskFilter(unittest.TestCase):
+    data_path = './data/tests/task_filter'
+    project_info = {
+        'name': 'test_project',
+        'group': 'group',
+        'status': 'RUNNING',
+        'script': 'import time\nprint(time.time())',
+        'comments': 'test project',
+        'rate': 1.0,
+        'burst': 10,
+        'updatetime': time.time(),
+    }
+
+    def setUp(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        os.makedirs(self.data_path)
+        self.taskdb = taskdb.TaskDB(':memory:')
+        for i, status in enumerate([1, 1, 2, 3, 4]):
+            self.taskdb.insert('test_project', 'taskid%d' % i, {
+                'url': 'url%d' % i, 'status': status, 'schedule': {'age': -1}})
+
+    def new_scheduler(self):
+        scheduler = Scheduler(taskdb=self.taskdb, projectdb=projectdb.ProjectDB(':memory:'),
+                              newtask_queue=Queue(10), status_queue=Queue(10),
+                              out_queue=Queue(10), data_path=self.data_path)
+        scheduler.TASK_FILTER_ERROR_RATE = 0.001
+        scheduler.TASK_LOAD_CHUNK = 2
+        scheduler.TASK_LOAD_TIME = 0
+        scheduler._update_project(dict(self.project_info))
+        return scheduler, scheduler.projects['test_project']
+
+    def load(self, scheduler, project):
+        loops = 0
+        while project.task_loading or project.task_filter_loading:
+            scheduler._check_task_loading()
+            loops += 1
+        return loops
+
+    def test_10_build_in_chunks(self):
+        scheduler, project = self.new_scheduler()
+        scheduler._check_task_loading()
+        scheduler._check_task_loading()
+        self.assertFalse(project.task_loading)
+        self.assertIsNotNone(project.task_filter)
+        self.assertFalse(project.task_filter_ready)
+        # one chunk of a status in each loop
+        self.assertGreater(self.load(scheduler, project), 3)
+        self.assertTrue(project.task_filter_ready)
+        self.assertEqual(len(project.task_filter), 5)
+        for i in range(5):
+            self.assertIn('taskid%d' % i, project.task_filter)
+        self.assertTrue(os.path.exists(scheduler._task_filter_path('test_project')))
+
+    def test_20_skip_lookup(self):
+        scheduler, project = self.new_scheduler()
+        lookups = []
+        get_task = self.taskdb.get_task
+        def _get_task(*args, **kwargs):
+            lookups.append(args[1])
+            return get_task(*args, **kwargs)
+        self.taskdb.get_task = _get_task
+
+        # taskdb is looked up until the filter is built
+        scheduler._check_task_loading()
+        scheduler.on_request({'project': 'test_project', 'taskid': 'new1', 'url': 'new1'})
+        self.assertEqual(lookups, ['new1'])
+
+        self.load(scheduler, project)
+        task = scheduler.on_request({'project': 'test_project', 'taskid': 'new2', 'url': 'new2'})
+        self.assertEqual(task['taskid'], 'new2')
+        self.assertEqual(lookups, ['new1'])
+        self.assertIn('new1', project.task_filter)
+        self.assertIn('new2', project.task_filter)
+        self.assertEqual(self.taskdb.get_task('test_project', 'new2')['status'], 1)
+
+        self.assertIsNone(scheduler.on_request(
+            {'project': 'test_project', 'taskid': 'taskid2', 'url': 'url2'}))
+        self.assertEqual(lookups[-1], 'taskid2')
+
+    def test_30_staleness(self):
+        scheduler, project = self.new_scheduler()
+        self.load(scheduler, project)
+        scheduler.on_request({'project': 'test_project', 'taskid': 'new1', 'url': 'new1'})
+        project.task_filter.dump(scheduler._task_filter_path('test_project'))
+
+        # loaded from file when count matches taskdb
+        scheduler, project = self.new_scheduler()
+        while project.task_loading:
+            scheduler._check_task_loading()
+        self.assertTrue(project.task_filter_ready)
+        self.assertEqual(project.task_filter_loading, [])
+        self.assertIn('new1', project.task_filter)
+
+        # rebuilt when taskdb is changed by others
+        self.taskdb.insert('test_project', 'other', {'url': 'other', 'status': 2})
+        scheduler, project = self.new_scheduler()
+        while project.task_loading:
+            scheduler._check_task_loading()
+        self.assertFalse(project.task_filter_ready)
+        self.assertNotIn('new1', project.task_filter)
+        self.load(scheduler, project)
+        self.assertTrue(project.task_filter_ready)
+        self.assertIn('new1', project.task_filter)
+        self.assertIn('other', project.task_filter)
+        self.assertEqual(len(project.task_filter), 7)
+
+
+class TestTaskLoading(unittest.TestCase):
+    data_path = './data/tests/task_loading'
+
+    def setUp(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        os.makedirs(self.data_path)
+        self.taskdb = taskdb.TaskDB(':memory:')
+        tasks = [('taskid%d' % i, {'url': 'url%d' % i, 'status': 1,
+                                   'schedule': {'priority': i}}) for i in range(5)]
+        tasks.append(('success', {'url': 'url', 'status': 2}))
+        self.taskdb.insert_many('test_project', tasks)
+        self.scheduler = Scheduler(taskdb=self.taskdb, projectdb=projectdb.ProjectDB(':memory:'),
+                                   newtask_queue=Queue(10), status_queue=Queue(10),
+                                   out_queue=Queue(10), data_path=self.data_path)
+        self.scheduler.TASK_LOAD_CHUNK = 2
+        self.scheduler.TASK_LOAD_TIME = 0
+
+    def test_10_load_in_chunks(self):
+        self.scheduler._update_project(dict(TestTaskFilter.project_info))
+        project = self.scheduler.projects['test_project']
+        self.assertTrue(project.task_loaded)
+        self.assertTrue(project.task_loading)
+        self.assertEqual(project.task_load_total, 5)
+        self.assertEqual(len(project.task_queue), 0)
+
+        progress = []
+        while project.task_loading:
+            self.scheduler._check_task_loading()
+            progress.append((project.task_load_count, len(project.task_queue)))
+        self.assertEqual(progress, [(2, 2), (4, 4), (5, 5)])
+        self.assertEqual(project.task_load_count, project.task_load_total)
+        self.assertNotIn('success', project.task_queue)
+
+    def test_20_queued_while_loading(self):
+        self.scheduler._update_project(dict(TestTaskFilter.project_info))
+        project = self.scheduler.projects['test_project']
+        self.scheduler._check_task_loading()
+        self.assertTrue(project.task_loading)
+        self.assertIn('taskid0', project.task_queue)
+        self.assertIn('taskid1', project.task_queue)
+        self.assertNotIn('taskid2', project.task_queue)
+
+        # stopped while loading
+        self.scheduler._update_project(dict(TestTaskFilter.project_info, status='STOP'))
+        self.assertFalse(project.task_loading)
+        self.assertFalse(project.task_loaded)
+        self.assertEqual(len(project.task_queue), 0)
+
+
+from pyspider.scheduler.shard import ShardRing
+
+class TestTaskSnapshot(unittest.TestCase):
+    data_path = './data/tests/task_snapshot'
+
+    def setUp(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        os.makedirs(self.data_path)
+        self.taskdb = taskdb.TaskDB(':memory:')
+        self.taskdb.insert_many('test_project', [
+            ('taskid%d' % i, {'url': 'url%d' % i, 'status': 1}) for i in range(3)])
+
+    def new_scheduler(self, shard_ring=None, shard_id=None):
+        scheduler = Scheduler(taskdb=self.taskdb, projectdb=projectdb.ProjectDB(':memory:'),
+                              newtask_queue=Queue(10), status_queue=Queue(10),
+                              out_queue=Queue(10), data_path=self.data_path)
+        scheduler.TASK_QUEUE_SNAPSHOT_INTERVAL = 60
+        scheduler.shard_ring = shard_ring
+        scheduler.shard_id = shard_id
+        scheduler._update_project(dict(TestTaskFilter.project_info))
+        project = scheduler.projects['test_project']
+        while project.task_loading:
+            scheduler._check_task_loading()
+        return scheduler, project
+
+    def test_10_load_from_snapshot(self):
+        scheduler, project = self.new_scheduler()
+        self.assertIsNotNone(project.task_snapshot)
+        self.assertTrue(os.path.exists(os.path.join(self.data_path, 'scheduler.test_project.queue')))
+
+        project.task_queue.delete('taskid0')
+        self.taskdb.update('test_project', 'taskid0', status=2)
+        scheduler.on_new_request({'project': 'test_project', 'taskid': 'new', 'url': 'new'})
+        project.task_snapshot.synced = 0
+        scheduler._try_dump_task_snapshots()
+        scheduler._close_task_snapshot(project)
+
+        # not loaded from taskdb
+        load_tasks_page = self.taskdb.load_tasks_page
+        self.taskdb.load_tasks_page = None
+        try:
+            scheduler, project = self.new_scheduler()
+        finally:
+            self.taskdb.load_tasks_page = load_tasks_page
+        self.assertEqual(sorted(x[0] for x in project.task_queue.iter_tasks()),
+                         ['new', 'taskid1', 'taskid2'])
+        scheduler._close_task_snapshot(project)
+
+    def test_20_stale_count(self):
+        scheduler, project = self.new_scheduler()
+        scheduler._try_dump_task_snapshots(force=True)
+        scheduler._close_task_snapshot(project)
+        self.taskdb.insert('test_project', 'other', {'url': 'other', 'status': 1})
+
+        scheduler, project = self.new_scheduler()
+        self.assertIn('other', project.task_queue)
+        self.assertEqual(len(project.task_queue), 4)
+        scheduler._close_task_snapshot(project)
+
+    def test_30_stale_updatetime(self):
+        scheduler, project = self.new_scheduler()
+        scheduler._try_dump_task_snapshots(force=True)
+        scheduler._close_task_snapshot(project)
+        # same count of active tasks, but not the same tasks
+        time.sleep(0.01)
+        self.taskdb.update('test_project', 'taskid0', status=2)
+        self.taskdb.insert('test_project', 'other', {'url': 'other', 'status': 1})
+
+        scheduler, project = self.new_scheduler()
+        self.assertEqual(sorted(x[0] for x in project.task_queue.iter_tasks()),
+                         ['other', 'taskid1', 'taskid2'])
+        scheduler._close_task_snapshot(project)
+
+    def test_40_shard_path(self):
+        ring = ShardRing(2)
+        shard_id = ring.shard_of('test_project')
+        scheduler, project = self.new_scheduler(ring, shard_id)
+        self.assertEqual(project.task_snapshot.path, os.path.join(
+            self.data_path, 'scheduler.test_project.%d-2.queue' % shard_id))
+        scheduler._close_task_snapshot(project)
+
+        ring = ShardRing(2, split_projects=['test_project'])
+        scheduler, project = self.new_scheduler(ring, shard_id)
+        self.assertIsNone(project.task_snapshot)
+        self.assertFalse(scheduler._use_task_snapshot('test_project'))
+
+
+class TestSplitProjectFinished(unittest.TestCase):
+
+    def test_on_finished_after_all_shards(self):
+        ring = ShardRing(2, split_projects=['test_project'])
+        primary = ring.shard_of('test_project')
+        other = [taskid for taskid in ('taskid%d' % i for i in range(100))
+                 if ring.shard_of('test_project', taskid) != primary][0]
+        _taskdb = taskdb.TaskDB(':memory:')
+        _taskdb.insert('test_project', other, {'url': 'url', 'status': 1})
+
+        scheduler = Scheduler(taskdb=_taskdb, projectdb=projectdb.ProjectDB(':memory:'),
+                              newtask_queue=Queue(10), status_queue=Queue(10),
+                              out_queue=Queue(10), data_path='./data/tests/')
+        scheduler.shard_ring = ring
+        scheduler.shard_id = primary
+        scheduler.FAIL_PAUSE_NUM = 2
+        scheduler._update_project(dict(TestTaskFilter.project_info))
+        project = scheduler.projects['test_project']
+        scheduler._check_task_loading()
+        self.assertEqual(len(project.task_queue), 0)
+        project.waiting_get_info = False
+        project._selected_tasks = True
+
+        def finished():
+            return [t for t in scheduler._postpone_request if t['taskid'] == 'on_finished']
+
+        for i in range(10):
+            scheduler._check_select()
+        self.assertEqual(finished(), [])
+        self.assertTrue(project._selected_tasks)
+
+        # task on the other shard is done
+        _taskdb.update('test_project', other, status=2)
+        for i in range(10):
+            scheduler._check_select()
+        self.assertEqual(len(finished()), 1)
+        self.assertFalse(project._selected_tasks)
+
+
+class TestTaskDeferred(unittest.TestCase):
+
+    def test_deferred_by_fetcher(self):
+        _taskdb = taskdb.TaskDB(':memory:')
+        _taskdb.insert('test_project', 'taskid', {
+            'url': 'http://a.com/', 'status': 1, 'schedule': {'retries': 3}})
+        scheduler = Scheduler(taskdb=_taskdb, projectdb=projectdb.ProjectDB(':memory:'),
+                              newtask_queue=Queue(10), status_queue=Queue(10),
+                              out_queue=Queue(10), data_path='./data/tests/')
+        scheduler._update_project(dict(TestTaskFilter.project_info))
+        project = scheduler.projects['test_project']
+        scheduler._check_task_loading()
+        project.task_queue.bucket.set(10)
+        self.assertEqual(project.task_queue.get(), 'taskid')
+
+        scheduler.on_task_status({
+            'taskid': 'taskid',
+            'project': 'test_project',
+            'url': 'http://a.com/',
+            'track': {
+                'fetch': {'ok': False, 'status_code': 599, 'deferred': True, 'backoff': 30},
+                'process': {'ok': True},
+            },
+        })
+        # put back after backoff, not a retry
+        self.assertIn('taskid', project.task_queue.time_queue)
+        self.assertGreater(project.task_queue.time_queue['taskid'].exetime, time.time() + 20)
+        task = _taskdb.get_task('test_project', 'taskid')
+        self.assertEqual(task['status'], _taskdb.ACTIVE)
+        self.assertNotIn('retried', task['schedule'])
+
+        # tasks of the host put during backoff are delayed
+        project.task_queue.put('other', 0, 0, url='http://a.com/other')
+        project.task_queue.put('b', 0, 0, url='http://b.com/')
+        self.assertIn('other', project.task_queue.time_queue)
+        self.assertEqual(project.task_queue.get(), 'b')
+
+
 if __name__ == '__main__':
     unittest.main()
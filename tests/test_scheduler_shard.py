@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import unittest
+
+import queue as Queue
+
+from pyspider.scheduler.shard import ShardRing, ShardRouter, merge_counter
+
+
+class TestShardRing(unittest.TestCase):
+
+    def test_consistent(self):
+        ring3 = ShardRing(3)
+        ring4 = ShardRing(4)
+        projects = ['project%d' % i for i in range(1000)]
+        shards = [ring3.shard_of(x) for x in projects]
+        self.assertEqual(set(shards), set([0, 1, 2]))
+        moved = sum(1 for x, shard in zip(projects, shards) if ring4.shard_of(x) != shard)
+        self.assertLess(moved, 400)
+
+    def test_split_project(self):
+        ring = ShardRing(3, ['big'])
+        self.assertEqual(set(ring.shard_of('big', 'taskid%d' % i) for i in range(100)),
+                         set([0, 1, 2]))
+        self.assertEqual(ring.shard_of('big', 'on_start'), ring.shard_of('big'))
+        self.assertEqual(ring.shards_of_project('big'), [0, 1, 2])
+        self.assertEqual(ring.shards_of_project('small'), [ring.shard_of('small')])
+
+
+class TestShardRouter(unittest.TestCase):
+
+    def test_route(self):
+        ring = ShardRing(2, ['big'])
+        newtask_queue, status_queue = Queue.Queue(), Queue.Queue()
+        shard_newtask = [Queue.Queue(), Queue.Queue()]
+        shard_status = [Queue.Queue(), Queue.Queue()]
+        router = ShardRouter(ring, newtask_queue, status_queue, Queue.Queue(),
+                             shard_newtask, shard_status, [])
+
+        tasks = [{'project': 'big', 'taskid': 'taskid%d' % i} for i in range(20)]
+        newtask_queue.put(tasks)
+        status_queue.put({'project': 'big', 'taskid': '_on_get_info'})
+        status_queue.put({'project': 'small', 'taskid': 'a'})
+        self.assertEqual(router.run_once(), 3)
+
+        for shard in (0, 1):
+            routed = shard_newtask[shard].get_nowait()
+            self.assertTrue(all(ring.shard_of('big', x['taskid']) == shard for x in routed))
+            self.assertEqual(shard_status[shard].get_nowait()['taskid'], '_on_get_info')
+        self.assertEqual(shard_status[ring.shard_of('small')].get_nowait()['taskid'], 'a')
+
+    def test_merge_counter(self):
+        merged = merge_counter([
+            {'a': {'success': 1, 'time': {'fetch_time': 1.0}}},
+            {'a': {'success': 2, 'time': {'fetch_time': 3.0}}, 'b': {'success': 1}},
+        ], avg=True)
+        self.assertEqual(merged['a']['time']['fetch_time'], 2.0)
+        self.assertEqual(merge_counter([{'a': {'success': 1}}, {'a': {'success': 2}}]),
+                         {'a': {'success': 3}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,108 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import time
+import shutil
 import unittest
+import queue as Queue
 
-import six
-from six.moves import queue as Queue
+from pyspider.scheduler.compact_task_queue import CompactTaskQueue
+from pyspider.scheduler.task_queue import (InQueueTask, PriorityTaskQueue, TaskQueue,
+                                           TimingWheelTaskQueue, host_of)
+from pyspider.scheduler.task_queue_snapshot import TaskQueueSnapshot
+from pyspider.scheduler.timing_wheel import TimingWheel
 
-from pyspider.scheduler.task_queue import InQueueTask, TaskQueue
+
+class TestPriorityTaskQueue(unittest.TestCase):
+
+    def check_index(self, queue):
+        self.assertEqual(len(queue.queue), len(queue.queue_dict))
+        for taskid, pos in queue.queue_index.items():
+            self.assertEqual(queue.queue[pos].taskid, taskid)
+
+    def test_merge_priority(self):
+        queue = PriorityTaskQueue()
+        for i in range(10):
+            queue.put(InQueueTask('t%d' % i, i))
+        queue.put(InQueueTask('t3', 100))
+        self.check_index(queue)
+        self.assertEqual(queue.top.taskid, 't3')
+        self.assertEqual(queue.get_nowait().taskid, 't3')
+        self.assertEqual(queue.get_nowait().taskid, 't9')
+
+    def test_merge_exetime(self):
+        queue = PriorityTaskQueue()
+        for i in range(10):
+            queue.put(InQueueTask('t%d' % i, 0, 1000 + i))
+        queue.put(InQueueTask('t7', 0, 10))
+        queue.put(InQueueTask('t2', 0, 5000))
+        self.check_index(queue)
+        self.assertEqual(queue.get_nowait().taskid, 't7')
+        self.assertEqual(queue.get_nowait().taskid, 't0')
+
+    def test_delete(self):
+        queue = PriorityTaskQueue()
+        for i in range(10):
+            queue.put(InQueueTask('t%d' % i, i))
+        del queue['t9']
+        del queue['t0']
+        del queue['t5']
+        self.check_index(queue)
+        self.assertEqual(queue.qsize(), 7)
+        self.assertEqual(len(queue.queue), 7)
+        self.assertEqual([queue.get_nowait().taskid for _ in range(7)],
+                         ['t8', 't7', 't6', 't4', 't3', 't2', 't1'])
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def test_expire(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=2, now=0)
+        for exetime in (0.5, 3, 5, 17, 100, 7):
+            wheel.put(InQueueTask('t%d' % exetime, 0, exetime))
+        wheel.put(InQueueTask('t17', 0, 2))
+        wheel.put(InQueueTask('t100', 0, 200))
+        del wheel['t5']
+        self.assertEqual(len(wheel), 5)
+        expired = []
+        for now in range(0, 110):
+            expired.extend((now, task.taskid) for task in wheel.pop_expired(now))
+        self.assertEqual(expired, [(1, 't0'), (3, 't17'), (4, 't3'), (8, 't7'), (101, 't100')])
+        self.assertEqual(len(wheel), 0)
+        self.assertFalse(wheel.location)
+
+    def test_jump(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=2, now=0)
+        for i in range(10):
+            wheel.put(InQueueTask('t%d' % i, 0, i * 100))
+        self.assertEqual(len(wheel.pop_expired(450)), 5)
+        self.assertEqual(len(wheel.pop_expired(899)), 4)
+        self.assertEqual(len(wheel.pop_expired(1000)), 1)
 
 
 class TestTaskQueue(unittest.TestCase):
-    """
-        TestTaskQueue
-    """
+    task_queue_cls = TaskQueue
+
+    def test_task_queue(self):
+        task_queue = self.task_queue_cls(rate=100000, burst=100000)
+        task_queue.processing_timeout = 0.1
+        task_queue.put('a3', 3, time.time() + 0.1)
+        task_queue.put('a1', 1)
+        task_queue.put('a2', 2)
+        self.assertEqual(task_queue.get(), 'a2')
+        time.sleep(0.12)
+        task_queue._check_time_queue()
+        self.assertEqual(task_queue.get(), 'a3')
+        self.assertEqual(task_queue.get(), 'a1')
+        time.sleep(0.12)
+        task_queue._check_processing()
+        self.assertEqual(task_queue.get(), 'a3')
+        self.assertEqual(task_queue.get(), 'a2')
+        self.assertTrue(task_queue.is_processing('a2'))
+        self.assertTrue(task_queue.done('a2'))
+        self.assertFalse(task_queue.is_processing('a2'))
+        self.assertNotIn('a2', task_queue)
 
     def test_task_queue_in_time_order(self):
         tq = TaskQueue(rate=300, burst=1000)
@@ -31,7 +120,7 @@ class TestTaskQueue(unittest.TestCase):
             q = queues[it.priority]  # type:Queue.Queue
             q.put(it)
             tasks[it.taskid] = it
-            # six.print_('put, taskid=', it.taskid, 'priority=', it.priority, 'exetime=', it.exetime)
+            # print('put, taskid=', it.taskid, 'priority=', it.priority, 'exetime=', it.exetime)
         for i in range(0, 100):
             task_id = tq.get()
             task = tasks[task_id]
@@ -39,22 +128,66 @@ class TestTaskQueue(unittest.TestCase):
             expect_task = q.get()
             self.assertEqual(task_id, expect_task.taskid)
             self.assertEqual(task.priority, int(9 - i // 10))
-            # six.print_('get, taskid=', task.taskid, 'priority=', task.priority, 'exetime=', task.exetime)
+            # print('get, taskid=', task.taskid, 'priority=', task.priority, 'exetime=', task.exetime)
 
         self.assertEqual(tq.size(), 100)
         self.assertEqual(tq.priority_queue.qsize(), 0)
         self.assertEqual(tq.processing.qsize(), 100)
-        for q in six.itervalues(queues):  # type:Queue.Queue
+        for q in queues.values():  # type:Queue.Queue
             self.assertEqual(q.qsize(), 0)
-        pass
 
-    pass
+    def test_merge_and_delete(self):
+        task_queue = self.task_queue_cls(rate=100000, burst=100000)
+        taskids = ['%032x' % i for i in range(10)] + ['taskid_a', 'taskid_b']
+        for i, taskid in enumerate(taskids):
+            task_queue.put(taskid, i % 3)
+        task_queue.put('taskid_b', 0, time.time() + 100)
+        task_queue.put(taskids[0], 5)
+        self.assertEqual(len(task_queue), 12)
+        self.assertTrue(task_queue.delete(taskids[1]))
+        self.assertFalse(task_queue.delete(taskids[1]))
+        self.assertEqual(task_queue.get(), taskids[0])
+        task_queue.put(taskids[0], 10)
+        self.assertTrue(task_queue.is_processing(taskids[0]))
+        got = [task_queue.get() for _ in range(11)]
+        self.assertEqual(got[:4], [taskids[2], taskids[5], taskids[8], 'taskid_b'])
+        self.assertIsNone(got[-1])
+        self.assertEqual(len(task_queue), 11)
+        self.assertTrue(task_queue.done('taskid_a'))
+        self.assertNotIn('taskid_a', task_queue)
+
+    def test_bulk_load(self):
+        task_queue = self.task_queue_cls(rate=100000, burst=100000)
+        for i in range(10):
+            task_queue.put('%032x' % i, i % 2, time.time() + 100 if i == 3 else 0)
+        task_queue.get()
+        tasks = list(task_queue.iter_tasks())
+        self.assertEqual(len(tasks), 10)
+
+        loaded = self.task_queue_cls(rate=100000, burst=100000)
+        loaded.bulk_load(tasks)
+        self.assertEqual(len(loaded), 10)
+        self.assertEqual([loaded.get() for _ in range(10)],
+                         ['%032x' % i for i in (1, 5, 7, 9, 0, 2, 4, 6, 8)] + [None])
+
+    def test_backoff_without_host_limit(self):
+        task_queue = self.task_queue_cls(rate=100000, burst=100000)
+        task_queue.backoff('http://a.com/0', 0.2)
+        # tasks of the host put during backoff are delayed until then
+        task_queue.put('a0', 0, url='http://a.com/0')
+        task_queue.put('b0', 0, url='http://b.com/0')
+        self.assertEqual([task_queue.get() for _ in range(2)], ['b0', None])
+        time.sleep(0.25)
+        task_queue.check_update()
+        self.assertEqual(task_queue.get(), 'a0')
+        task_queue.put('a1', 0, url='http://a.com/1')
+        self.assertEqual(task_queue.get(), 'a1')
 
 
 class TestTimeQueue(unittest.TestCase):
     def test_time_queue(self):
 
-        # six.print_('Test time queue order by time only')
+        # print('Test time queue order by time only')
 
         tq = TaskQueue(rate=300, burst=1000)
 
@@ -66,7 +199,7 @@ class TestTimeQueue(unittest.TestCase):
             it = InQueueTask(str(i), priority=int(i // 10), exetime=time.time() + (i + 1) * interval)
             tq.put(it.taskid, it.priority, it.exetime)
             fifo_queue.put(it)
-            # six.print_('put, taskid=', it.taskid, 'priority=', it.priority, 'exetime=', it.exetime)
+            # print('put, taskid=', it.taskid, 'priority=', it.priority, 'exetime=', it.exetime)
 
         self.assertEqual(tq.priority_queue.qsize(), 0)
         self.assertEqual(tq.processing.qsize(), 0)
@@ -76,7 +209,7 @@ class TestTimeQueue(unittest.TestCase):
             t1 = fifo_queue.get()
             t2 = tq.time_queue.get()
             self.assertEqual(t1.taskid, t2.taskid)
-            # six.print_('get, taskid=', t2.taskid, 'priority=', t2.priority, 'exetime=', t2.exetime)
+            # print('get, taskid=', t2.taskid, 'priority=', t2.priority, 'exetime=', t2.exetime)
         self.assertEqual(tq.priority_queue.qsize(), 0)
         self.assertEqual(tq.processing.qsize(), 0)
         self.assertEqual(tq.time_queue.qsize(), 0)
@@ -119,5 +252,152 @@ class TestTimeQueue(unittest.TestCase):
     pass
 
 
+class TestHostLimit(unittest.TestCase):
+
+    def test_host_of(self):
+        self.assertEqual(host_of('http://www.example.com:8080/a'), 'www.example.com')
+        self.assertEqual(host_of('http://a.b.example.co.uk/', 'domain'), 'example.co.uk')
+        self.assertEqual(host_of('http://a.b.example.com/', 'domain'), 'example.com')
+        self.assertEqual(host_of('http://127.0.0.1/', 'domain'), '127.0.0.1')
+
+    def test_round_robin(self):
+        task_queue = TaskQueue(rate=100000, burst=100000)
+        task_queue.set_host_limit(concurrency=2)
+        for i in range(6):
+            task_queue.put('a%d' % i, 0, url='http://a.com/%d' % i)
+        task_queue.put('b0', 0, url='http://b.com/0')
+        task_queue.put('c0', 0)
+        got = [task_queue.get() for _ in range(6)]
+        self.assertEqual(got, ['a0', 'b0', 'c0', 'a1', None, None])
+        self.assertEqual(task_queue.hosts.hosts()['a.com'], (4, 2))
+
+        self.assertTrue(task_queue.done('a0'))
+        self.assertEqual(task_queue.get(), 'a2')
+        self.assertIsNone(task_queue.get())
+        self.assertTrue(task_queue.delete('a5'))
+        self.assertTrue(task_queue.delete('a1'))
+        self.assertEqual(task_queue.get(), 'a3')
+        self.assertEqual(len(task_queue), 5)
+
+    def test_rate(self):
+        task_queue = TaskQueue(rate=100000, burst=100000)
+        task_queue.set_host_limit(rate=10, burst=1)
+        for i in range(3):
+            task_queue.put('a%d' % i, 0, url='http://a.com/%d' % i)
+            task_queue.put('b%d' % i, 0, url='http://b.com/%d' % i)
+        self.assertEqual([task_queue.get() for _ in range(3)], ['a0', 'b0', None])
+        time.sleep(0.25)
+        self.assertEqual([task_queue.get() for _ in range(3)], ['a1', 'b1', None])
+
+    def test_backoff(self):
+        task_queue = TaskQueue(rate=100000, burst=100000)
+        task_queue.set_host_limit(concurrency=10)
+        for i in range(2):
+            task_queue.put('a%d' % i, 0, url='http://a.com/%d' % i)
+            task_queue.put('b%d' % i, 0, url='http://b.com/%d' % i)
+        task_queue.backoff('http://a.com/0', 0.2)
+        self.assertEqual([task_queue.get() for _ in range(3)], ['b0', 'b1', None])
+        time.sleep(0.25)
+        self.assertEqual([task_queue.get() for _ in range(3)], ['a0', 'a1', None])
+
+
+class TestCompactTaskQueue(TestTaskQueue):
+    task_queue_cls = CompactTaskQueue
+
+
+class TestTimingWheelTaskQueue(TestTaskQueue):
+    class task_queue_cls(TimingWheelTaskQueue):
+        tick = 0.01
+
+
+class TestTaskQueueSnapshot(unittest.TestCase):
+    data_path = './data/tests/snapshot'
+
+    def setUp(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        os.makedirs(self.data_path)
+        self.path = os.path.join(self.data_path, 'scheduler.test.queue')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+
+    def test_10_dump_and_load(self):
+        tq = TaskQueue(rate=100000, burst=100000)
+        tq.put('a1', 1, 0)
+        tq.put('a2', 2, 0)
+        tq.put(u'中文', 3, 0)
+        tq.put('later', 1, time.time() + 100)
+        self.assertEqual(tq.get(), u'中文')
+        snapshot = TaskQueueSnapshot(self.path)
+        self.assertTrue(snapshot.dump(tq))
+        self.assertEqual(snapshot.synced, snapshot.created)
+
+        tq2 = TaskQueue(rate=100000, burst=100000)
+        snapshot2 = TaskQueueSnapshot(self.path)
+        self.assertTrue(snapshot2.load(tq2))
+        self.assertEqual(len(tq2), 4)
+        self.assertEqual(snapshot2.synced, snapshot.created)
+        self.assertIn('later', tq2.time_queue)
+        # task in processing is pending again
+        self.assertEqual([tq2.get() for i in range(4)], [u'中文', 'a2', 'a1', None])
+        snapshot.close()
+
+    def test_20_replay_log(self):
+        tq = TaskQueue(rate=100000, burst=100000)
+        tq.put('a1', 1, 0)
+        snapshot = TaskQueueSnapshot(self.path)
+        snapshot.dump(tq)
+        tq.journal = snapshot
+        tq.put('a2', 2, 0)
+        tq.put('a3', 3, 0)
+        tq.delete('a1')
+        snapshot.synced = 0
+        snapshot.flush()
+        synced = snapshot.synced
+        self.assertGreater(synced, snapshot.created)
+        tq.put('a4', 4, 0)
+        snapshot.close()
+
+        tq2 = TaskQueue(rate=100000, burst=100000)
+        snapshot2 = TaskQueueSnapshot(self.path)
+        self.assertTrue(snapshot2.load(tq2))
+        self.assertEqual(sorted(x[0] for x in tq2.iter_tasks()), ['a2', 'a3', 'a4'])
+        self.assertEqual(snapshot2.synced, synced)
+
+        # log is truncated by next dump
+        snapshot2.dump(tq2)
+        self.assertEqual(os.path.getsize(snapshot2.log_path), 0)
+        snapshot2.close()
+
+    def test_30_mark_interval(self):
+        snapshot = TaskQueueSnapshot(self.path)
+        snapshot.dump(TaskQueue())
+        size = os.path.getsize(snapshot.log_path)
+        snapshot.flush()
+        self.assertEqual(os.path.getsize(snapshot.log_path), size)
+        snapshot.synced -= snapshot.MARK_INTERVAL
+        snapshot.flush()
+        self.assertEqual(os.path.getsize(snapshot.log_path), size + snapshot.LOG_RECORD.size)
+        snapshot.close()
+
+    def test_40_missing_or_broken(self):
+        snapshot = TaskQueueSnapshot(self.path)
+        self.assertFalse(snapshot.load(TaskQueue()))
+
+        tq = TaskQueue(rate=100000, burst=100000)
+        tq.put('a1', 1, 0)
+        snapshot.dump(tq)
+        snapshot.close()
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        with open(self.path, 'wb') as fp:
+            fp.write(data[:-1])
+        self.assertFalse(TaskQueueSnapshot(self.path).load(TaskQueue()))
+
+        snapshot.remove_files()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(snapshot.log_path))
+
+
 if __name__ == '__main__':
     unittest.main()